@@ -0,0 +1,2 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
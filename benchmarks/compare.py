@@ -0,0 +1,78 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# Compare two sets of benchmark results produced by benchmarks.run.
+
+import argparse
+import json
+import sys
+
+import tabulate
+
+
+def compare(baseline, current, statistic="median"):
+    """
+    Compare the scenarios common to two result sets.
+
+    :param baseline: The baseline results dictionary.
+    :param current: The current results dictionary.
+    :param statistic: The statistic to compare. (Default value = "median")
+    :returns: A list of (scenario, baseline, current, ratio) tuples, where
+              a ratio above 1.0 is a slowdown.
+    """
+    rows = []
+    for name, result in current["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        before = baseline["scenarios"][name][statistic]
+        after = result[statistic]
+        rows.append((name, before, after, after / before if before else None))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument("baseline", help="JSON results of the baseline run")
+    parser.add_argument("current", help="JSON results of the current run")
+    parser.add_argument(
+        "--statistic", choices=["min", "median", "mean", "max"], default="median"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="Exit with an error if any ratio exceeds this value",
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as in_:
+        baseline = json.load(in_)
+    with open(args.current) as in_:
+        current = json.load(in_)
+
+    rows = compare(baseline, current, args.statistic)
+    print(
+        "%s (%s) -> %s (%s)"
+        % (
+            (baseline.get("commit") or "?")[:10],
+            baseline.get("database"),
+            (current.get("commit") or "?")[:10],
+            current.get("database"),
+        )
+    )
+    print(
+        tabulate.tabulate(
+            rows,
+            headers=["Scenario", "Baseline (s)", "Current (s)", "Ratio"],
+            floatfmt=".4f",
+        )
+    )
+
+    if args.threshold is not None:
+        if any(ratio is not None and ratio > args.threshold for *_, ratio in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# Deterministic generator for synthetic timetrack2 databases.
+#
+# The same arguments (and seed) always produce the same database, so results
+# from different commits can be compared.  Timestamps are laid out in a local
+# timezone over a configurable span of days, which by default is long enough
+# to cross both DST transitions twice.
+
+import argparse
+from datetime import date, datetime, timedelta
+import logging
+import os
+import random
+import sys
+
+from dateutil import tz
+
+from tt.orm import Task, TaskTree, Timer
+from tt.sql import connect, transaction
+
+log = logging.getLogger("benchmarks.generate")
+
+SIZES = {"10k": 10000, "100k": 100000, "1m": 1000000, "10m": 10000000}
+DEFAULT_SEED = 20180214
+DEFAULT_TASKS = 25
+DEFAULT_FANOUT = 5
+DEFAULT_DAYS = 730
+DEFAULT_TZ = "America/New_York"
+BATCH_SIZE = 10000
+
+WORKDAY_START = timedelta(hours=8)
+WORKDAY_LENGTH = timedelta(hours=10)
+
+
+def task_names(count):
+    """
+    Generate the names of the synthetic tasks.
+
+    :param count: The number of tasks.
+    :returns: A list of task names.
+    """
+    return ["task-%04d" % i for i in range(count)]
+
+
+def task_tree(count, fanout=DEFAULT_FANOUT):
+    """
+    Generate the closure table rows of the synthetic task hierarchy.
+
+    Every task is its own ancestor at a depth of 0.  The tasks are grouped
+    in runs of ``fanout``, the first task of each run being the top-level
+    parent of the others, so that rolling up to level 1 folds the time of
+    the subtasks into their parents.
+
+    :param count: The number of tasks.
+    :param fanout: The number of tasks in each group, parent included.
+    :returns: A list of dictionaries, one per task_tree row, using the
+              1-based ids of the tasks.
+    """
+    rows = []
+    for i in range(count):
+        parent = i - i % fanout
+        if parent == i:
+            rows.append(_tree_row(i, i, 0, 1))
+        else:
+            rows.append(_tree_row(parent, i, 1, 1))
+            rows.append(_tree_row(i, i, 0, 2))
+    return rows
+
+
+def _tree_row(ancestor, descendant, depth, level):
+    return {
+        "ancestor_id": ancestor + 1,
+        "descendant_id": descendant + 1,
+        "depth": depth,
+        "level": level,
+    }
+
+
+def timers(count, tasks, days, end, seed=DEFAULT_SEED, tzname=DEFAULT_TZ):
+    """
+    Generate synthetic timers.
+
+    The timers are distributed evenly over the days preceding ``end``, each
+    day's share being split into back-to-back intervals of random length
+    within a local working day.  No timers overlap, and all are stopped.
+
+    :param count: The total number of timers.
+    :param tasks: The number of tasks to distribute the timers across.
+    :param days: The number of days to spread the timers over.
+    :param end: The datetime.date after the last generated day.
+    :param seed: Seed for the random number generator.
+    :param tzname: Name of the timezone used for laying out the days.
+    :yields: Tuples of (task index, start, stop) with timezone-aware UTC
+             datetimes, ordered by start.
+    """
+    rng = random.Random(seed)
+    zone = tz.gettz(tzname)
+    first = end - timedelta(days=days)
+
+    per_day, remainder = divmod(count, days)
+    for day in range(days):
+        n = per_day + (1 if day < remainder else 0)
+        if not n:
+            continue
+
+        current = first + timedelta(days=day)
+        midnight = datetime(current.year, current.month, current.day, tzinfo=zone)
+        slot = WORKDAY_LENGTH.total_seconds() / n
+
+        offset = WORKDAY_START.total_seconds()
+        for _ in range(n):
+            duration = max(1, int(slot * rng.uniform(0.5, 1.0)))
+            start = midnight + timedelta(seconds=int(offset))
+            stop = start + timedelta(seconds=duration)
+            yield rng.randrange(tasks), tz_utc(start), tz_utc(stop)
+            offset += slot
+
+
+def tz_utc(dt):
+    """Convert a timezone-aware datetime to UTC."""
+    return dt.astimezone(tz.tzutc())
+
+
+def generate(
+    db_file,
+    count,
+    tasks=DEFAULT_TASKS,
+    days=DEFAULT_DAYS,
+    end=None,
+    seed=DEFAULT_SEED,
+    tzname=DEFAULT_TZ,
+    fanout=DEFAULT_FANOUT,
+):
+    """
+    Create a synthetic database.
+
+    :param db_file: Path to the database file, which must not exist.
+    :param count: The total number of timers.
+    :param tasks: The number of tasks. (Default value = DEFAULT_TASKS)
+    :param days: The number of days to cover. (Default value = DEFAULT_DAYS)
+    :param end: The datetime.date after the last generated day.
+                (Default value = today)
+    :param seed: Seed for the random number generator.
+    :param tzname: Name of the timezone used for laying out the days.
+    :param fanout: The number of tasks in each group of the task hierarchy.
+                   (Default value = DEFAULT_FANOUT)
+    """
+    if os.path.exists(db_file):
+        raise FileExistsError(db_file)
+
+    end = end or date.today()
+
+    connect(db_url="sqlite:///%s" % db_file)
+
+    names = task_names(tasks)
+    with transaction() as session:
+        session.execute(
+            Task.__table__.insert(),
+            [{"id": i + 1, "name": name} for i, name in enumerate(names)],
+        )
+        session.execute(TaskTree.__table__.insert(), task_tree(tasks, fanout))
+
+    batch = []
+    for task, start, stop in timers(count, tasks, days, end, seed, tzname):
+        batch.append({"task_id": task + 1, "start": start, "stop": stop})
+        if len(batch) == BATCH_SIZE:
+            _insert(batch)
+            batch = []
+    if batch:
+        _insert(batch)
+
+
+def _insert(batch):
+    with transaction() as session:
+        session.execute(Timer.__table__.insert(), batch)
+    log.info("inserted %d timers", len(batch))
+
+
+def _size(value):
+    try:
+        return SIZES[value.lower()]
+    except KeyError:
+        return int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic database")
+    parser.add_argument("db_file", help="Path of the database to create")
+    parser.add_argument(
+        "--timers",
+        type=_size,
+        default="10k",
+        help="Number of timers, or one of %s" % ", ".join(SIZES),
+    )
+    parser.add_argument("--tasks", type=int, default=DEFAULT_TASKS)
+    parser.add_argument(
+        "--fanout",
+        type=int,
+        default=DEFAULT_FANOUT,
+        help="Number of tasks in each group of the task hierarchy",
+    )
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS)
+    parser.add_argument(
+        "--end",
+        type=lambda s: datetime.strptime(s, "%Y-%m-%d").date(),
+        help="Day after the last generated day, as YYYY-MM-DD (Default today)",
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--tz", default=DEFAULT_TZ, help="Timezone name")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    generate(
+        args.db_file,
+        args.timers,
+        tasks=args.tasks,
+        days=args.days,
+        end=args.end,
+        seed=args.seed,
+        tzname=args.tz,
+        fanout=args.fanout,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# Timed scenarios for the tt command line interface.
+#
+# Each scenario runs the CLI against a copy of a generated database and the
+# results are written as JSON so that runs from different commits can be
+# compared with benchmarks.compare.
+
+import argparse
+import contextlib
+from datetime import datetime, timedelta, timezone
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import iso8601
+
+import tt
+import tt.cli
+import tt.datetime
+
+log = logging.getLogger("benchmarks.run")
+
+DB_NAME = "timetrack2.db"
+IMPORT_SAMPLE = 1000
+
+SCENARIOS = [
+    ("start", ["start", "task-0000"]),
+    ("stop", ["stop"]),
+    ("status", ["status"]),
+    ("summary-year", ["summary", "--begin", "{year}", "--end", "{now}"]),
+    (
+        "summary-rollup",
+        ["summary", "--begin", "{year}", "--end", "{now}", "--rollup", "1"],
+    ),
+    ("records-month", ["records", "--begin", "{month}", "--end", "{now}"]),
+    ("report", ["report", "--month", "{month_number}"]),
+    ("export", ["export", "{workdir}/export.json"]),
+    ("import", ["import", "{sample}"]),
+]
+"""Scenario names and the CLI arguments used to run them."""
+
+SETUP = {"stop": ["start", "task-0000", "1 minute ago"]}
+"""Commands run, untimed, before a scenario."""
+
+EMPTY = {"import"}
+"""Scenarios which run against an empty database."""
+
+AFTER_DATA = timedelta(minutes=1)
+"""How long after the last record the clock is frozen by default."""
+
+
+def run_inproc(workdir, argv, now=None):
+    """
+    Run the CLI in the current process.
+
+    :param workdir: The application data directory holding the database.
+    :param argv: The command line arguments.
+    :param now: Optional instant to freeze the clock used for elapsed times.
+    :returns: The elapsed wall-clock time in seconds.
+    """
+    tt.cli.APP_DATA_DIR = workdir
+    with contextlib.redirect_stdout(io.StringIO()), _frozen(now):
+        t0 = time.perf_counter()
+        tt.cli.main(argv)
+        return time.perf_counter() - t0
+
+
+def _frozen(now):
+    return tt.datetime.frozen(now) if now else contextlib.ExitStack()
+
+
+def run_subprocess(workdir, argv, now=None):
+    """
+    Run the CLI in a new interpreter, including the startup cost.
+
+    :param workdir: The home directory whose ``.timetrack2`` holds the
+                    database.
+    :param argv: The command line arguments.
+    :param now: Unused, the clock can not be frozen in a subprocess.
+    :returns: The elapsed wall-clock time in seconds.
+    """
+    env = dict(os.environ, HOME=os.path.dirname(workdir))
+    cmd = [sys.executable, "-m", "tt.cli"] + argv
+    t0 = time.perf_counter()
+    subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - t0
+
+
+def _prepare(db_file, root, empty=False):
+    """Copy the database into a fresh application data directory."""
+    workdir = os.path.join(root, ".timetrack2")
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    if not empty:
+        shutil.copyfile(db_file, os.path.join(workdir, DB_NAME))
+    return workdir
+
+
+def _sample(db_file, root):
+    """Export a small slice of records to use for the import scenario."""
+    workdir = _prepare(db_file, root)
+    sample = os.path.join(root, "sample.json")
+    export = os.path.join(workdir, "export.json")
+    run_inproc(workdir, ["export", export])
+
+    with open(export) as in_, open(sample, "w") as out:
+        for i, line in enumerate(in_):
+            if i >= IMPORT_SAMPLE:
+                break
+            out.write(line)
+    return sample
+
+
+def run(db_file, scenarios=None, repeat=5, mode="inproc", now=None):
+    """
+    Run the benchmark scenarios.
+
+    :param db_file: The generated database to run against.
+    :param scenarios: Names of the scenarios to run. (Default value = all)
+    :param repeat: Number of timed runs per scenario.
+    :param mode: Either "inproc" or "subprocess".
+    :param now: The instant the scenarios run at, and their time ranges
+                end at.  The clock is frozen at it for "inproc" runs, so
+                that ``status`` and ``report`` cover the same records.
+                (Default value = just after the last record)
+    :returns: A dictionary of results suitable for serializing to JSON.
+    """
+    runner = run_subprocess if mode == "subprocess" else run_inproc
+    selected = [s for s in SCENARIOS if not scenarios or s[0] in scenarios]
+    now = now or _last_stop(db_file) + AFTER_DATA
+    fields = _range_fields(now)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        sample = _sample(db_file, root)
+
+        for name, template in selected:
+            timings = []
+            for _ in range(repeat):
+                workdir = _prepare(db_file, root, empty=name in EMPTY)
+                if name in SETUP:
+                    run_inproc(workdir, SETUP[name], now=now)
+                argv = [
+                    a.format(workdir=workdir, sample=sample, **fields) for a in template
+                ]
+                timings.append(runner(workdir, argv, now=now))
+
+            results[name] = {
+                "min": min(timings),
+                "median": statistics.median(timings),
+                "mean": statistics.mean(timings),
+                "max": max(timings),
+                "runs": timings,
+            }
+            log.info("%s: %.4fs", name, results[name]["median"])
+
+    return {
+        "version": tt.__VERSION__,
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "database": os.path.basename(db_file),
+        "database_size": os.path.getsize(db_file),
+        "now": now.isoformat(),
+        "mode": mode,
+        "repeat": repeat,
+        "scenarios": results,
+    }
+
+
+def _last_stop(db_file):
+    """Return the stop time of the last record of a generated database."""
+    connection = sqlite3.connect(db_file)
+    try:
+        (stop,) = connection.execute("SELECT max(stop) FROM timer").fetchone()
+    finally:
+        connection.close()
+    return datetime.fromtimestamp(stop, timezone.utc)
+
+
+def _range_fields(now):
+    """The fields of the scenario arguments derived from their instant."""
+    local = now.astimezone(tt.datetime.tz_local())
+    return {
+        "now": local.isoformat(),
+        "year": tt.datetime.start_of_year(local).isoformat(),
+        "month": tt.datetime.start_of_month(local).isoformat(),
+        "month_number": str(local.month),
+    }
+
+
+def _commit():
+    """Return the current git commit, or None outside a checkout."""
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.decode().strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the tt benchmarks")
+    parser.add_argument("db_file", help="Generated database to benchmark")
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=[name for name, _ in SCENARIOS],
+        help="Scenario to run, may be repeated (Default all)",
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--mode", choices=["inproc", "subprocess"], default="inproc")
+    parser.add_argument(
+        "--now",
+        type=iso8601.parse_date,
+        help="ISO 8601 instant the scenarios run at (Default just after the "
+        "last record)",
+    )
+    parser.add_argument("-o", "--output", help="Write JSON results to this file")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    results = run(
+        os.path.abspath(args.db_file),
+        scenarios=args.scenario,
+        repeat=args.repeat,
+        mode=args.mode,
+        now=args.now,
+    )
+
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(results, out, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
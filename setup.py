@@ -7,9 +7,9 @@ import tt
 install_requires = [
     'dateparser',
     'iso8601',
+    'numpy',
     'pandas',
     'SQLALchemy',
-    'SQLAlchemy-Utc',
     'tabulate',
 ]
 
@@ -24,7 +24,7 @@ tests_require = [
 ]
 
 console_scripts = [
-    'tt = tt.cli:main',
+    'tt = tt.__main__:main',
 ]
 
 setup(name='timetrack2',
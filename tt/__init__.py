@@ -1,4 +1,11 @@
+import time
+
 __VERSION__ = "1.0.8"
 __AUTHOR__ = "Anthony Oteri"
 __AUTHOR_EMAIL__ = "anthony.oteri@gmail.com"
 __DESCRIPTION__ = "A timetracking utility"
+
+APP_DATA_DIR = "~/.timetrack2"
+DB_FILE = "timetrack2.db"
+
+_IMPORT_STARTED = time.perf_counter()
@@ -0,0 +1,37 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# The console entry point.  The prompt command is answered from the state
+# file without importing the rest of the application when possible.
+
+import os
+import sys
+
+import tt
+import tt.state
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv == ["prompt"]:
+        data_dir = os.path.expanduser(tt.APP_DATA_DIR)
+        state = tt.state.load(
+            os.path.join(data_dir, tt.state.STATE_FILE),
+            os.path.join(data_dir, tt.DB_FILE),
+        )
+        if state is not None:
+            print(tt.state.format_prompt(state))
+            return 0
+
+    from tt import cli
+
+    return cli.main(argv)
+
+
+def __init__():
+    if __name__ == "__main__":
+        sys.exit(main())
+
+
+__init__()
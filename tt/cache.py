@@ -0,0 +1,117 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+import collections
+import contextlib
+import logging
+import os
+import pickle
+import tempfile
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 128
+
+
+class ReportCache(object):
+    """A persistent, size-bounded cache of report results.
+
+    Each entry is stored along with the data version it was computed from,
+    and is only returned while that version is current.  When the cache is
+    full, the least recently used entry is evicted.  Changes are kept in
+    memory until flush() is called.
+
+    :param filename: The file where to persist the cache, or None to only
+                     keep it in memory.
+    :param size: The maximum number of entries. (Default value = DEFAULT_SIZE)
+    """
+
+    def __init__(self, filename=None, size=DEFAULT_SIZE):
+        self.filename = filename
+        self.size = size
+        self._entries = None
+        self._dirty = False
+
+    @property
+    def entries(self):
+        """The ordered mapping of key to (version, value), oldest first."""
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        if self.filename is None:
+            return collections.OrderedDict()
+        try:
+            with open(self.filename, "rb") as in_:
+                entries = pickle.load(in_)
+        except FileNotFoundError:
+            return collections.OrderedDict()
+        except Exception as err:
+            log.warning("Discarding unreadable cache %s: %s", self.filename, err)
+            return collections.OrderedDict()
+
+        if not isinstance(entries, collections.OrderedDict):
+            return collections.OrderedDict()
+        return entries
+
+    def get(self, key, version):
+        """
+        Look up a cached value.
+
+        :param key: A hashable key identifying the result.
+        :param version: The current data version.
+        :returns: The cached value, or None if there is no value cached for
+                  the current version.
+        """
+        try:
+            cached_version, value = self.entries[key]
+        except KeyError:
+            return None
+
+        if cached_version != version:
+            del self.entries[key]
+            self._dirty = True
+            return None
+
+        # The order of use alone is not worth rewriting the file for, it is
+        # persisted along with the next change.
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, version, value):
+        """
+        Store a value in the cache, evicting the least recently used entries
+        if the cache is full.
+
+        :param key: A hashable key identifying the result.
+        :param version: The data version the value was computed from.
+        :param value: The value, which must be picklable.
+        """
+        self.entries[key] = (version, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        self._dirty = True
+
+    def clear(self):
+        """Remove all entries."""
+        self._entries = collections.OrderedDict()
+        self._dirty = True
+
+    def flush(self):
+        """Atomically write the cache to its file, if it has changed."""
+        if not self._dirty or self.filename is None:
+            return
+
+        directory = os.path.dirname(self.filename) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".cache-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                pickle.dump(self.entries, out, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.filename)
+        except Exception:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+        self._dirty = False
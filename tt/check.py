@@ -0,0 +1,48 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# Consistency checks over the whole timeline of timers.
+
+import collections
+
+Problem = collections.namedtuple("Problem", ["kind", "start", "stop", "timers"])
+"""An inconsistency between timers, with the UTC time span it covers and the
+ids of the timers involved."""
+
+KINDS = ("overlap", "negative", "gap")
+"""The kinds of problems, from the most to the least severe."""
+
+
+def sweep(rows, now, gaps=False):
+    """
+    Find the problems in a stream of timers, in a single pass.
+
+    The timers must be ordered by start time.  Only the timer ending last so
+    far is remembered, against which each timer is checked for an overlap
+    or a gap, so the pass takes linear time and constant memory.
+
+    :param rows: An iterable of tt.reader.TimerRow in chronological order.
+    :param now: The time a running timer is considered to end.
+    :param gaps: If True, also report the time between timers.
+                 (Default value = False)
+    :yields: A Problem for each overlap between timers, each timer stopping
+             before it starts, and, if requested, each gap.
+    """
+    last = None
+    last_end = None
+    for row in rows:
+        if row.stop is not None and row.stop < row.start:
+            yield Problem("negative", row.start, row.stop, (row.id,))
+            continue
+
+        end = now if row.stop is None else row.stop
+        if last is not None:
+            if row.start < last_end:
+                yield Problem(
+                    "overlap", row.start, min(end, last_end), (last.id, row.id)
+                )
+            elif gaps and row.start > last_end:
+                yield Problem("gap", last_end, row.start, (last.id, row.id))
+
+        if last is None or end > last_end:
+            last, last_end = row, end
@@ -7,24 +7,37 @@ import contextlib
 from datetime import datetime, timedelta
 import logging
 import os
+import shlex
 import sys
+import time
+
+try:
+    import readline
+except ImportError:  # pragma: no cover
+    readline = None
 
 import dateparser
 import tabulate
 
 import tt
+from tt.cache import ReportCache
 from tt.datatable import Datatable
+import tt.datatable
 from tt.datetime import (
     local_time,
     start_of_day,
     start_of_week,
     start_of_month,
     start_of_year,
-    tz_local,
 )
-from tt.exc import BadRequest, ParseError
+from tt.exc import BadRequest, ParseError, ValidationError
 import tt.io
-from tt.sql import connect
+import tt.pivot
+import tt.profile
+import tt.reader
+from tt.sql import connect, transaction
+import tt.state
+import tt.stats
 from tt.service import TaskService, TimerService, ReportingService
 
 log = logging.getLogger("tt.cli")
@@ -32,18 +45,64 @@ log = logging.getLogger("tt.cli")
 DEFAULT_REPORT_START = "midnight"
 DEFAULT_REPORT_END = "tomorrow at midnight"
 DATEPARSER_SETTINGS = {"TO_TIMEZONE": "UTC", "RETURN_AS_TIMEZONE_AWARE": True}
+DEFAULT_LOG_LIMIT = 10
+DEFAULT_SEARCH_LIMIT = 20
+DEFAULT_WORKING_HOURS = "09:00-17:00"
 DEFAULT_TABLE_FORMAT = "fancy_grid"
 DEFAULT_TABLE_HEADER_FORMATTER = str.capitalize
-APP_DATA_DIR = "~/.timetrack2"
+APP_DATA_DIR = tt.APP_DATA_DIR
+REPORT_CACHE_FILE = "reports.cache"
+
+_shell_report_cache = None
+"""The report cache kept for the duration of the shell, if running."""
 
 tabulate.PRESERVE_WHITESPACE = True
 
+IMPORT_TIME = time.perf_counter() - tt._IMPORT_STARTED
 
-def main(argv=None):
-    parser = argparse.ArgumentParser(description=tt.__DESCRIPTION__)
+
+def build_parser(parser_class=None):
+    """
+    Build the command line parser.
+
+    :param parser_class: The class used for the parser and the parsers of
+                         each command. (Default value = argparse.ArgumentParser)
+    :returns: The parser.
+    """
+    parser_class = parser_class or argparse.ArgumentParser
+    parser = parser_class(description=tt.__DESCRIPTION__)
 
     parser.add_argument("-v", "--verbose", action="store_true")
     parser.add_argument("-V", "--version", action="store_true")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not use cached report results"
+    )
+    instrumentation = parser.add_mutually_exclusive_group()
+    instrumentation.add_argument(
+        "--profile",
+        choices=tt.profile.PROFILERS,
+        help="Profile the command, --profile alone uses %s"
+        % tt.profile.DEFAULT_PROFILER,
+    )
+    instrumentation.add_argument(
+        "--stats",
+        action="store_true",
+        help="Show SQL statement counts and timings for the command",
+    )
+    parser.add_argument(
+        "--profile-output",
+        help="Write cProfile statistics to this .prof file, with --profile=cprofile",
+    )
+    parser.add_argument(
+        "--profile-limit",
+        type=int,
+        default=tt.profile.DEFAULT_LIMIT,
+        help="Number of functions to show in the profile summary",
+    )
+    parser.add_argument(
+        "--stats-format", choices=tt.stats.FORMATS, default=tt.stats.FORMATS[0]
+    )
+    parser.add_argument("--stats-output", help="Write the statistics to this file")
 
     subparsers = parser.add_subparsers()
 
@@ -52,6 +111,7 @@ def main(argv=None):
     create_parser = subparsers.add_parser("create")
     create_parser.add_argument("name", help="Task name")
     create_parser.add_argument("description", help="Long description", nargs="?")
+    create_parser.add_argument("--parent", help="Create as a subtask of this task")
     create_parser.set_defaults(func=do_create)
 
     describe_parser = subparsers.add_parser("describe")
@@ -64,6 +124,24 @@ def main(argv=None):
     rename_parser.add_argument("new_name", help="New task name")
     rename_parser.set_defaults(func=do_rename)
 
+    move_parser = subparsers.add_parser(
+        "move", help="Move a task, with its subtasks, under another task"
+    )
+    move_parser.add_argument("name", help="Task name")
+    move_target = move_parser.add_mutually_exclusive_group(required=True)
+    move_target.add_argument("--parent", help="Move the task under this task")
+    move_target.add_argument(
+        "--top", action="store_true", help="Make the task a top-level task"
+    )
+    move_parser.set_defaults(func=do_move)
+
+    merge_parser = subparsers.add_parser(
+        "merge-tasks", help="Merge tasks into another task"
+    )
+    merge_parser.add_argument("sources", nargs="+", help="Tasks to merge")
+    merge_parser.add_argument("dest", help="Task to merge them into")
+    merge_parser.set_defaults(func=do_merge_tasks)
+
     tasks_parser = subparsers.add_parser("tasks")
     tasks_parser.set_defaults(func=do_tasks)
 
@@ -76,6 +154,15 @@ def main(argv=None):
     start_parser = subparsers.add_parser("start")
     start_parser.add_argument("task", help="Task name", nargs="?")
     start_parser.add_argument("time", help="timestamp", default="now", nargs="?")
+    start_parser.add_argument(
+        "--tag",
+        action="append",
+        metavar="NAME",
+        help="Tag the timer, may be repeated",
+    )
+    start_parser.add_argument(
+        "-m", "--message", dest="note", help="A note on the work done"
+    )
     start_parser.set_defaults(func=do_start)
 
     stop_parser = subparsers.add_parser("stop")
@@ -88,11 +175,37 @@ def main(argv=None):
     edit_parser.add_argument("--task", help="Set task")
     edit_parser.add_argument("--start-time", help="Set start time")
     edit_parser.add_argument("--stop-time", help="Set stop time")
+    edit_parser.add_argument(
+        "--tag", action="append", metavar="NAME", help="Add a tag, may be repeated"
+    )
+    edit_parser.add_argument(
+        "--untag",
+        action="append",
+        metavar="NAME",
+        help="Remove a tag, may be repeated",
+    )
     edit_parser.add_argument(
         "--make-active", action="store_true", help="Mark timer as active/running"
     )
     edit_parser.set_defaults(func=do_edit)
 
+    retag_parser = subparsers.add_parser(
+        "retag", help="Move the records of a task to another task"
+    )
+    retag_parser.add_argument(
+        "--from", dest="from_task", required=True, help="Task of the records"
+    )
+    retag_parser.add_argument(
+        "--to", dest="to_task", required=True, help="Task to move them to"
+    )
+    _add_bulk_arguments(retag_parser)
+    retag_parser.set_defaults(func=do_retag)
+
+    delete_parser = subparsers.add_parser("delete", help="Delete the records of a task")
+    delete_parser.add_argument("--task", required=True, help="Task of the records")
+    _add_bulk_arguments(delete_parser)
+    delete_parser.set_defaults(func=do_delete)
+
     # Commands for working with reporting
 
     summary_parser = subparsers.add_parser("summary")
@@ -110,6 +223,9 @@ def main(argv=None):
     summary_time_shortcuts.add_argument("--last-month", action="store_true")
     summary_time_shortcuts.add_argument("--year", action="store_true")
     summary_time_shortcuts.add_argument("--last-year", action="store_true")
+    _add_task_filter_arguments(summary_parser)
+    _add_rollup_argument(summary_parser)
+    _add_output_argument(summary_parser)
     summary_parser.set_defaults(func=do_summary)
 
     records_parser = subparsers.add_parser("records")
@@ -127,17 +243,144 @@ def main(argv=None):
     records_time_shortcuts.add_argument("--last-month", action="store_true")
     records_time_shortcuts.add_argument("--year", action="store_true")
     records_time_shortcuts.add_argument("--last-year", action="store_true")
+    records_parser.add_argument(
+        "--limit", type=int, help="Show at most this many records"
+    )
+    records_parser.add_argument(
+        "--after", help="Show the records after this timer ID, or from this timestamp"
+    )
+    _add_task_filter_arguments(records_parser)
+    _add_output_argument(records_parser)
     records_parser.set_defaults(func=do_records)
 
+    log_parser = subparsers.add_parser("log", help="Show the most recent records")
+    log_parser.add_argument(
+        "-n",
+        "--limit",
+        type=int,
+        default=DEFAULT_LOG_LIMIT,
+        help="Show at most this many records (Default %d)" % DEFAULT_LOG_LIMIT,
+    )
+    log_parser.add_argument(
+        "--before", help="Show the records before this timer ID, or timestamp"
+    )
+    _add_output_argument(log_parser)
+    log_parser.set_defaults(func=do_log)
+
+    search_parser = subparsers.add_parser(
+        "search", help="Search the notes of the records"
+    )
+    search_parser.add_argument(
+        "query", nargs="+", help="Words which must all appear in the note"
+    )
+    search_parser.add_argument(
+        "--begin", help="Search the records started from this timestamp"
+    )
+    search_parser.add_argument(
+        "--end", help="Search the records started before this timestamp"
+    )
+    search_parser.add_argument(
+        "-n",
+        "--limit",
+        type=int,
+        default=DEFAULT_SEARCH_LIMIT,
+        help="Show at most this many records (Default %d)" % DEFAULT_SEARCH_LIMIT,
+    )
+    _add_task_filter_arguments(search_parser)
+    _add_output_argument(search_parser)
+    search_parser.set_defaults(func=do_search)
+
     report_parser = subparsers.add_parser("report")
     report_parser.add_argument(
         "--month", type=int, choices=range(1, 13), help="Month to generate report for"
     )
+    _add_task_filter_arguments(report_parser)
+    _add_output_argument(report_parser)
     report_parser.set_defaults(func=do_report)
 
+    pivot_parser = subparsers.add_parser(
+        "pivot", help="Tabulate the time spent by any rows and columns"
+    )
+    pivot_parser.add_argument(
+        "--begin", help="Timestamp for start of reporting period (inclusive)"
+    )
+    pivot_parser.add_argument(
+        "--end", help="Timestamp for end of reporting period (exclusive)"
+    )
+    pivot_time_shortcuts = pivot_parser.add_mutually_exclusive_group()
+    pivot_time_shortcuts.add_argument("--yesterday", action="store_true")
+    pivot_time_shortcuts.add_argument("--week", action="store_true")
+    pivot_time_shortcuts.add_argument("--last-week", action="store_true")
+    pivot_time_shortcuts.add_argument("--month", action="store_true")
+    pivot_time_shortcuts.add_argument("--last-month", action="store_true")
+    pivot_time_shortcuts.add_argument("--year", action="store_true")
+    pivot_time_shortcuts.add_argument("--last-year", action="store_true")
+    pivot_parser.add_argument(
+        "--rows",
+        type=_dimensions,
+        default=("task",),
+        help="Comma separated row dimensions, from %s (Default task)"
+        % ", ".join(tt.pivot.DIMENSIONS),
+    )
+    pivot_parser.add_argument(
+        "--cols",
+        type=_dimensions,
+        default=(),
+        help="Comma separated column dimensions (Default none)",
+    )
+    pivot_parser.add_argument(
+        "--measure",
+        choices=tt.pivot.MEASURES,
+        default="elapsed",
+        help="The total, number, shortest or longest elapsed time of the "
+        "records (Default elapsed)",
+    )
+    _add_task_filter_arguments(pivot_parser)
+    _add_rollup_argument(pivot_parser)
+    _add_output_argument(pivot_parser)
+    pivot_parser.set_defaults(func=do_pivot)
+
+    check_parser = subparsers.add_parser(
+        "check", help="Audit the records for overlaps and negative durations"
+    )
+    check_parser.add_argument(
+        "--gaps", action="store_true", help="Also show the time between records"
+    )
+    _add_output_argument(check_parser)
+    check_parser.set_defaults(func=do_check)
+
+    gaps_parser = subparsers.add_parser(
+        "gaps", help="Show the untracked time within working hours"
+    )
+    gaps_parser.add_argument(
+        "--begin", help="Timestamp for start of reporting period (inclusive)"
+    )
+    gaps_parser.add_argument(
+        "--end", help="Timestamp for end of reporting period (exclusive)"
+    )
+    gaps_parser.add_argument(
+        "--hours",
+        type=_working_hours,
+        default=DEFAULT_WORKING_HOURS,
+        metavar="HH:MM-HH:MM",
+        help="Working hours of each day (Default %s)" % DEFAULT_WORKING_HOURS,
+    )
+    gaps_parser.add_argument(
+        "--weekdays", action="store_true", help="Skip the weekends"
+    )
+    _add_output_argument(gaps_parser)
+    gaps_parser.set_defaults(func=do_gaps)
+
     status_parser = subparsers.add_parser("status")
+    _add_task_filter_arguments(status_parser)
+    _add_output_argument(status_parser)
     status_parser.set_defaults(func=do_status)
 
+    prompt_parser = subparsers.add_parser(
+        "prompt", help="Show the running task and elapsed time for a shell prompt"
+    )
+    prompt_parser.set_defaults(func=do_prompt)
+
     # Commands for import and export
 
     export_parser = subparsers.add_parser("export")
@@ -150,25 +393,236 @@ def main(argv=None):
     import_parser.add_argument("source", help="Source filename or - for stdin")
     import_parser.set_defaults(func=do_import)
 
-    args = parser.parse_args(argv or sys.argv[1:])
+    # Commands for running many commands at once
+
+    batch_parser = subparsers.add_parser(
+        "batch", help="Run commands read one per line, all or nothing"
+    )
+    batch_parser.add_argument(
+        "source", help="Source filename or - for stdin", default="-", nargs="?"
+    )
+    batch_parser.set_defaults(func=do_batch)
+
+    shell_parser = subparsers.add_parser(
+        "shell", help="Run commands interactively, keeping caches warm"
+    )
+    shell_parser.set_defaults(func=do_shell)
+
+    parser.commands = sorted(subparsers.choices)
+    return parser
+
+
+def _add_task_filter_arguments(parser):
+    """Add the options restricting a report to some tasks and tags."""
+    parser.add_argument(
+        "--task",
+        action="append",
+        metavar="NAME",
+        help="Include only this task, may be repeated",
+    )
+    parser.add_argument(
+        "--task-glob",
+        action="append",
+        metavar="PATTERN",
+        help="Include only the tasks matching this pattern, e.g. 'client-*', "
+        "may be repeated",
+    )
+    parser.add_argument(
+        "--tag",
+        dest="tags",
+        action="append",
+        metavar="NAME",
+        help="Include only the records with this tag, may be repeated",
+    )
+    parser.add_argument(
+        "--not-tag",
+        dest="not_tags",
+        action="append",
+        metavar="NAME",
+        help="Exclude the records with this tag, may be repeated",
+    )
+
+
+# The options added by _add_task_filter_arguments(), with their destinations.
+_FILTER_OPTIONS = [
+    ("--task", "task"),
+    ("--task-glob", "task_glob"),
+    ("--tag", "tags"),
+    ("--not-tag", "not_tags"),
+]
+
+
+def _filter_options(args):
+    """
+    Rebuild the options restricting a report to some tasks and tags.
+
+    :param args: parsed command line arguments.
+    :returns: A list of command line arguments.
+    """
+    options = []
+    for option, dest in _FILTER_OPTIONS:
+        for value in getattr(args, dest) or []:
+            options += [option, value]
+    return options
+
+
+def _add_rollup_argument(parser):
+    """Add the option rolling up the time of subtasks."""
+    parser.add_argument(
+        "--rollup",
+        type=_level,
+        metavar="LEVEL",
+        help="Include the time of subtasks in their parent task at this "
+        "level, from 1 for the top-level tasks",
+    )
+
+
+def _level(value):
+    """Parse a level of the task hierarchy."""
+    try:
+        level = int(value)
+    except ValueError:
+        level = 0
+    if level < 1:
+        raise argparse.ArgumentTypeError("invalid level %r" % value)
+    return level
+
+
+def _working_hours(value):
+    """Parse the working hours of a day, such as 09:00-17:00."""
+    try:
+        opening, closing = (
+            datetime.strptime(part.strip(), "%H:%M").time() for part in value.split("-")
+        )
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid working hours %r" % value)
+    if opening >= closing:
+        raise argparse.ArgumentTypeError(
+            "working hours %r must end after they start" % value
+        )
+    return opening, closing
+
+
+def _add_bulk_arguments(parser):
+    """Add the time range and --dry-run options of the bulk changes."""
+    parser.add_argument(
+        "--begin",
+        required=True,
+        help="Timestamp after which records start (inclusive)",
+    )
+    parser.add_argument(
+        "--end", required=True, help="Timestamp before which records start (exclusive)"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Count the records without changing them",
+    )
+
+
+def _dimensions(value):
+    """Parse a comma separated list of pivot dimensions."""
+    dimensions = tuple(name.strip() for name in value.split(",") if name.strip())
+    for name in dimensions:
+        if name not in tt.pivot.DIMENSIONS:
+            raise argparse.ArgumentTypeError(
+                "invalid dimension %r (choose from %s)"
+                % (name, ", ".join(tt.pivot.DIMENSIONS))
+            )
+    if not dimensions:
+        raise argparse.ArgumentTypeError("no dimension given")
+    return dimensions
+
+
+def _add_output_argument(parser):
+    """Add the option selecting the output format of a report."""
+    parser.add_argument(
+        "--output",
+        choices=tt.datatable.FORMATS,
+        default="table",
+        help="Output format, the machine-readable formats give durations "
+        "in seconds and times in ISO 8601 (Default table)",
+    )
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = _parse_args(parser, argv or sys.argv[1:])
     if args.version:
         print("Timetrack2-%s" % tt.__VERSION__)
         return 0
 
     configure_logging(args.verbose)
 
-    db_file = os.path.expanduser(os.path.join(APP_DATA_DIR, "timetrack2.db"))
+    data_dir = os.path.expanduser(APP_DATA_DIR)
+    db_file = os.path.join(data_dir, tt.DB_FILE)
     with contextlib.suppress(OSError):
-        os.makedirs(os.path.dirname(db_file))
+        os.makedirs(data_dir)
+
+    with tt.profile.profiled(
+        args.profile, output=args.profile_output, limit=args.profile_limit
+    ), tt.stats.collected(args.stats, fmt=args.stats_format, output=args.stats_output):
+        tt.profile.record("imports", IMPORT_TIME)
+
+        with tt.profile.phase("connect"):
+            connect(db_url="sqlite:///%s" % db_file, echo=args.verbose)
+        tt.state.configure(os.path.join(data_dir, tt.state.STATE_FILE))
+        return _run(args)
+
 
-    connect(db_url="sqlite:///%s" % db_file, echo=args.verbose)
+def _run(args):
+    """
+    Run a parsed command.
+
+    :param args: parsed command line arguments.
+    :returns: 1 if the request was refused, otherwise the exit status
+              returned by the command, if any.
+    """
     try:
-        args.func(args)
+        with tt.datetime.frozen():
+            return args.func(args)
     except BadRequest as err:
         print("Error: %s" % err)
         return 1
 
 
+def _parse_args(parser, argv):
+    """
+    Parse the command line arguments of a command.
+
+    :param parser: The parser built by build_parser().
+    :param argv: The command line arguments.
+    :returns: The parsed arguments.
+    """
+    args = parser.parse_args(_expand_profile_flag(argv))
+    if args.profile_output and args.profile != "cprofile":
+        # Only cProfile statistics are written to the file.
+        parser.error("--profile-output requires --profile=cprofile")
+    return args
+
+
+def _expand_profile_flag(argv):
+    """
+    Allow --profile to be given without a value.
+
+    An optional value for --profile would otherwise consume the name of
+    the subcommand which follows it.
+
+    :param argv: The command line arguments.
+    :returns: The command line arguments with a bare --profile, ahead of
+              the subcommand, replaced by --profile=<default>.
+    """
+    result = list(argv)
+    i = 0
+    while i < len(result) and result[i].startswith("-"):
+        if result[i] == "--profile":
+            result[i] = "--profile=%s" % tt.profile.DEFAULT_PROFILER
+        elif result[i] in ("--profile-output", "--profile-limit"):
+            i += 1
+        i += 1
+    return result
+
+
 def configure_logging(verbose=False):
     """
     Initialize and configure the logging.
@@ -185,7 +639,7 @@ def configure_logging(verbose=False):
 def do_create(args):
     log.info("create task with name %s", args.name)
     service = TaskService()
-    service.add(name=args.name, description=args.description)
+    service.add(name=args.name, description=args.description, parent=args.parent)
     print('Added task "%s" with description "%s"' % (args.name, args.description))
 
 
@@ -203,6 +657,26 @@ def do_rename(args):
     print('Renamed task "%s" to "%s"' % (args.old_name, args.new_name))
 
 
+def do_move(args):
+    log.info("move task %s under %s", args.name, args.parent)
+    service = TaskService()
+    service.move(name=args.name, parent=args.parent)
+    if args.parent is None:
+        print('Moved task "%s" to the top level' % args.name)
+    else:
+        print('Moved task "%s" under "%s"' % (args.name, args.parent))
+
+
+def do_merge_tasks(args):
+    log.info("merge tasks %s into %s", args.sources, args.dest)
+    service = TaskService()
+    count = service.merge(names=args.sources, into=args.dest)
+    print(
+        'Merged %s into "%s", moving %d records'
+        % (", ".join('"%s"' % name for name in args.sources), args.dest, count)
+    )
+
+
 def do_tasks(args):
     log.info("list tasks")
     service = TaskService()
@@ -224,7 +698,7 @@ def do_start(args):
     time = _parse_timestamp(args.time)
     log.info("starting timer on task %s %s", args.task, time)
     service = TimerService()
-    service.start(task=args.task, timestamp=time)
+    service.start(task=args.task, timestamp=time, tags=args.tag, note=args.note)
     print('Started at "%s"' % time)
 
 
@@ -263,6 +737,49 @@ def do_edit(args):
         service.update(id=args.id, stop="")
         print('Marking timer "%s" as active' % args.id)
 
+    if args.tag:
+        service.tag(id=args.id, names=args.tag)
+        print('Tagged timer "%s" with %s' % (args.id, ", ".join(args.tag)))
+
+    if args.untag:
+        service.untag(id=args.id, names=args.untag)
+        print('Untagged timer "%s" from %s' % (args.id, ", ".join(args.untag)))
+
+
+def do_retag(args):
+    begin, end = _parse_timestamp(args.begin), _parse_timestamp(args.end)
+    log.info(
+        "move timers of %s from %s to %s to %s",
+        args.from_task,
+        begin,
+        end,
+        args.to_task,
+    )
+    service = TimerService()
+    count = service.retag(
+        args.from_task, args.to_task, begin, end, dry_run=args.dry_run
+    )
+    print(
+        '%s %d records from "%s" to "%s"'
+        % (
+            "Would move" if args.dry_run else "Moved",
+            count,
+            args.from_task,
+            args.to_task,
+        )
+    )
+
+
+def do_delete(args):
+    begin, end = _parse_timestamp(args.begin), _parse_timestamp(args.end)
+    log.info("delete timers of %s from %s to %s", args.task, begin, end)
+    service = TimerService()
+    count = service.delete_range(args.task, begin, end, dry_run=args.dry_run)
+    print(
+        '%s %d records of "%s"'
+        % ("Would delete" if args.dry_run else "Deleted", count, args.task)
+    )
+
 
 def do_summary(args):
 
@@ -272,10 +789,54 @@ def do_summary(args):
     else:
         begin, end = from_timerange(args)
 
-    timer_service = TimerService()
-    reporting_service = ReportingService(timer_service)
+    task_ids = _task_filter(args)
+    tags = _tag_filter(args)
+
+    with _report_cache(args) as cache:
+        timer_service = TimerService(cache=cache)
+        reporting_service = ReportingService(timer_service)
+
+        table = reporting_service.summary_by_task(
+            start=begin,
+            end=end,
+            task_ids=task_ids,
+            plain=_plain(args),
+            rollup=args.rollup,
+            tags=tags,
+        )
+        _output(args, [table], end="")
+
+
+def do_pivot(args):
+
+    if args.begin or args.end:
+        begin = _parse_timestamp(args.begin or DEFAULT_REPORT_START)
+        end = _parse_timestamp(args.end or DEFAULT_REPORT_END)
+    else:
+        begin, end = from_timerange(args)
 
-    print(reporting_service.summary_by_task(start=begin, end=end))
+    if set(args.rows) & set(args.cols):
+        raise BadRequest("A dimension cannot be both a row and a column")
+
+    task_ids = _task_filter(args)
+    tags = _tag_filter(args)
+
+    with _report_cache(args) as cache:
+        timer_service = TimerService(cache=cache)
+        reporting_service = ReportingService(timer_service)
+
+        table = reporting_service.pivot(
+            begin,
+            end,
+            args.rows,
+            args.cols,
+            measure=args.measure,
+            task_ids=task_ids,
+            plain=_plain(args),
+            rollup=args.rollup,
+            tags=tags,
+        )
+        _output(args, [table], end="")
 
 
 def do_records(args):
@@ -286,20 +847,148 @@ def do_records(args):
     else:
         begin, end = from_timerange(args)
 
+    task_ids = _task_filter(args)
+    tags = _tag_filter(args)
     timer_service = TimerService()
     reporting_service = ReportingService(timer_service)
 
-    for daily_table in reporting_service.timers_by_day(start=begin, end=end):
-        print("%s\n" % daily_table)
+    if args.limit is None and args.after is None:
+        _output(
+            args,
+            reporting_service.timers_by_day(
+                start=begin, end=end, task_ids=task_ids, tags=tags
+            ),
+        )
+        return
 
+    after = (begin, 0)
+    if args.after is not None:
+        after = _parse_position(timer_service, args.after)
 
-def do_report(args):
+    records = timer_service.page(
+        after, end, limit=args.limit, task_ids=task_ids, tags=tags
+    )
+    _output(args, reporting_service.records_by_day(records))
+
+    if records and len(records) == args.limit and not _plain(args):
+        # The next page starts after the last record, within the same range
+        # and filters, whatever time it is run.
+        _more_records(
+            ["records", "--end", end.isoformat()]
+            + _filter_options(args)
+            + ["--limit", str(args.limit), "--after", str(records[-1]["id"])]
+        )
+
+
+def do_log(args):
+    timer_service = TimerService()
+    reporting_service = ReportingService(timer_service)
+
+    before = None
+    if args.before is not None:
+        before = _parse_position(timer_service, args.before)
+
+    records = timer_service.recent(args.limit, before=before)
+    if _plain(args):
+        _output(args, [reporting_service.log(records)])
+        return
+
+    if not records:
+        print("No records")
+        return
+
+    print(reporting_service.log(records))
+    if len(records) == args.limit:
+        _more_records(
+            ["log", "--limit", str(args.limit), "--before", str(records[-1]["id"])]
+        )
+
+
+def _more_records(argv):
+    """Show the command listing the next page of records."""
+    print("More records: tt %s" % " ".join(shlex.quote(arg) for arg in argv))
+
+
+def do_search(args):
+    begin = _parse_timestamp(args.begin) if args.begin else None
+    end = _parse_timestamp(args.end) if args.end else None
     timer_service = TimerService()
     reporting_service = ReportingService(timer_service)
 
-    target_date = datetime.now(tz_local()).replace(
-        hour=0, minute=0, second=0, microsecond=0
+    records = timer_service.search(
+        " ".join(args.query),
+        start=begin,
+        end=end,
+        limit=args.limit,
+        task_ids=_task_filter(args),
+        tags=_tag_filter(args),
     )
+    if records or _plain(args):
+        _output(args, [reporting_service.matches(records)])
+    else:
+        print("No matching records")
+
+
+def _plain(args):
+    """True if a machine-readable output format was requested."""
+    return args.output != "table"
+
+
+def _output(args, tables, end="\n"):
+    """
+    Print report tables in the requested output format.
+
+    :param args: parsed command line arguments.
+    :param tables: An iterable of Datatable.
+    :param end: Printed after each table rendered as text.
+                (Default value = an empty line)
+    """
+    if _plain(args):
+        tt.datatable.write(tables, sys.stdout, args.output)
+        return
+
+    for table in tables:
+        print("%s%s" % (table, end))
+
+
+def _task_filter(args):
+    """
+    Resolve the tasks a report is restricted to.
+
+    :param args: parsed command line arguments.
+    :returns: The list of task ids, or None to include all tasks.
+    """
+    return TaskService().select(names=args.task, patterns=args.task_glob)
+
+
+def _tag_filter(args):
+    """
+    Resolve the tags a report is restricted to.
+
+    :param args: parsed command line arguments.
+    :returns: A tt.reader.TagFilter, or None to include all records.
+    """
+    if not args.tags and not args.not_tags:
+        return None
+    return TimerService().tag_filter(tags=args.tags, not_tags=args.not_tags)
+
+
+def _parse_position(timer_service, value):
+    """
+    Parse the position of a timer, for paging through the records.
+
+    :param timer_service: The TimerService.
+    :param value: A timer ID, or a timestamp string.
+    :returns: The (start, id) position of the timer, or the position of the
+              timestamp which is (timestamp, 0).
+    """
+    if value.isdigit():
+        return timer_service.position(int(value))
+    return _parse_timestamp(value), 0
+
+
+def do_report(args):
+    target_date = start_of_day(tt.datetime.local_now())
 
     if args.month:
         if args.month > target_date.month:
@@ -310,34 +999,135 @@ def do_report(args):
 
     start = target_date.replace(day=1)
     end = target_date.replace(day=last_day_of_month)
-    for weekly_report in reporting_service.summary_by_day_and_task(
-        start=start, end=end
-    ):
-        print("%s\n" % weekly_report)
+    task_ids = _task_filter(args)
+    tags = _tag_filter(args)
+
+    with _report_cache(args) as cache:
+        timer_service = TimerService(cache=cache)
+        reporting_service = ReportingService(timer_service)
+
+        _output(
+            args,
+            reporting_service.summary_by_day_and_task(
+                start=start,
+                end=end,
+                task_ids=task_ids,
+                plain=_plain(args),
+                tags=tags,
+            ),
+        )
 
 
 def do_status(args):
-    timer_service = TimerService()
-    reporting_service = ReportingService(timer_service)
-
-    now = datetime.now(tz_local()).replace(hour=0, minute=0, second=0, microsecond=0)
+    now = start_of_day(tt.datetime.local_now())
 
     week_begin, week_end = tt.datetime.week_boundaries(now)
 
     day_begin = now
     day_end = now + timedelta(days=1)
-    try:
-        print(
-            next(
+    filters = {"task_ids": _task_filter(args), "tags": _tag_filter(args)}
+
+    with _report_cache(args) as cache:
+        timer_service = TimerService(cache=cache)
+        reporting_service = ReportingService(timer_service)
+
+        if _plain(args):
+            tables = list(
                 reporting_service.summary_by_day_and_task(
-                    start=week_begin, end=week_end
+                    start=week_begin, end=week_end, plain=True, **filters
+                )
+            )
+            tables.extend(
+                reporting_service.timers_by_day(start=day_begin, end=day_end, **filters)
+            )
+            _output(args, tables)
+            return
+
+        try:
+            print(
+                next(
+                    reporting_service.summary_by_day_and_task(
+                        start=week_begin, end=week_end, **filters
+                    )
                 )
             )
+            print("\n")
+            print(
+                next(
+                    reporting_service.timers_by_day(
+                        start=day_begin, end=day_end, **filters
+                    )
+                )
+            )
+        except StopIteration:
+            print("No records")
+
+
+def do_check(args):
+    timer_service = TimerService()
+    reporting_service = ReportingService(timer_service)
+
+    problems = list(timer_service.check(gaps=args.gaps))
+    if problems or _plain(args):
+        _output(args, [reporting_service.problems(problems)])
+    else:
+        print("No problems found")
+
+    if any(problem["kind"] != "gap" for problem in problems):
+        return 1
+
+
+def do_gaps(args):
+    begin = _parse_timestamp(args.begin or DEFAULT_REPORT_START)
+    end = _parse_timestamp(args.end or DEFAULT_REPORT_END)
+    timer_service = TimerService()
+    reporting_service = ReportingService(timer_service)
+
+    gaps = list(timer_service.untracked(begin, end, args.hours, weekdays=args.weekdays))
+    if gaps or _plain(args):
+        _output(args, [reporting_service.untracked(gaps)])
+    else:
+        print("No untracked time")
+
+
+def do_prompt(args):
+    # Only reached when the state file is missing or out of date, see
+    # tt.__main__.  Rebuild it from the database.
+    active = tt.reader.active()
+    tt.state.save(active)
+    if active is None:
+        print("")
+    else:
+        print(
+            tt.state.format_prompt(
+                {"task": active.task, "start": active.start.timestamp()},
+                now=tt.datetime.utc_now().timestamp(),
+            )
         )
-        print("\n")
-        print(next(reporting_service.timers_by_day(start=day_begin, end=day_end)))
-    except StopIteration:
-        print("No records")
+
+
+@contextlib.contextmanager
+def _report_cache(args):
+    """
+    Provide the persistent report cache for the duration of a command.
+
+    :param args: parsed command line arguments.
+    :yields: A ReportCache, or None if caching is disabled.
+    """
+    if args.no_cache:
+        yield None
+        return
+
+    if _shell_report_cache is not None:
+        # Flushed when the shell exits.
+        yield _shell_report_cache
+        return
+
+    cache = ReportCache(
+        os.path.expanduser(os.path.join(APP_DATA_DIR, REPORT_CACHE_FILE))
+    )
+    yield cache
+    cache.flush()
 
 
 def _parse_timestamp(timestamp_in):
@@ -348,7 +1138,14 @@ def _parse_timestamp(timestamp_in):
     :returns: A timezone aware python datetime object.
     :raises: ParseError if the timestamp string is not parsable.
     """
-    timestamp_out = dateparser.parse(timestamp_in, settings=DATEPARSER_SETTINGS)
+    # Relative times, such as "1 hour ago", are relative to the clock of
+    # the command, in the local time zone dateparser expects.
+    settings = dict(
+        DATEPARSER_SETTINGS,
+        RELATIVE_BASE=tt.datetime.local_now().replace(tzinfo=None),
+    )
+    with tt.profile.phase("dateparser"):
+        timestamp_out = dateparser.parse(timestamp_in, settings=settings)
 
     if timestamp_out is None:
         raise ParseError("Unable to parse %s" % timestamp_in)
@@ -374,7 +1171,7 @@ def from_timerange(args):
               timerange, or the start and end of the current day if not
               specified.
     """
-    now = datetime.now(tz_local())
+    now = tt.datetime.local_now()
 
     if args.yesterday:
         return start_of_day(now - timedelta(days=1)), start_of_day(now)
@@ -429,6 +1226,206 @@ def do_import(args):
         tt.io.load(task_service, timer_service, in_)
 
 
+class _CommandParser(argparse.ArgumentParser):
+    """An argument parser raising ParseError rather than exiting on errors."""
+
+    def error(self, message):
+        raise ParseError(message)
+
+
+def do_batch(args):
+    if args.source == "-":
+        commands = _parse_batch(sys.stdin)
+    else:
+        with open(args.source, "r") as in_:
+            commands = _parse_batch(in_)
+
+    try:
+        with transaction():
+            for number, command in commands:
+                command.func(command)
+    except (BadRequest, ParseError, ValidationError) as err:
+        raise BadRequest("line %d: %s, no changes were made" % (number, err))
+
+    print("Ran %d commands" % len(commands))
+
+
+def _parse_batch(lines):
+    """
+    Parse the commands of a batch.
+
+    Each line holds one command with the same syntax as the command line,
+    blank lines and comments starting with # are ignored.  The report
+    cache is not used by commands in a batch, since their results may be
+    rolled back.
+
+    :param lines: An iterable of lines.
+    :returns: A list of (line number, parsed arguments) tuples.
+    :raises: BadRequest listing every line which could not be parsed.
+    """
+    parser = build_parser(_CommandParser)
+    commands = []
+    errors = []
+    for number, line in enumerate(lines, 1):
+        try:
+            argv = shlex.split(line, comments=True)
+            if not argv:
+                continue
+            command = _parse_args(parser, argv)
+            if getattr(command, "func", None) is None:
+                raise ParseError("no command given")
+            if command.func in (do_batch, do_shell):
+                raise ParseError("%s can not be run from a batch" % argv[0])
+        except (ParseError, ValueError) as err:
+            errors.append("line %d: %s" % (number, err))
+            continue
+        command.no_cache = True
+        commands.append((number, command))
+
+    if errors:
+        raise BadRequest("\n".join(errors))
+    return commands
+
+
+SHELL_PROMPT = "tt> "
+SHELL_HISTORY_FILE = "shell_history"
+
+
+def do_shell(args):
+    parser = build_parser(_CommandParser)
+    completer = _Completer(parser.commands)
+    history = os.path.expanduser(os.path.join(APP_DATA_DIR, SHELL_HISTORY_FILE))
+
+    if readline is not None:
+        with contextlib.suppress(OSError):
+            readline.read_history_file(history)
+        readline.set_completer(completer.complete)
+        readline.set_completer_delims(" \t")
+        readline.parse_and_bind("tab: complete")
+
+    # Load the dateparser languages before the first command needs them.
+    _parse_timestamp("now")
+
+    global _shell_report_cache
+    _shell_report_cache = ReportCache(
+        os.path.expanduser(os.path.join(APP_DATA_DIR, REPORT_CACHE_FILE))
+    )
+    try:
+        while True:
+            try:
+                line = input(SHELL_PROMPT)
+            except EOFError:
+                print()
+                break
+            except KeyboardInterrupt:
+                print()
+                continue
+
+            if line.strip() in ("exit", "quit"):
+                break
+            if _shell_command(parser, line):
+                completer.invalidate()
+    finally:
+        _shell_report_cache.flush()
+        _shell_report_cache = None
+        if readline is not None:
+            with contextlib.suppress(OSError):
+                readline.write_history_file(history)
+
+
+def _shell_command(parser, line):
+    """
+    Parse and run one line entered in the shell, showing how long it took.
+
+    :param parser: The parser built for the shell.
+    :param line: The line entered.
+    :returns: True if a command was run.
+    """
+    try:
+        argv = shlex.split(line, comments=True)
+        if not argv:
+            return False
+        command = _parse_args(parser, argv)
+        if getattr(command, "func", None) is None:
+            raise ParseError("no command given")
+        if command.func is do_shell:
+            raise ParseError("already in the shell")
+    except (ParseError, ValueError) as err:
+        print("Error: %s" % err)
+        return False
+    except SystemExit:
+        # --help
+        return False
+
+    t0 = time.perf_counter()
+    try:
+        # The shell itself runs within a frozen clock, each command gets
+        # its own instant.
+        with tt.datetime.frozen(tt.datetime.clock()), tt.profile.profiled(
+            command.profile,
+            output=command.profile_output,
+            limit=command.profile_limit,
+        ), tt.stats.collected(
+            command.stats, fmt=command.stats_format, output=command.stats_output
+        ):
+            _run(command)
+    except (ParseError, ValidationError) as err:
+        print("Error: %s" % err)
+    except Exception as err:
+        # A failing command must not end the shell.
+        log.debug("Command %r failed", line, exc_info=True)
+        print("Error: %s: %s" % (err.__class__.__name__, err))
+    print("(%.1f ms)" % (1000.0 * (time.perf_counter() - t0)), file=sys.stderr)
+    return True
+
+
+class _Completer(object):
+    """
+    Complete command names, then task names, in the shell.
+
+    The task names are loaded once, and again after each command since it
+    may have changed them.
+
+    :param commands: The command names.
+    """
+
+    def __init__(self, commands):
+        self.commands = commands
+        self._tasks = None
+
+    @property
+    def tasks(self):
+        """The sorted task names."""
+        if self._tasks is None:
+            self._tasks = sorted(row.name for row in tt.reader.tasks())
+        return self._tasks
+
+    def invalidate(self):
+        """Forget the task names."""
+        self._tasks = None
+
+    def matches(self, line, text):
+        """
+        List the completions of a word.
+
+        :param line: The line before the word being completed.
+        :param text: The beginning of the word being completed.
+        :returns: The sorted candidates starting with text.
+        """
+        candidates = self.tasks if line.strip() else self.commands
+        return [candidate for candidate in candidates if candidate.startswith(text)]
+
+    def complete(self, text, state):
+        """The readline completer function."""
+        if state == 0:
+            line = readline.get_line_buffer()[: readline.get_begidx()]
+            self._matches = self.matches(line, text)
+        try:
+            return self._matches[state]
+        except IndexError:
+            return None
+
+
 def __init__():
     if __name__ == "__main__":
         sys.exit(main())
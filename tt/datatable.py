@@ -1,7 +1,17 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved.
+import collections
+import csv
+from datetime import date, datetime, timedelta
+import json
+
 import tabulate
 
+import tt.profile
+
+FORMATS = ("table", "json", "ndjson", "csv", "tsv")
+"""The output formats; "table" is the text rendering of str(Datatable)."""
+
 
 class Datatable(object):
     """Representation of a printable data table.
@@ -12,6 +22,9 @@ class Datatable(object):
     :param summaries: A list of summary values for the rows.
     :param label_header: An optional header for the label column.
     :param summary_header: An optional header for the summary column.
+    :param label_key: The key of the label in the rows(). (Default "label")
+    :param summary_key: The key of the summary in the rows().
+                        (Default "summary")
     :param table_fmt: Formating string to apply to this table.
     :param sort_fn: Callable used to sort the columns.
     :param header_fn: Callable to apply to each header value.
@@ -45,6 +58,8 @@ class Datatable(object):
         summaries=None,
         label_header=None,
         summary_header=None,
+        label_key="label",
+        summary_key="summary",
         table_fmt=None,
         sort_fn=None,
         header_fn=None,
@@ -60,6 +75,8 @@ class Datatable(object):
 
         self.label_header = label_header
         self.summary_header = summary_header
+        self.label_key = label_key
+        self.summary_key = summary_key
 
         self.caption = None
 
@@ -103,14 +120,11 @@ class Datatable(object):
                   of values.
         """
 
-        if not self.headers:
-            for row in self.table:
-                self.headers = self.headers | set(row.keys())
-            self.headers = self.sort_fn(list(self.headers))
+        self._make_headers()
 
         result = []
         for i, row in enumerate(self.table):
-            if any(self.labels):
+            if _any(self.labels):
                 try:
                     label = [self.label_fn(self.labels[i])]
                 except IndexError:
@@ -118,7 +132,7 @@ class Datatable(object):
             else:
                 label = []
 
-            if any(self.summaries):
+            if _any(self.summaries):
                 try:
                     summary = [self.summary_fn(self.summaries[i])]
                 except IndexError:
@@ -131,18 +145,116 @@ class Datatable(object):
             )
 
         headers = list(self.header_fn(h) for h in self.headers)
-        if self.label_header is not None and any(self.labels):
+        if self.label_header is not None and _any(self.labels):
             headers = [self.label_header] + headers
-        if self.summary_header is not None and any(self.summaries):
+        if self.summary_header is not None and _any(self.summaries):
             headers = headers + [self.summary_header]
 
         return headers, result
 
+    def _make_headers(self):
+        """Determine the headers from the data, unless they were given."""
+        if not self.headers:
+            headers = set()
+            for row in self.table:
+                headers |= set(row.keys())
+            self.headers = self.sort_fn(list(headers))
+
+    def rows(self):
+        """Generate the rows as dictionaries of plain values.
+
+        Unlike the text rendering, no formatting function is applied:
+        durations are given in seconds, and times and dates in ISO 8601.
+        The label and summary, when there are any, come first and last.
+
+        :yields: An ordered dictionary for each row.
+        """
+        self._make_headers()
+        labels = _any(self.labels)
+        summaries = _any(self.summaries)
+
+        for i, row in enumerate(self.table):
+            result = collections.OrderedDict()
+            if labels:
+                result[self.label_key] = _plain(_get(self.labels, i))
+            for header in self.headers:
+                result[_plain(header)] = _plain(row.get(header))
+            if summaries:
+                result[self.summary_key] = _plain(_get(self.summaries, i))
+            yield result
+
     def __str__(self):
-        headers, table = self._make()
-        table = tabulate.tabulate(table, headers, tablefmt=self.table_fmt)
+        with tt.profile.phase("render"):
+            headers, table = self._make()
+            table = tabulate.tabulate(table, headers, tablefmt=self.table_fmt)
 
         if self.caption:
             return "%s\n%s" % (self.caption, table)
         else:
             return table
+
+
+def _any(values):
+    """True if any of the labels or summaries is given, even if falsy."""
+    return any(value is not None for value in values)
+
+
+def _get(values, i):
+    try:
+        return values[i]
+    except IndexError:
+        return None
+
+
+def _plain(value):
+    """Convert a value to a plain JSON or CSV value."""
+    if isinstance(value, timedelta):
+        seconds = value.total_seconds()
+        return int(seconds) if seconds.is_integer() else seconds
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, tuple):
+        return "/".join(str(_plain(v)) for v in value)
+    return value
+
+
+def write(tables, stream, fmt):
+    """
+    Write tables in a machine-readable format, one row at a time.
+
+    The rows of all the tables are written as a single JSON array, as one
+    JSON object per line (ndjson), or as comma or tab separated values.
+    CSV and TSV output start with a header line, which is repeated after a
+    blank line whenever the columns change from one table to the next.
+
+    :param tables: An iterable of Datatable.
+    :param stream: A file-like object where to write the rows.
+    :param fmt: One of "json", "ndjson", "csv" or "tsv".
+    """
+    rows = (row for table in tables for row in table.rows())
+
+    if fmt == "json":
+        stream.write("[")
+        for i, row in enumerate(rows):
+            stream.write(",\n" if i else "\n")
+            json.dump(row, stream)
+        stream.write("\n]\n")
+        return
+
+    if fmt == "ndjson":
+        for row in rows:
+            json.dump(row, stream)
+            stream.write("\n")
+        return
+
+    writer = csv.writer(
+        stream, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n"
+    )
+    columns = None
+    for row in rows:
+        if list(row) != columns:
+            if columns is not None:
+                stream.write("\n")
+            columns = list(row)
+            writer.writerow(columns)
+        writer.writerow(row.values())
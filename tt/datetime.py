@@ -1,12 +1,76 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved
 
-from datetime import datetime, timedelta
+import contextlib
+from datetime import datetime, time, timedelta, timezone
 
+import numpy
 import pandas
 
 from dateutil import tz
 
+_frozen = None
+
+
+def utc_now():
+    """
+    Return the current time in UTC, truncated to the second.
+
+    Within a frozen() block, the instant the clock was frozen at is returned
+    instead, so that all elapsed times computed within the block agree.
+
+    :returns: A timezone-aware datetime.datetime object in UTC.
+    """
+    if _frozen is not None:
+        return _frozen
+    return clock()
+
+
+def clock():
+    """
+    Read the system clock, even within a frozen() block.
+
+    Everything else should use utc_now(), so that a frozen clock applies to
+    it; this is for starting a new frozen() block, e.g. for each command of
+    the shell.
+
+    :returns: A timezone-aware datetime.datetime object in UTC, truncated to
+              the second.
+    """
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def local_now():
+    """
+    Return the current time from utc_now() in the local timezone.
+
+    :returns: A timezone-aware datetime.datetime object.
+    """
+    return utc_now().astimezone(tz_local())
+
+
+@contextlib.contextmanager
+def frozen(instant=None):
+    """
+    Freeze the clock returned by utc_now() for the duration of a block.
+
+    Nested blocks without an explicit instant keep the outer instant.
+
+    :param instant: A timezone-aware datetime.datetime object to freeze the
+                    clock at. (Default value = the current time)
+    :yields: The frozen instant, in UTC.
+    """
+    global _frozen
+    previous = _frozen
+    if instant is not None:
+        _frozen = instant.astimezone(timezone.utc).replace(microsecond=0)
+    elif previous is None:
+        _frozen = utc_now()
+    try:
+        yield _frozen
+    finally:
+        _frozen = previous
+
 
 def range_days(start, end):
     """
@@ -47,6 +111,92 @@ def range_weeks(start, end):
         yield ts.to_pydatetime()
 
 
+def split_days(starts, stops, start, end):
+    """
+    Clip intervals to a time range and split them at local midnight.
+
+    The intervals are split as arrays, without a Python loop per interval
+    or per piece.
+
+    :param starts: A sequence of interval start times, in epoch seconds.
+    :param stops: A sequence of interval stop times, in epoch seconds.
+    :param start: The timezone-aware start of the range (inclusive).
+    :param end: The timezone-aware end of the range (exclusive).
+    :returns: A tuple of three arrays, with the index of the interval each
+              piece belongs to, and the start and stop of each piece in
+              epoch seconds.  Intervals outside the range have no pieces.
+    """
+    return _split_at(_midnights, starts, stops, start, end)
+
+
+def split_hours(starts, stops, start, end):
+    """
+    Clip intervals to a time range and split them at each local hour, as
+    split_days() splits them at midnight.
+
+    :param starts: A sequence of interval start times, in epoch seconds.
+    :param stops: A sequence of interval stop times, in epoch seconds.
+    :param start: The timezone-aware start of the range (inclusive).
+    :param end: The timezone-aware end of the range (exclusive).
+    :returns: A tuple of three arrays, with the index of the interval each
+              piece belongs to, and the start and stop of each piece in
+              epoch seconds.  Intervals outside the range have no pieces.
+    """
+    return _split_at(_hours, starts, stops, start, end)
+
+
+def _split_at(boundaries, starts, stops, start, end):
+    """Split intervals at the boundaries from before their start to stop."""
+    starts = numpy.maximum(
+        numpy.asarray(starts, dtype=numpy.int64), int(start.timestamp())
+    )
+    stops = numpy.minimum(numpy.asarray(stops, dtype=numpy.int64), int(end.timestamp()))
+    index = numpy.flatnonzero(starts < stops)
+    if not len(index):
+        return index, starts[index], stops[index]
+    starts, stops = starts[index], stops[index]
+
+    bounds = boundaries(starts.min(), stops.max())
+    first = numpy.searchsorted(bounds, starts, side="right") - 1
+    last = numpy.searchsorted(bounds, stops - 1, side="right") - 1
+    counts = last - first + 1
+
+    interval = numpy.repeat(numpy.arange(len(starts)), counts)
+    piece = first[interval] + (
+        numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    )
+    bounds = numpy.append(bounds, numpy.iinfo(numpy.int64).max)
+    return (
+        index[interval],
+        numpy.maximum(starts[interval], bounds[piece]),
+        numpy.minimum(stops[interval], bounds[piece + 1]),
+    )
+
+
+def _midnights(start, stop):
+    """The epoch seconds of each local midnight from before start to stop."""
+    day = datetime.fromtimestamp(start, tz_local()).date()
+    result = []
+    while True:
+        midnight = int(datetime.combine(day, time(), tzinfo=tz_local()).timestamp())
+        if midnight >= stop:
+            return numpy.array(result, dtype=numpy.int64)
+        result.append(midnight)
+        day += timedelta(days=1)
+
+
+def _hours(start, stop):
+    """The epoch seconds of each local hour from before start to stop.
+
+    Local hours are an hour apart, even across a change of daylight saving
+    time, which moves the clock by whole hours.
+    """
+    hour = datetime.fromtimestamp(start, tz_local()).replace(
+        minute=0, second=0, microsecond=0
+    )
+    return numpy.arange(int(hour.timestamp()), stop, 3600, dtype=numpy.int64)
+
+
 def week_boundaries(date):
     """
     Given a datetime.date object, return the boundaries of the week containing
@@ -114,7 +264,7 @@ def start_of_day(dt=None):
     :returns: The datetime representing the first second of the day.
     """
     if dt is None:
-        dt = datetime.now(tz_local())
+        dt = local_now()
 
     return dt.replace(hour=0, minute=0, second=0, microsecond=0)
 
@@ -127,7 +277,7 @@ def start_of_week(dt=None):
     :returns: The datetime representing the first second of the week.
     """
     if dt is None:
-        dt = datetime.now(tz_local())
+        dt = local_now()
 
     start, _ = week_boundaries(dt)
     return start_of_day(start)
@@ -142,7 +292,7 @@ def start_of_month(dt=None):
     """
 
     if dt is None:
-        dt = datetime.now(tz_local())
+        dt = local_now()
 
     return start_of_day(dt.replace(day=1))
 
@@ -156,6 +306,6 @@ def start_of_year(dt=None):
     """
 
     if dt is None:
-        dt = datetime.now(tz_local())
+        dt = local_now()
 
     return start_of_month(dt.replace(month=1))
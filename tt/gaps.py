@@ -0,0 +1,80 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# The untracked time within working hours.
+
+import collections
+from datetime import datetime, timedelta
+
+import tt.datetime
+from tt.datetime import tz_local
+
+Gap = collections.namedtuple("Gap", ["start", "stop"])
+"""A span of working hours without any timer, as timezone-aware times."""
+
+
+def working_hours(start, end, hours, weekdays=False):
+    """
+    Generate the working hours of each day within a time range.
+
+    :param start: The timezone-aware starting time (inclusive)
+    :param end: The timezone-aware ending time (exclusive)
+    :param hours: The (start, end) datetime.time of the working day, where
+                  the start is before the end.
+    :param weekdays: If True, skip the weekends. (Default value = False)
+    :yields: A (start, end) tuple of local times for each day, clipped to
+             the time range, in chronological order.
+    """
+    if end <= start:
+        return
+    first = start.astimezone(tz_local()).date()
+    last = (end - timedelta(microseconds=1)).astimezone(tz_local()).date()
+    days = tt.datetime.range_weekdays if weekdays else tt.datetime.range_days
+    for day in days(first, last):
+        opening = datetime.combine(day.date(), hours[0], tzinfo=tz_local())
+        closing = datetime.combine(day.date(), hours[1], tzinfo=tz_local())
+        opening, closing = max(opening, start), min(closing, end)
+        if opening < closing:
+            yield opening, closing
+
+
+def untracked(rows, windows, now):
+    """
+    Find the time within some windows not covered by any timer, in a single
+    pass.
+
+    The timers and the windows must both be in chronological order, and the
+    windows must not overlap.  Each timer and each window is read once, and
+    only the current timer is held, so the pass takes linear time and
+    constant memory.  Time after now is never untracked.
+
+    :param rows: An iterable of tt.reader.TimerRow ordered by start time.
+    :param windows: An iterable of (start, end) tuples of timezone-aware
+                    times, such as generated by working_hours().
+    :param now: The time a running timer is considered to end.
+    :yields: A Gap for each span of a window not covered by any timer.
+    """
+    rows = iter(rows)
+    row = next(rows, None)
+    for start, end in windows:
+        end = min(end, now)
+        if end <= start:
+            return
+
+        covered = start
+        while row is not None and row.start < end:
+            stop = now if row.stop is None else row.stop
+            if stop <= row.start:
+                # A timer without any duration covers nothing.
+                row = next(rows, None)
+                continue
+            if row.start > covered:
+                yield Gap(covered, row.start)
+            covered = max(covered, min(stop, end))
+            if stop > end:
+                # The timer continues into the next window.
+                break
+            row = next(rows, None)
+
+        if covered < end:
+            yield Gap(covered, end)
@@ -0,0 +1,67 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+import logging
+
+from sqlalchemy import text
+
+from tt.orm import Meta
+from tt.sql import DATABASE_ID, read_transaction
+
+log = logging.getLogger(__name__)
+
+DATA_VERSION = "data_version"
+REVISION = "revision"
+
+_BUMP = text(
+    "INSERT INTO meta (key, value) VALUES (:key, 1), (:revision, random()) "
+    "ON CONFLICT (key) DO UPDATE SET value = "
+    "CASE key WHEN :key THEN value + 1 ELSE excluded.value END"
+)
+
+
+def bump(session, key=DATA_VERSION):
+    """
+    Increment a counter within an existing transaction.
+
+    Every write to the tasks or timers must bump the data version, so that
+    results derived from the data, such as cached reports, can be
+    invalidated.  Each bump also draws a new random revision, see version().
+
+    :param session: The session of the transaction making the change.
+    :param key: The name of the counter. (Default value = DATA_VERSION)
+    """
+    session.execute(_BUMP, {"key": key, "revision": REVISION})
+
+
+def get(key=DATA_VERSION):
+    """
+    Get the current value of a counter.
+
+    :param key: The name of the counter. (Default value = DATA_VERSION)
+    :returns: The integer value, or 0 if the counter was never bumped.
+    """
+    with read_transaction() as session:
+        value = session.query(Meta.value).filter(Meta.key == key).scalar()
+        return value or 0
+
+
+def version():
+    """
+    Identify the current data, e.g. to key cached results on.
+
+    Unlike the data version counter, which restarts in a new database and
+    is repeated by a database restored from a backup, the version is the
+    random id of the database along with the random revision of its last
+    change.
+
+    :returns: A (database id, revision) tuple, in which the revision is
+              None if the data was never changed.
+    """
+    with read_transaction() as session:
+        values = dict(
+            session.query(Meta.key, Meta.value).filter(
+                Meta.key.in_([DATABASE_ID, REVISION])
+            )
+        )
+    return values.get(DATABASE_ID), values.get(REVISION)
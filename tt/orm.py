@@ -1,14 +1,26 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved.
 
-from datetime import datetime, timezone
-
-from sqlalchemy import Column, Integer, ForeignKey, String
-from sqlalchemy_utc import UtcDateTime
+from sqlalchemy import (
+    Column,
+    DDL,
+    event,
+    Integer,
+    ForeignKey,
+    Index,
+    PrimaryKeyConstraint,
+    String,
+)
 from sqlalchemy.orm import relationship
 
-from tt.datetime import local_time
-from tt.sql import Base
+from tt.datetime import local_time, utc_now
+from tt.sql import Base, EpochDateTime, NOTE_INDEX
+
+
+class Meta(Base):
+    __tablename__ = "meta"
+    key = Column(String(32), primary_key=True)
+    value = Column(Integer, nullable=False)
 
 
 class Task(Base):
@@ -19,13 +31,63 @@ class Task(Base):
     timers = relationship("Timer", back_populates="task")
 
 
+class Tag(Base):
+    __tablename__ = "tag"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(24), nullable=False, unique=True)
+
+
+class TimerTag(Base):
+    """The tags of each timer.
+
+    The primary key indexes the timers by tag, for reports filtered by tag,
+    and the ix_timer_tag_timer_id index the tags by timer.
+    """
+
+    __tablename__ = "timer_tag"
+    tag_id = Column(Integer, ForeignKey("tag.id"), nullable=False)
+    timer_id = Column(Integer, ForeignKey("timer.id"), nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("tag_id", "timer_id"),
+        Index("ix_timer_tag_timer_id", "timer_id"),
+    )
+
+
+class TaskTree(Base):
+    """The closure table of the task hierarchy.
+
+    There is a row for each task and each of its ancestors, as well as for
+    the task itself at a depth of 0.  The level is that of the ancestor,
+    from 1 for a task without a parent.
+    """
+
+    __tablename__ = "task_tree"
+    ancestor_id = Column(Integer, ForeignKey("task.id"), nullable=False)
+    descendant_id = Column(Integer, ForeignKey("task.id"), nullable=False)
+    depth = Column(Integer, nullable=False)
+    level = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("descendant_id", "ancestor_id"),
+        Index("ix_task_tree_ancestor_id_depth", "ancestor_id", "depth"),
+    )
+
+
 class Timer(Base):
     __tablename__ = "timer"
     id = Column(Integer, primary_key=True)
-    start = Column(UtcDateTime(), nullable=False)
-    stop = Column(UtcDateTime(), nullable=True)
+    start = Column(EpochDateTime(), nullable=False)
+    stop = Column(EpochDateTime(), nullable=True)
     task_id = Column(Integer, ForeignKey("task.id"), nullable=False)
     task = relationship("Task", back_populates="timers")
+    note = Column(String(255))
+
+    __table_args__ = (
+        Index("ix_timer_start_id", "start", "id"),
+        Index("ix_timer_task_id_start", "task_id", "start"),
+        Index("ix_timer_stop", "stop"),
+    )
 
     @property
     def running(self):
@@ -38,19 +100,37 @@ class Timer(Base):
         A timedelta representing the duration of a completed timer, or
         The current elapsed time for a running timer.
         """
+        return self.elapsed_at(utc_now())
+
+    def elapsed_at(self, now):
+        """
+        The duration of the timer, measuring a running timer up to the
+        given instant.
+
+        :param now: The timezone-aware current time.
+        """
         if self.running:
-            return datetime.now(timezone.utc).replace(microsecond=0) - self.start
+            return now - self.start
         else:
             return self.stop - self.start
 
-    def as_dict(self):
+    def as_dict(self, now=None):
         """
         Return the object as a plain dictionary.
+
+        :param now: The timezone-aware time used for the elapsed time of a
+                    running timer. (Default value = utc_now())
         """
         return {
             "id": self.id,
             "task": self.task.name,
             "start": local_time(self.start),
             "stop": local_time(self.stop),
-            "elapsed": self.elapsed,
+            "elapsed": self.elapsed_at(now or utc_now()),
         }
+
+
+# The full-text index of the notes is not described by the metadata, so it
+# is created along with the timer table.
+for statement in NOTE_INDEX:
+    event.listen(Timer.__table__, "after_create", DDL(statement))
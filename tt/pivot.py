@@ -0,0 +1,136 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# Pivot tables of the time spent, tabulated from the measures aggregated by
+# tt.reader.aggregate().
+
+import calendar
+import collections
+from datetime import timedelta
+
+from tt.datatable import Datatable
+from tt.reader import Measures, merge
+
+DIMENSIONS = ("task", "day", "week", "month", "weekday", "hour")
+"""The dimensions by which timers may be grouped."""
+
+MEASURES = ("elapsed", "count", "min", "max")
+"""The total, number, shortest and longest elapsed time of the timers."""
+
+TOTAL = "TOTAL"
+"""The label of the row of column totals."""
+
+_NO_TIMERS = Measures(0, 0, 0, 0)
+
+_FORMATS = {
+    "task": str.capitalize,
+    "day": lambda value: value.strftime("%a %b %d"),
+    "week": lambda value: value.strftime("Week %W %Y"),
+    "month": lambda value: value.strftime("%b %Y"),
+    "weekday": lambda value: calendar.day_abbr[value],
+    "hour": lambda value: "%02d:00" % value,
+}
+
+
+def value(measures, measure):
+    """
+    Extract one measure, as a timedelta for the elapsed times.
+
+    :param measures: A tt.reader.Measures.
+    :param measure: One of MEASURES.
+    """
+    result = getattr(measures, measure)
+    if measure == "count":
+        return result
+    return timedelta(seconds=result)
+
+
+def label(dimensions, key):
+    """
+    Format a key for display.
+
+    :param dimensions: The dimension of each value of the key.
+    :param key: The key, as a tuple for more than one dimension.
+    """
+    if key == TOTAL:
+        return key.capitalize()
+    if len(dimensions) == 1:
+        return _FORMATS[dimensions[0]](key)
+    return " ".join(_FORMATS[d](v) for d, v in zip(dimensions, key))
+
+
+def tabulate(groups, rows, cols=(), measure="elapsed", totals=True, **kwargs):
+    """
+    Tabulate a measure with rows and columns keyed by some dimensions.
+
+    The groups are read in a single pass.  The rows are in the order of
+    their first group, which is chronological for groups ordered by start
+    time, unless the row dimensions do not include the task, in which case
+    they are sorted.  The columns are sorted.
+
+    :param groups: An iterable of (key, Measures) tuples, where the key holds
+                   one value for each row dimension followed by one for each
+                   column dimension, as returned by tt.reader.aggregate().
+    :param rows: The row dimensions.
+    :param cols: The column dimensions.  Without any, the table has a single
+                 column, named after the measure.  (Default value = ())
+    :param measure: One of MEASURES. (Default value = "elapsed")
+    :param totals: If True, add a summary column with the total of each row,
+                   if there are columns, and a TOTAL row with the total of
+                   each column, even if there are no groups.
+                   (Default value = True)
+    :param kwargs: Extra arguments to the Datatable.
+    :returns: A Datatable.
+    """
+    rows, cols = tuple(rows), tuple(cols)
+    width = len(rows)
+
+    cells = collections.OrderedDict()
+    row_totals = collections.OrderedDict()
+    col_totals = {}
+    for key, measures in groups:
+        row_key = _key(key[:width])
+        col_key = _key(key[width:]) if cols else measure
+        row = cells.setdefault(row_key, {})
+        row[col_key] = merge(row.get(col_key), measures)
+        row_totals[row_key] = merge(row_totals.get(row_key), measures)
+        col_totals[col_key] = merge(col_totals.get(col_key), measures)
+
+    row_keys = list(cells)
+    if "task" not in rows:
+        row_keys.sort()
+
+    table = Datatable(
+        headers=sorted(col_totals) if cols else [measure],
+        header_fn=(lambda key: label(cols, key)) if cols else None,
+        label_fn=lambda key: label(rows, key),
+        **kwargs
+    )
+    summary = bool(totals and cols)
+    for row_key in row_keys:
+        table.append(
+            {k: value(v, measure) for k, v in cells[row_key].items()},
+            label=row_key,
+            summary=value(row_totals[row_key], measure) if summary else None,
+        )
+
+    if totals:
+        grand_total = None
+        for measures in row_totals.values():
+            grand_total = merge(grand_total, measures)
+        grand_total = grand_total or _NO_TIMERS
+        if not cols:
+            # The single column is known even without any timers.
+            col_totals = {measure: grand_total}
+        table.append(
+            {k: value(v, measure) for k, v in col_totals.items()},
+            label=TOTAL,
+            summary=value(grand_total, measure) if summary else None,
+        )
+
+    return table
+
+
+def _key(values):
+    """Use a single value as the key, rather than a tuple of one value."""
+    return values[0] if len(values) == 1 else values
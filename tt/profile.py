@@ -0,0 +1,195 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+import collections
+import contextlib
+import cProfile
+import logging
+import pstats
+import sys
+import time
+
+import tabulate
+
+log = logging.getLogger(__name__)
+
+PROFILERS = ("cprofile", "wall")
+DEFAULT_PROFILER = "cprofile"
+DEFAULT_LIMIT = 25
+
+PHASES = collections.OrderedDict(
+    [
+        ("imports", "Imports"),
+        ("connect", "DB connect"),
+        ("sql", "SQL execution"),
+        ("orm", "ORM hydration"),
+        ("render", "Table rendering"),
+        ("dateparser", "Date parsing"),
+    ]
+)
+"""Known phases and their descriptions, in reporting order."""
+
+timings = collections.defaultdict(float)
+"""Accumulated exclusive time in seconds per phase."""
+
+_enabled = False
+_nested = []
+
+
+def enable():
+    """Start collecting phase timings."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop collecting phase timings."""
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    """Discard all collected phase timings."""
+    timings.clear()
+    del _nested[:]
+
+
+def record(name, seconds):
+    """
+    Add time to a phase directly.
+
+    :param name: The phase name.
+    :param seconds: The time to add, in seconds.
+    """
+    if _enabled:
+        timings[name] += seconds
+
+
+def begin():
+    """
+    Mark the beginning of a phase.
+
+    :returns: An opaque token to pass to end(), or None when timings are
+              not being collected.
+    """
+    if not _enabled:
+        return None
+    _nested.append(0.0)
+    return time.perf_counter()
+
+
+def end(name, token):
+    """
+    Mark the end of a phase started with begin().
+
+    Time spent in phases nested within this one is not counted towards it,
+    so the timings of all phases add up to the total elapsed time.
+
+    :param name: The phase name.
+    :param token: The value returned by begin().
+    """
+    if token is None or not _nested:
+        return
+    elapsed = time.perf_counter() - token
+    nested = _nested.pop()
+    timings[name] += elapsed - nested
+    if _nested:
+        _nested[-1] += elapsed
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Time a block of code as a named phase.
+
+    :param name: The phase name.
+    """
+    token = begin()
+    try:
+        yield
+    finally:
+        end(name, token)
+
+
+def report(total, stream):
+    """
+    Write a summary of the phase timings.
+
+    :param total: The total elapsed time of the profiled block, in seconds.
+    :param stream: A file-like object where to write the summary.
+    """
+    rows = []
+    accounted = 0.0
+    for name, description in PHASES.items():
+        seconds = timings.get(name, 0.0)
+        if name == "imports":
+            # Imports happen before the profiled block starts.
+            rows.append((description, seconds, None))
+            continue
+        accounted += seconds
+        rows.append((description, seconds, _percent(seconds, total)))
+
+    for name in sorted(set(timings) - set(PHASES)):
+        accounted += timings[name]
+        rows.append((name, timings[name], _percent(timings[name], total)))
+
+    other = max(total - accounted, 0.0)
+    rows.append(("Other", other, _percent(other, total)))
+    rows.append(("TOTAL", total, _percent(total, total)))
+
+    stream.write(
+        tabulate.tabulate(rows, headers=["Phase", "Seconds", "%"], floatfmt=".4f")
+    )
+    stream.write("\n")
+
+
+def _percent(seconds, total):
+    return 100.0 * seconds / total if total else 0.0
+
+
+@contextlib.contextmanager
+def profiled(mode=None, output=None, limit=DEFAULT_LIMIT, stream=None):
+    """
+    Profile a block of code.
+
+    In "cprofile" mode the block is run under cProfile and the statistics
+    are either dumped to a file which can be loaded with pstats, or the
+    top functions by cumulative time are written to the stream.  In both
+    modes a breakdown of the wall-clock time per phase is written to the
+    stream.  If mode is None, the block is run without profiling.
+
+    :param mode: One of PROFILERS, or None. (Default value = None)
+    :param output: Optional filename for the cProfile statistics.
+    :param limit: Number of functions to show in the summary.
+                  (Default value = DEFAULT_LIMIT)
+    :param stream: Where to write the summaries. (Default value = stderr)
+    """
+    if mode is None:
+        yield
+        return
+
+    stream = stream or sys.stderr
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+
+    enable()
+    t0 = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        total = time.perf_counter() - t0
+        disable()
+
+        if profiler is not None:
+            if output:
+                profiler.dump_stats(output)
+                log.info("Wrote profile statistics to %s", output)
+            else:
+                stats = pstats.Stats(profiler, stream=stream)
+                stats.sort_stats("cumulative").print_stats(limit)
+
+        report(total, stream)
+        reset()
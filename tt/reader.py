@@ -0,0 +1,688 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+import collections
+from datetime import datetime, timedelta
+import logging
+
+from sqlalchemy import (
+    and_,
+    bindparam,
+    case,
+    cast,
+    column,
+    func,
+    Integer,
+    literal_column,
+    or_,
+    select,
+    table,
+    tuple_,
+    type_coerce,
+)
+
+from tt.datetime import local_time, split_days, split_hours, tz_local
+from tt.orm import Task, TaskTree, Timer, TimerTag
+import tt.profile
+from tt.sql import EpochDateTime, read_transaction
+
+log = logging.getLogger(__name__)
+
+TimerRow = collections.namedtuple("TimerRow", ["id", "task", "start", "stop"])
+"""A timer, with the name of its task and UTC start and stop times."""
+
+TaskRow = collections.namedtuple("TaskRow", ["id", "name", "description"])
+"""A task."""
+
+Measures = collections.namedtuple("Measures", ["elapsed", "count", "min", "max"])
+"""The total, number, shortest and longest elapsed seconds of some timers."""
+
+SearchRow = collections.namedtuple(
+    "SearchRow", ["id", "task", "start", "stop", "snippet"]
+)
+"""A timer whose note matches a search, with a snippet of the note."""
+
+# Read-only queries selecting only the columns needed for reporting, without
+# constructing ORM instances.  The statements are built once with bound
+# parameters, so that their compiled form is cached and reused by each call.
+
+_timer = Timer.__table__
+_task = Task.__table__
+
+_timers = select(
+    [_timer.c.id, _task.c.name, _timer.c.start, _timer.c.stop]
+).select_from(_timer.join(_task))
+
+_RUNNING = {
+    None: lambda statement: statement,
+    True: lambda statement: statement.where(_timer.c.stop.is_(None)),
+    False: lambda statement: statement.where(_timer.c.stop.isnot(None)),
+}
+
+# Restrict a selection to some tasks.  The list of task ids is expanded into
+# the IN clause when the statement is executed.
+_TASK_FILTER = {
+    False: lambda statement: statement,
+    True: lambda statement: statement.where(
+        _timer.c.task_id.in_(bindparam("task_ids", expanding=True))
+    ),
+}
+
+TagFilter = collections.namedtuple("TagFilter", ["include", "exclude"])
+"""Restrict a selection to the timers with any of the included tags and none
+of the excluded tags, given as lists of tag ids, either of which may be
+empty."""
+
+# Restrict a selection by tags.  Each list of tag ids is expanded into the
+# IN clause of a subquery, which is read from the primary key of timer_tag
+# on (tag_id, timer_id).
+_timer_tag = TimerTag.__table__
+
+
+def _tagged(name):
+    return _timer.c.id.in_(
+        select([_timer_tag.c.timer_id]).where(
+            _timer_tag.c.tag_id.in_(bindparam(name, expanding=True))
+        )
+    )
+
+
+_TAG_FILTER = {
+    (False, False): lambda statement: statement,
+    (True, False): lambda statement: statement.where(_tagged("tag_ids")),
+    (False, True): lambda statement: statement.where(~_tagged("not_tag_ids")),
+    (True, True): lambda statement: statement.where(_tagged("tag_ids")).where(
+        ~_tagged("not_tag_ids")
+    ),
+}
+
+# Select the timers overlapping a time range.  Each alternative is a range
+# of one index: on the start time for the timers started within the range,
+# and on the stop time for those started before it and stopped within or
+# after it, or still running.
+_overlapping = or_(
+    and_(_timer.c.start >= bindparam("start"), _timer.c.start < bindparam("end")),
+    and_(_timer.c.stop > bindparam("start"), _timer.c.start < bindparam("start")),
+    and_(_timer.c.stop.is_(None), _timer.c.start < bindparam("start")),
+)
+
+_SLICE = {
+    (running, filtered, tagged): _TAG_FILTER[tagged](
+        _TASK_FILTER[filtered](_RUNNING[running](_timers.where(_overlapping)))
+    )
+    for running in _RUNNING
+    for filtered in _TASK_FILTER
+    for tagged in _TAG_FILTER
+}
+
+# Grouping keys for aggregate(), computed by the database in the local time
+# zone of the connection.  Weeks start on Monday, and weekdays are numbered
+# from 0 for Monday, as in datetime.date.weekday().
+_local = (_timer.c.start, "unixepoch", "localtime")
+_DIMENSIONS = {
+    "task": _task.c.name,
+    "day": func.date(*_local),
+    "week": func.date(*(_local + ("weekday 0", "-6 days"))),
+    "month": func.date(*(_local + ("start of month",))),
+    "weekday": (cast(func.strftime("%w", *_local), Integer) + 6) % 7,
+    "hour": cast(func.strftime("%H", *_local), Integer),
+}
+
+# Attribute each timer to the ancestor of its task at a level of the task
+# hierarchy, or to its task if it is not as deep, by joining the one row of
+# the closure table which matches, whatever the depth of the hierarchy.
+_tree = TaskTree.__table__
+_rollup = _timer.join(
+    _tree,
+    and_(
+        _tree.c.descendant_id == _timer.c.task_id,
+        or_(
+            _tree.c.level == bindparam("level"),
+            and_(_tree.c.depth == 0, _tree.c.level < bindparam("level")),
+        ),
+    ),
+).join(_task, _task.c.id == _tree.c.ancestor_id)
+
+_stop = func.coalesce(_timer.c.stop, bindparam("now", type_=EpochDateTime()))
+_elapsed = _stop - _timer.c.start
+_measures = [
+    func.sum(_elapsed, type_=Integer),
+    func.count(),
+    func.min(_elapsed, type_=Integer),
+    func.max(_elapsed, type_=Integer),
+]
+
+# The aggregate statements are built when first used, for each combination
+# of dimensions.
+_AGGREGATES = {}
+
+# The dimensions of each piece of a timer which must be split, computed
+# from the local start time of the piece.
+_TIME_KEYS = {
+    "day": lambda local: local.date(),
+    "week": lambda local: local.date() - timedelta(days=local.weekday()),
+    "month": lambda local: local.date().replace(day=1),
+    "weekday": lambda local: local.weekday(),
+    "hour": lambda local: local.hour,
+}
+
+# Pages of timers in chronological order, selected by their position
+# (start, id) so that each page is read from the ix_timer_start_id index
+# without counting past the previous pages.
+_position = tuple_(_timer.c.start, _timer.c.id)
+_bound_position = tuple_(
+    bindparam("start", type_=EpochDateTime()), bindparam("id", type_=Integer)
+)
+
+_PAGE = {
+    (filtered, tagged): _TAG_FILTER[tagged](
+        _TASK_FILTER[filtered](
+            _timers.where(_position > _bound_position).where(
+                _timer.c.start < bindparam("end")
+            )
+        )
+    )
+    .order_by(_timer.c.start, _timer.c.id)
+    .limit(bindparam("limit"))
+    for filtered in _TASK_FILTER
+    for tagged in _TAG_FILTER
+}
+
+_RECENT = (
+    _timers.where(_position < _bound_position)
+    .order_by(_timer.c.start.desc(), _timer.c.id.desc())
+    .limit(bindparam("limit"))
+)
+
+_RECENT_ALL = _timers.order_by(_timer.c.start.desc(), _timer.c.id.desc()).limit(
+    bindparam("limit")
+)
+
+_POSITION = select([_timer.c.start, _timer.c.id]).where(_timer.c.id == bindparam("id"))
+
+# Search the full-text index of the notes, created by tt.sql.NOTE_INDEX.  The
+# index is referred to by its table name in the MATCH, snippet() and rank
+# expressions.
+_timer_note = table("timer_note", column("rowid", Integer))
+_note_index = literal_column("timer_note")
+
+_MATCHES = (
+    select(
+        [
+            _timer.c.id,
+            _task.c.name,
+            _timer.c.start,
+            _timer.c.stop,
+            func.snippet(_note_index, 0, "[", "]", "...", 12),
+        ]
+    )
+    .select_from(
+        _timer_note.join(_timer, _timer.c.id == _timer_note.c.rowid).join(_task)
+    )
+    .where(_note_index.op("MATCH")(bindparam("query")))
+    .where(_timer.c.start >= bindparam("start"))
+    .where(_timer.c.start < bindparam("end"))
+)
+
+_SEARCH = {
+    (filtered, tagged): _TAG_FILTER[tagged](_TASK_FILTER[filtered](_MATCHES))
+    .order_by(literal_column("rank"), _timer.c.start)
+    .limit(bindparam("limit"))
+    for filtered in _TASK_FILTER
+    for tagged in _TAG_FILTER
+}
+
+_TIMELINE = _timers.order_by(_timer.c.start, _timer.c.id)
+
+# The timeline of a time range: the timers started before the range and
+# still running at its start, read from ix_timer_stop and sorted once
+# selected, followed by those started within the range, read in order from
+# ix_timer_start_id.
+_COVERING = _timers.where(
+    or_(
+        and_(_timer.c.stop > bindparam("start"), _timer.c.start < bindparam("start")),
+        and_(_timer.c.stop.is_(None), _timer.c.start < bindparam("start")),
+    )
+)
+
+_TIMELINE_RANGE = (
+    _timers.where(_timer.c.start >= bindparam("start"))
+    .where(_timer.c.start < bindparam("end"))
+    .order_by(_timer.c.start, _timer.c.id)
+)
+
+_ACTIVE = _timers.where(_timer.c.stop.is_(None))
+_LAST = _timers.order_by(_timer.c.start.desc()).limit(1)
+_TASKS = select([_task.c.id, _task.c.name, _task.c.description])
+
+_compiled_cache = {}
+
+
+def _execute(statement, factory=tuple, **params):
+    """
+    Execute a statement, reusing its compiled form.
+
+    :param statement: One of the module level statements.
+    :param factory: The tuple type used for each row.
+    :param params: The values of the bound parameters.
+    :returns: The list of result rows.
+    """
+    with read_transaction() as session:
+        connection = session.connection().execution_options(
+            compiled_cache=_compiled_cache
+        )
+        result = connection.execute(statement, params)
+        with tt.profile.phase("orm"):
+            if factory is tuple:
+                return [tuple(row) for row in result]
+            return [factory._make(row) for row in result]
+
+
+def slice(start, end, running=None, task_ids=None, tags=None):
+    """
+    Select the timers overlapping a time range, in chronological order.
+
+    The timers are sorted once selected, rather than by the database, so
+    that it may select them from the indexes on both the start and stop
+    times.
+
+    :param start: The starting time (inclusive)
+    :param end: The ending time (exclusive)
+    :param running: If True, include only the running timer, if False, only
+                    stopped timers. (Default value = None, include both)
+    :param task_ids: If given, include only the timers of these tasks.
+    :param tags: If given, a TagFilter of the timers to include.
+    :returns: A list of TimerRow.
+    """
+    rows = _execute(
+        _SLICE[running, task_ids is not None, _tag_key(tags)],
+        TimerRow,
+        start=start,
+        end=end,
+        **_task_params(task_ids),
+        **_tag_params(tags)
+    )
+    rows.sort(key=lambda row: (row.start, row.id))
+    return rows
+
+
+def aggregate(
+    dimensions, start, end, now, running=None, task_ids=None, rollup=None, tags=None
+):
+    """
+    Aggregate the elapsed time of the timers overlapping a time range.
+
+    The timers are grouped and measured by the database, using the local
+    time zone of the database connection to determine the day, week, month,
+    weekday and hour of each timer.  Only the few timers which overlap the
+    start or end of the range, or, when grouping by time, cross midnight,
+    are returned individually, to be clipped to the range and split at
+    midnight before they are added to their groups.  When grouping by hour,
+    the timers crossing the start of an hour are split at each hour instead.
+    Each piece of a split timer is counted as a timer of its day or hour.
+
+    :param dimensions: A sequence of dimension names, from "task", "day",
+                       "week", "month", "weekday" and "hour".
+    :param start: The timezone-aware starting time (inclusive)
+    :param end: The timezone-aware ending time (exclusive)
+    :param now: The time used for the elapsed time of a running timer.
+    :param running: If True, include only the running timer, if False, only
+                    stopped timers. (Default value = None, include both)
+    :param task_ids: If given, include only the timers of these tasks.
+    :param rollup: If given, the level of the task hierarchy to which the
+                   time of subtasks is rolled up, from 1 for the tasks
+                   without a parent. (Default value = None)
+    :param tags: If given, a TagFilter of the timers to include.
+    :returns: A list of (key, Measures) tuples, ordered by the earliest
+              start time of each key.  The key is a tuple of one value per
+              dimension: a task name, a date for a day, week or month, or
+              an integer weekday or hour.
+    """
+    dimensions = tuple(dimensions)
+    if "task" not in dimensions:
+        rollup = None
+    params = {} if rollup is None else {"level": rollup}
+    rows = _execute(
+        _aggregate_statement(
+            dimensions, running, task_ids is not None, rollup, _tag_key(tags)
+        ),
+        start=start,
+        end=end,
+        now=now,
+        **_task_params(task_ids),
+        **_tag_params(tags),
+        **params
+    )
+    width = len(dimensions)
+    parsers = [_PARSERS.get(dimension, _nop) for dimension in dimensions]
+
+    groups = {}
+    first = {}
+    split = []
+    for row in rows:
+        if row[width]:
+            split.append(row)
+            continue
+        key = tuple(parse(value) for parse, value in zip(parsers, row[:width]))
+        groups[key] = merge(groups.get(key), Measures._make(row[width + 1 : -2]))
+        first[key] = min(first.get(key, row[-2]), row[-2])
+
+    for key, measures, piece_start in _split(dimensions, split, start, end):
+        groups[key] = merge(groups.get(key), measures)
+        first[key] = min(first.get(key, piece_start), piece_start)
+
+    return sorted(groups.items(), key=lambda group: first[group[0]])
+
+
+def _aggregate_statement(
+    dimensions, running, filtered, rollup=None, tagged=(False, False)
+):
+    """Build, or reuse, the statement grouping timers by some dimensions.
+
+    Besides the dimensions, the timers are grouped by the id of those which
+    must be clipped or split, and by 0 for all the others.  Each row ends
+    with the first start and last stop time, in epoch seconds.  If rolling
+    up, the task of each timer is its ancestor at the bound level.
+    """
+    rollup = rollup is not None
+    try:
+        return _AGGREGATES[dimensions, running, filtered, rollup, tagged]
+    except KeyError:
+        pass
+
+    whole = [_timer.c.start >= bindparam("start"), _stop <= bindparam("end")]
+    if set(dimensions) & set(_TIME_KEYS):
+        period = "%Y-%m-%d %H" if "hour" in dimensions else "%Y-%m-%d"
+        whole.append(
+            func.strftime(period, *_local)
+            == func.strftime(
+                period, type_coerce(_stop, Integer) - 1, "unixepoch", "localtime"
+            )
+        )
+    split = case([(and_(*whole), 0)], else_=_timer.c.id)
+
+    keys = [_DIMENSIONS[dimension] for dimension in dimensions] + [split]
+    statement = (
+        _TAG_FILTER[tagged](
+            _TASK_FILTER[filtered](
+                _RUNNING[running](
+                    select(
+                        keys
+                        + _measures
+                        + [
+                            func.min(_timer.c.start, type_=Integer),
+                            func.max(_stop, type_=Integer),
+                        ]
+                    )
+                    .select_from(_rollup if rollup else _timer.join(_task))
+                    .where(_overlapping)
+                )
+            )
+        )
+        .group_by(*keys)
+        .order_by(func.min(_timer.c.start))
+    )
+    _AGGREGATES[dimensions, running, filtered, rollup, tagged] = statement
+    return statement
+
+
+def _split(dimensions, rows, start, end):
+    """
+    Clip timers to a time range, and split them at midnight if grouping by
+    time, or at each hour if grouping by hour.
+
+    :param dimensions: The dimension names.
+    :param rows: The rows of the timers returned individually by the
+                 aggregate statement.
+    :param start: The starting time (inclusive)
+    :param end: The ending time (exclusive)
+    :yields: The key, Measures and start time of each piece.
+    """
+    if not rows:
+        return
+
+    width = len(dimensions)
+    starts = [row[-2] for row in rows]
+    stops = [row[-1] for row in rows]
+    if "hour" in dimensions:
+        index, starts, stops = split_hours(starts, stops, start, end)
+    elif set(dimensions) & set(_TIME_KEYS):
+        index, starts, stops = split_days(starts, stops, start, end)
+    else:
+        index = range(len(rows))
+        starts = [max(value, int(start.timestamp())) for value in starts]
+        stops = [min(value, int(end.timestamp())) for value in stops]
+
+    for i, piece_start, piece_stop in zip(index, starts, stops):
+        seconds = int(piece_stop - piece_start)
+        if seconds <= 0:
+            continue
+        local = datetime.fromtimestamp(piece_start, tz_local())
+        key = tuple(
+            row_value if dimension == "task" else _TIME_KEYS[dimension](local)
+            for dimension, row_value in zip(dimensions, rows[i][:width])
+        )
+        yield key, Measures(seconds, 1, seconds, seconds), piece_start
+
+
+def merge(a, b):
+    """
+    Combine the measures of two groups of timers.
+
+    :param a: A Measures, or None.
+    :param b: A Measures.
+    :returns: The measures of both groups together.
+    """
+    if a is None:
+        return b
+    return Measures(
+        a.elapsed + b.elapsed, a.count + b.count, min(a.min, b.min), max(a.max, b.max)
+    )
+
+
+def page(after, end, limit=None, task_ids=None, tags=None):
+    """
+    Select the timers following a position, in chronological order.
+
+    :param after: The (start, id) position after which to select.  Use an
+                  id of 0 to select from a start time (inclusive).
+    :param end: The time before which timers must start (exclusive).
+    :param limit: The maximum number of timers. (Default value = None, all)
+    :param task_ids: If given, include only the timers of these tasks.
+    :param tags: If given, a TagFilter of the timers to include.
+    :returns: A list of TimerRow.
+    """
+    start, id = after
+    return _execute(
+        _PAGE[task_ids is not None, _tag_key(tags)],
+        TimerRow,
+        start=start,
+        id=id,
+        end=end,
+        limit=_limit(limit),
+        **_task_params(task_ids),
+        **_tag_params(tags)
+    )
+
+
+def recent(limit, before=None):
+    """
+    Select the timers preceding a position, most recent first.
+
+    :param limit: The maximum number of timers.
+    :param before: The (start, id) position before which to select.  Use an
+                   id of 0 to select before a start time (exclusive).
+                   (Default value = None, the most recent timers)
+    :returns: A list of TimerRow.
+    """
+    if before is None:
+        return _execute(_RECENT_ALL, TimerRow, limit=_limit(limit))
+    start, id = before
+    return _execute(_RECENT, TimerRow, start=start, id=id, limit=_limit(limit))
+
+
+def timeline(batch=1000, start=None, end=None):
+    """
+    Stream all the timers in chronological order.
+
+    The timers are read in the order of the ix_timer_start_id index and
+    fetched in batches, so that memory use does not grow with the number of
+    timers.  Given a time range, only the timers overlapping it are read,
+    so the time taken grows with the range rather than the whole history.
+
+    :param batch: The number of timers fetched at a time. (Default 1000)
+    :param start: If given with end, the starting time (inclusive)
+    :param end: If given with start, the ending time (exclusive)
+    :yields: A TimerRow for each timer.
+    """
+    with read_transaction() as session:
+        connection = session.connection().execution_options(
+            compiled_cache=_compiled_cache
+        )
+        if start is None:
+            result = connection.execute(_TIMELINE)
+        else:
+            covering = connection.execute(_COVERING, start=start).fetchall()
+            for row in sorted(covering, key=lambda row: (row.start, row.id)):
+                yield TimerRow._make(row)
+            result = connection.execute(_TIMELINE_RANGE, start=start, end=end)
+        while True:
+            rows = result.fetchmany(batch)
+            if not rows:
+                return
+            for row in rows:
+                yield TimerRow._make(row)
+
+
+def search(text, start, end, limit=None, task_ids=None, tags=None):
+    """
+    Search the notes of the timers started within a time range.
+
+    Each word of the text must appear in the note.  A word ending with "*"
+    matches any word it starts.  The search reads the full-text index of the
+    notes rather than every note.
+
+    :param text: The words to search for.
+    :param start: The starting time (inclusive)
+    :param end: The ending time (exclusive)
+    :param limit: The maximum number of timers. (Default value = None, all)
+    :param task_ids: If given, include only the timers of these tasks.
+    :param tags: If given, a TagFilter of the timers to include.
+    :returns: A list of SearchRow, best match first.
+    """
+    query = _match_query(text)
+    if not query:
+        return []
+    return _execute(
+        _SEARCH[task_ids is not None, _tag_key(tags)],
+        SearchRow,
+        query=query,
+        start=start,
+        end=end,
+        limit=_limit(limit),
+        **_task_params(task_ids),
+        **_tag_params(tags)
+    )
+
+
+def _match_query(text):
+    """Quote each word of a search, so it is not read as an FTS5 operator."""
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append('"%s"%s' % (word.replace('"', '""'), "*" if prefix else ""))
+    return " ".join(terms)
+
+
+def position(id):
+    """
+    Look up the position of a timer, for page() and recent().
+
+    :param id: The ID of the timer.
+    :returns: The (start, id) tuple, or None if there is no such timer.
+    """
+    rows = _execute(_POSITION, id=id)
+    return rows[0] if rows else None
+
+
+def _task_params(task_ids):
+    return {} if task_ids is None else {"task_ids": list(task_ids)}
+
+
+def _tag_key(tags):
+    if tags is None:
+        return False, False
+    return bool(tags.include), bool(tags.exclude)
+
+
+def _tag_params(tags):
+    params = {}
+    if tags is not None and tags.include:
+        params["tag_ids"] = list(tags.include)
+    if tags is not None and tags.exclude:
+        params["not_tag_ids"] = list(tags.exclude)
+    return params
+
+
+def _limit(limit):
+    return -1 if limit is None else limit
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _nop(value):
+    return value
+
+
+_PARSERS = {"day": _parse_date, "week": _parse_date, "month": _parse_date}
+
+
+def active():
+    """Fetch the active timer as a TimerRow, or None if there is none."""
+    rows = _execute(_ACTIVE, TimerRow)
+    return rows[0] if rows else None
+
+
+def last():
+    """Fetch the last timer, active or not, as a TimerRow or None."""
+    rows = _execute(_LAST, TimerRow)
+    return rows[0] if rows else None
+
+
+def tasks():
+    """Select all tasks.
+
+    :returns: A list of TaskRow.
+    """
+    return _execute(_TASKS, TaskRow)
+
+
+def elapsed(row, now):
+    """
+    The duration of a timer, measuring a running timer up to now.
+
+    :param row: A TimerRow.
+    :param now: The timezone-aware current time.
+    """
+    return (row.stop or now) - row.start
+
+
+def as_dict(row, now):
+    """
+    Convert a timer to the dictionary representation used in reports.
+
+    :param row: A TimerRow.
+    :param now: The timezone-aware time used for the elapsed time of a
+                running timer.
+    """
+    return {
+        "id": row.id,
+        "task": row.task,
+        "start": local_time(row.start),
+        "stop": local_time(row.stop),
+        "elapsed": elapsed(row, now),
+    }
@@ -3,13 +3,20 @@
 
 import collections
 from datetime import datetime, timedelta, timezone
+import itertools
 import logging
 
-from sqlalchemy.orm.exc import NoResultFound
 
 from tt.exc import BadRequest, ValidationError
 from tt.datatable import Datatable
+import tt.check
 import tt.datetime
+from tt.datetime import local_time
+import tt.gaps
+import tt.meta
+import tt.pivot
+import tt.reader
+import tt.tag
 import tt.task
 import tt.timer
 
@@ -17,15 +24,16 @@ log = logging.getLogger(__name__)
 
 
 class TaskService(object):
-    def add(self, name, description=None):
+    def add(self, name, description=None, parent=None):
         """
         Add a new task.
 
         :param name: The task name.
         :param description:  An optional description.
+        :param parent: The name of an optional parent task.
         """
         log.debug("Add new task named %s", name)
-        tt.task.create(name=name, description=description)
+        tt.task.create(name=name, description=description, parent=parent)
 
     def remove(self, name):
         """
@@ -48,12 +56,39 @@ class TaskService(object):
 
         """
         log.debug("Renaming %s to %s", old_name, new_name)
-        try:
-            task = tt.task.get(name=old_name)
-        except NoResultFound:
+        task_id = tt.task.lookup(old_name)
+        if task_id is None:
             raise BadRequest("Unable to locate task with name %s" % old_name)
 
-        tt.task.update(task.id, name=new_name)
+        tt.task.update(task_id, name=new_name)
+
+    def merge(self, names, into):
+        """
+        Merge tasks into another task, moving all their records.
+
+        :param names: The names of the existing tasks to merge.
+        :param into: The name of the existing task to merge them into.
+        :returns: The number of records moved.
+        """
+        log.debug("Merging %s into %s", ", ".join(names), into)
+        try:
+            return tt.task.merge(names, into)
+        except ValidationError as err:
+            raise BadRequest(err)
+
+    def move(self, name, parent=None):
+        """
+        Move a task, along with its subtasks, under another task.
+
+        :param name: The name of the task.
+        :param parent: The name of the new parent task, or None to make the
+                       task a top-level task. (Default value = None)
+        """
+        log.debug("Moving task %s under %s", name, parent)
+        try:
+            tt.task.move(name, parent=parent)
+        except ValidationError as err:
+            raise BadRequest(err)
 
     def describe(self, name, description):
         """
@@ -63,12 +98,36 @@ class TaskService(object):
         :param description:  The new description
         """
         log.debug("Adding description to task %s: %s", name, description)
-        try:
-            task = tt.task.get(name=name)
-        except NoResultFound:
+        task_id = tt.task.lookup(name)
+        if task_id is None:
             raise BadRequest("Unable to locate task with name %s" % name)
 
-        tt.task.update(task.id, description=description)
+        tt.task.update(task_id, description=description)
+
+    def select(self, names=None, patterns=None):
+        """
+        Find the tasks to restrict a report to.
+
+        :param names: A list of task names. (Default value = None)
+        :param patterns: A list of shell-style patterns matching task names.
+                         (Default value = None)
+        :returns: The sorted list of the ids of the tasks named or matching
+                  any of the patterns, or None if neither names nor patterns
+                  are given.
+        :raises: BadRequest if a named task does not exist.
+        """
+        if not names and not patterns:
+            return None
+
+        task_ids = set()
+        for name in names or []:
+            task_id = tt.task.lookup(name)
+            if task_id is None:
+                raise BadRequest("Unable to locate task with name %s" % name)
+            task_ids.add(task_id)
+        for pattern in patterns or []:
+            task_ids.update(tt.task.matching(pattern))
+        return sorted(task_ids)
 
     def list(self):
         """
@@ -78,42 +137,58 @@ class TaskService(object):
         """
         log.debug("Fetching task list")
 
-        for task in tt.task.tasks():
+        for task in tt.reader.tasks():
             yield task.name, task.description
 
 
 class TimerService(object):
-    def start(self, task, timestamp=datetime.now(timezone.utc)):
+    """Operations on timers.
+
+    :param cache: An optional tt.cache.ReportCache used to store the total
+                  elapsed time of stopped timers when grouping a selection
+                  of records.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def start(self, task, timestamp=None, tags=None, note=None):
         """
         Start a timer.
 
         :param task: The name of an existing task.
         :param timestamp:  The timezone-aware start time.
-                           (Default value = datetime.now(timezone.utc)
+                           (Default value = tt.datetime.utc_now())
+        :param tags: The names of tags for the timer, created as needed.
+                     (Default value = None)
+        :param note: A free-text note on the timer. (Default value = None)
         """
+        timestamp = timestamp or tt.datetime.utc_now()
+
         if task is None:
-            last = tt.timer.last()
+            last = tt.reader.last()
             if last is not None:
                 log.debug("Resuming last task")
-                task = last["task"]
+                task = last.task
             else:
                 raise BadRequest("No task to resume")
 
         log.debug("Starting new timer for %s at %s", task, timestamp)
         try:
-            tt.timer.create(task=task, start=timestamp)
+            tt.timer.create(task=task, start=timestamp, tags=tags, note=note)
         except ValidationError as err:
             raise BadRequest(err)
 
-    def stop(self, timestamp=datetime.now(timezone.utc)):
+    def stop(self, timestamp=None):
         """
         Stop the active timer.
 
         :param timestamp:  The timezone-aware stop time.
-                           (Default value = datetime.now(timezone.utc)
+                           (Default value = tt.datetime.utc_now())
         """
+        timestamp = timestamp or tt.datetime.utc_now()
         log.debug("Stopping last active timer at %s", timestamp)
-        last = tt.timer.active()
+        last = tt.reader.active()
         if last is not None:
             tt.timer.update(last.id, stop=timestamp)
         else:
@@ -134,6 +209,52 @@ class TimerService(object):
         except ValidationError as err:
             raise BadRequest(err)
 
+    def tag(self, id, names):
+        """
+        Tag a timer, creating the tags which do not exist yet.
+
+        :param id: The ID of the existing timer.
+        :param names: The tag names.
+        """
+        log.debug("Tagging timer %s with %s", id, names)
+        try:
+            tt.tag.attach(id, names)
+        except ValidationError as err:
+            raise BadRequest(err)
+
+    def untag(self, id, names):
+        """
+        Remove tags from a timer.
+
+        :param id: The ID of the existing timer.
+        :param names: The names of existing tags.
+        """
+        log.debug("Untagging timer %s from %s", id, names)
+        try:
+            tt.tag.detach(id, names)
+        except ValidationError as err:
+            raise BadRequest(err)
+
+    def tag_filter(self, tags=None, not_tags=None):
+        """
+        Resolve the tags a selection of records is restricted to.
+
+        :param tags: If given, include only the records with any of these
+                     tags.
+        :param not_tags: If given, exclude the records with any of these
+                         tags.
+        :returns: A tt.reader.TagFilter, or None to include all records.
+        :raises: BadRequest if a tag does not exist.
+        """
+        if not tags and not not_tags:
+            return None
+        try:
+            return tt.reader.TagFilter(
+                tt.tag.lookup(tags or []), tt.tag.lookup(not_tags or [])
+            )
+        except ValidationError as err:
+            raise BadRequest(err)
+
     def delete(self, id):
         """
         Delete a timer by ID.
@@ -143,95 +264,257 @@ class TimerService(object):
         log.debug("Deleting existing timer with id %s", id)
         tt.timer.remove(id=id)
 
-    def slice_grouped_by_date(self, start=None, end=None, elapsed=False):
-        """Group a selection of records by date
+    def retag(self, task, new_task, start, end, dry_run=False):
+        """
+        Move the records of a task started within a time range to another
+        task.
+
+        :param task: The name of the task of the records.
+        :param new_task: The name of the task to move them to.
+        :param start: The timezone-aware starting time (inclusive).
+        :param end: The timezone-aware ending time (exclusive).
+        :param dry_run: If True, only count the records.
+                        (Default value = False)
+        :returns: The number of records moved, or which would be moved.
+        """
+        log.debug("Moving timers of %s from %s to %s to %s", task, start, end, new_task)
+        try:
+            return tt.timer.retag(task, new_task, start, end, dry_run=dry_run)
+        except ValidationError as err:
+            raise BadRequest(err)
 
-        :param start: The starting date (inclusive)
-        :param end: The ending date (exclusive)
-        :param elapsed: If True, return the total elapsed time per bucket.
-                        If False, return the list of matching timers per
-                        bucket.
-        :yields: A tuple of Date, and either a list of records or the total
-                 elapsed time.
+    def delete_range(self, task, start, end, dry_run=False):
         """
+        Delete the records of a task started within a time range.
+
+        :param task: The name of the task of the records.
+        :param start: The timezone-aware starting time (inclusive).
+        :param end: The timezone-aware ending time (exclusive).
+        :param dry_run: If True, only count the records.
+                        (Default value = False)
+        :returns: The number of records deleted, or which would be deleted.
+        """
+        log.debug("Deleting timers of %s from %s to %s", task, start, end)
+        try:
+            return tt.timer.remove_range(task, start, end, dry_run=dry_run)
+        except ValidationError as err:
+            raise BadRequest(err)
 
-        start = start or datetime(1970, 1, 1, tzinfo=timezone.utc)
-        end = end or datetime.now(tt.datetime.tz_local())
+    def position(self, id):
+        """
+        Look up the position of a timer, for paging through the records.
+
+        :param id: The ID of an existing timer.
+        :returns: The (start, id) position of the timer.
+        :raises: BadRequest if there is no such timer.
+        """
+        position = tt.reader.position(id)
+        if position is None:
+            raise BadRequest("No such timer %s" % id)
+        return position
 
-        timers = tt.timer.slice(start=start, end=end)
+    def page(self, after, end, limit=None, task_ids=None, tags=None):
+        """
+        List the records following a position, in chronological order.
+
+        :param after: The (start, id) position after which to list.  An id
+                      of 0 lists from the start time (inclusive).
+        :param end: The time before which records must start (exclusive).
+        :param limit: The maximum number of records. (Default value = None)
+        :param task_ids: If given, list only the records of these tasks.
+        :param tags: If given, a tt.reader.TagFilter of the records to list.
+        :returns: A list of record dictionaries.
+        """
+        now = tt.datetime.utc_now()
+        return [
+            tt.reader.as_dict(row, now)
+            for row in tt.reader.page(after, end, limit, task_ids, tags)
+        ]
 
-        results = collections.defaultdict(list)
-        for timer in timers:
-            key = timer["start"].date()
-            results[key].append(timer)
+    def recent(self, limit, before=None):
+        """
+        List the most recent records, most recent first.
 
-        for k, v in results.items():
-            if elapsed:
-                yield k, timedelta(
-                    seconds=sum([t["elapsed"].total_seconds() for t in v])
-                )
-            else:
-                yield k, v
+        :param limit: The maximum number of records.
+        :param before: The (start, id) position before which to list.  An id
+                       of 0 lists before the start time (exclusive).
+                       (Default value = None, the latest records)
+        :returns: A list of record dictionaries.
+        """
+        now = tt.datetime.utc_now()
+        return [tt.reader.as_dict(row, now) for row in tt.reader.recent(limit, before)]
+
+    def search(self, text, start=None, end=None, limit=None, task_ids=None, tags=None):
+        """
+        Search the notes of the records.
+
+        :param text: The words to search for, see tt.reader.search().
+        :param start: The starting date (inclusive), or None
+        :param end: The ending date (exclusive), or None
+        :param limit: The maximum number of records. (Default value = None)
+        :param task_ids: If given, include only the records of these tasks.
+        :param tags: If given, a tt.reader.TagFilter of the records to include.
+        :returns: A list of record dictionaries, best match first, with a
+                  snippet of the matching note.
+        """
+        start = start or datetime(1970, 1, 1, tzinfo=timezone.utc)
+        end = end or tt.datetime.local_now()
+        now = tt.datetime.utc_now()
+        return [
+            dict(tt.reader.as_dict(row, now), note=row.snippet)
+            for row in tt.reader.search(
+                text, start, end, limit, task_ids=task_ids, tags=tags
+            )
+        ]
+
+    def check(self, gaps=False):
+        """
+        Audit all the records for overlaps and negative durations.
 
-    def slice_grouped_by_task(self, start=None, end=None, elapsed=False):
-        """Group a selection of records by task
+        :param gaps: If True, also report the time between records.
+                     (Default value = False)
+        :yields: A dictionary for each problem, with its kind, the ids of the
+                 records involved, and the local start, stop and duration of
+                 the problem.
+        """
+        now = tt.datetime.utc_now()
+        for problem in tt.check.sweep(tt.reader.timeline(), now, gaps):
+            yield {
+                "kind": problem.kind,
+                "timers": ", ".join(str(id) for id in problem.timers),
+                "start": local_time(problem.start),
+                "stop": local_time(problem.stop),
+                "elapsed": abs(problem.stop - problem.start),
+            }
+
+    def untracked(self, start, end, hours, weekdays=False):
+        """
+        Find the working hours not covered by any record.
+
+        :param start: The timezone-aware starting time (inclusive)
+        :param end: The timezone-aware ending time (exclusive)
+        :param hours: The (start, end) datetime.time of the working day.
+        :param weekdays: If True, skip the weekends. (Default value = False)
+        :yields: A dictionary for each span of untracked time, with its
+                 local date, start, stop and duration.
+        """
+        now = tt.datetime.utc_now()
+        windows = tt.gaps.working_hours(start, end, hours, weekdays)
+        rows = tt.reader.timeline(start=start, end=end)
+        for gap in tt.gaps.untracked(rows, windows, now):
+            # The bounds are aware times, from the windows or the timers,
+            # rather than the naive UTC times local_time() expects.
+            start = gap.start.astimezone(tt.datetime.tz_local())
+            yield {
+                "date": start.date(),
+                "start": start,
+                "stop": gap.stop.astimezone(tt.datetime.tz_local()),
+                "elapsed": gap.stop - gap.start,
+            }
+
+    def slice_grouped_by_date(self, start=None, end=None, task_ids=None, tags=None):
+        """Group a selection of records by date
 
         :param start: The starting date (inclusive)
         :param end: The ending date (exclusive)
-        :param elapsed: If True, return the total elapsed time per bucket.
-                        If False, return the list of matching timers per
-                        bucket.
-        :yields: A tuple of task name, and either a list of records or the
-                 total elapsed time.
+        :param task_ids: If given, include only the records of these tasks.
+        :param tags: If given, a tt.reader.TagFilter of the records to include.
+        :yields: A tuple of Date, and the list of records started on that date.
         """
         start = start or datetime(1970, 1, 1, tzinfo=timezone.utc)
-        end = end or datetime.now(tt.datetime.tz_local())
+        end = end or tt.datetime.local_now()
+        now = tt.datetime.utc_now()
 
-        timers = tt.timer.slice(start=start, end=end)
+        results = collections.OrderedDict()
+        for row in tt.reader.slice(start=start, end=end, task_ids=task_ids, tags=tags):
+            day = local_time(row.start).date()
+            results.setdefault(day, []).append(tt.reader.as_dict(row, now))
 
-        results = collections.defaultdict(list)
-        for timer in timers:
-            key = timer["task"]
-            results[key].append(timer)
+        for key, timers in results.items():
+            yield key, timers
 
-        for k, v in results.items():
-            if elapsed:
-                yield k, timedelta(
-                    seconds=sum([t["elapsed"].total_seconds() for t in v])
-                )
-            else:
-                yield k, v
+    def aggregate(
+        self, dimensions, start=None, end=None, task_ids=None, rollup=None, tags=None
+    ):
+        """Measure the elapsed time of a selection of records by key.
 
-    def slice_grouped_by_date_task(self, start=None, end=None, elapsed=False):
-        """Group a selection of records by date and task
+        With a cache, the measures of the stopped timers are served from the
+        cache as long as the data version is unchanged, and only those of
+        the running timer are recomputed.
 
+        :param dimensions: A sequence of dimension names, see
+                           tt.pivot.DIMENSIONS.
         :param start: The starting date (inclusive)
         :param end: The ending date (exclusive)
-        :param elapsed: If True, return the total elapsed time per bucket.
-                        If False, return the list of matching timers per
-                        bucket.
-        :yields: A tuple of date, task name, and either a list of records or
-                 the total elapsed time.
+        :param task_ids: If given, include only the records of these tasks.
+        :param tags: If given, a tt.reader.TagFilter of the records to include.
+        :param rollup: If given, the level of the task hierarchy to which the
+                       time of subtasks is rolled up. (Default value = None)
+        :returns: A list of (key, tt.reader.Measures) tuples, ordered by the
+                  earliest start time of each key.
         """
-        start = start or datetime(1970, 1, 1, tzinfo=timezone.utc)
-        end = end or datetime.now(tt.datetime.tz_local())
+        dimensions = tuple(dimensions)
+        now = tt.datetime.utc_now()
+
+        if not self._cacheable(start, end):
+            start = start or datetime(1970, 1, 1, tzinfo=timezone.utc)
+            end = end or tt.datetime.local_now()
+            return tt.reader.aggregate(
+                dimensions,
+                start,
+                end,
+                now,
+                task_ids=task_ids,
+                rollup=rollup,
+                tags=tags,
+            )
+
+        version = tt.meta.version()
+        cache_key = ("aggregate", dimensions, rollup) + _range_key(
+            start, end, task_ids, tags
+        )
+
+        groups = self.cache.get(cache_key, version)
+        if groups is None:
+            groups = tt.reader.aggregate(
+                dimensions,
+                start,
+                end,
+                now,
+                running=False,
+                task_ids=task_ids,
+                rollup=rollup,
+                tags=tags,
+            )
+            self.cache.put(cache_key, version, groups)
+
+        groups = collections.OrderedDict(groups)
+        for key, measures in tt.reader.aggregate(
+            dimensions,
+            start,
+            end,
+            now,
+            running=True,
+            task_ids=task_ids,
+            rollup=rollup,
+            tags=tags,
+        ):
+            groups[key] = tt.reader.merge(groups.get(key), measures)
+        return list(groups.items())
 
-        timers = tt.timer.slice(start=start, end=end)
+    def _cacheable(self, start, end):
+        """True if totals for the given time range may be cached."""
+        return self.cache is not None and start is not None and end is not None
 
-        results = collections.defaultdict(lambda: collections.defaultdict(list))
-        for timer in timers:
-            date_key = timer["start"].date()
-            task_key = timer["task"]
-            results[date_key][task_key].append(timer)
 
-        for date_key, tasks in results.items():
-            for task_key, v in tasks.items():
-                if elapsed:
-                    yield date_key, task_key, timedelta(
-                        seconds=sum([t["elapsed"].total_seconds() for t in v])
-                    )
-                else:
-                    yield date_key, task_key, v
+def _range_key(start, end, task_ids, tags=None):
+    """The part of a cache key identifying a selection of records."""
+    return (
+        start.isoformat(),
+        end.isoformat(),
+        None if task_ids is None else tuple(task_ids),
+        None if tags is None else (tuple(tags.include), tuple(tags.exclude)),
+    )
 
 
 class ReportingService(object):
@@ -239,31 +522,161 @@ class ReportingService(object):
         self.timer_service = timer_service
         Datatable.table_fmt = "fancy_grid"
         Datatable.value_fn = self._formatter
+        Datatable.summary_fn = self._formatter
 
-    def timers_by_day(self, start, end):
+    def timers_by_day(self, start, end, task_ids=None, tags=None):
         for day, timers in self.timer_service.slice_grouped_by_date(
-            start=start, end=end
+            start=start, end=end, task_ids=task_ids, tags=tags
         ):
             columns = ["id", "task", "start", "stop", "elapsed"]
             table = Datatable(table=timers, headers=columns)
             table.caption = day.strftime("%A %B %d, %Y")
             yield table
 
-    def summary_by_task(self, start, end):
-        columns = ["elapsed"]
-        table = Datatable(headers=columns)
+    def records_by_day(self, records):
+        """
+        Tabulate records by the day they started.
 
-        total = timedelta(0)
-        for task, elapsed in self.timer_service.slice_grouped_by_task(
-            start=start, end=end, elapsed=True
+        :param records: A list of record dictionaries in chronological order.
+        :yields: A Datatable for each day.
+        """
+        columns = ["id", "task", "start", "stop", "elapsed"]
+        for day, timers in itertools.groupby(
+            records, key=lambda record: record["start"].date()
         ):
-            table.append({"elapsed": elapsed}, label=task)
-            total += elapsed
-        table.append({"elapsed": total}, label="TOTAL")
+            table = Datatable(table=list(timers), headers=columns)
+            table.caption = day.strftime("%A %B %d, %Y")
+            yield table
+
+    def log(self, records):
+        """
+        Tabulate records in the order given.
+
+        :param records: A list of record dictionaries.
+        :returns: A Datatable.
+        """
+        return Datatable(
+            table=records, headers=["id", "task", "start", "stop", "elapsed"]
+        )
+
+    def pivot(
+        self,
+        start,
+        end,
+        rows,
+        cols=(),
+        measure="elapsed",
+        task_ids=None,
+        plain=False,
+        rollup=None,
+        tags=None,
+    ):
+        """
+        Tabulate a measure of the time spent, grouped by rows and columns.
+
+        :param start: The starting time (inclusive)
+        :param end: The ending time (exclusive)
+        :param rows: The row dimensions, see tt.pivot.DIMENSIONS.
+        :param cols: The column dimensions. (Default value = ())
+        :param measure: One of tt.pivot.MEASURES. (Default value = "elapsed")
+        :param task_ids: If given, include only these tasks.
+        :param plain: If True, leave out the row and column totals, for
+                      machine-readable output. (Default value = False)
+        :param rollup: If given, the level of the task hierarchy to which the
+                       time of subtasks is rolled up. (Default value = None)
+        :param tags: If given, a tt.reader.TagFilter of the records to include.
+        :returns: A Datatable.
+        """
+        groups = self.timer_service.aggregate(
+            tuple(rows) + tuple(cols),
+            start=start,
+            end=end,
+            task_ids=task_ids,
+            rollup=rollup,
+            tags=tags,
+        )
+        return tt.pivot.tabulate(
+            groups,
+            rows,
+            cols,
+            measure,
+            totals=not plain,
+            summary_header="Total",
+            label_key="/".join(rows),
+        )
+
+    def matches(self, records):
+        """
+        Tabulate the records found by TimerService.search().
+
+        :param records: A list of record dictionaries.
+        :returns: A Datatable.
+        """
+        return Datatable(
+            table=records, headers=["id", "task", "start", "elapsed", "note"]
+        )
+
+    def untracked(self, gaps):
+        """
+        Tabulate the untracked time found by TimerService.untracked().
+
+        :param gaps: A list of untracked time dictionaries.
+        :returns: A Datatable.
+        """
+        return Datatable(table=gaps, headers=["date", "start", "stop", "elapsed"])
+
+    def problems(self, problems):
+        """
+        Tabulate the problems found by TimerService.check().
 
-        return table
+        :param problems: A list of problem dictionaries.
+        :returns: A Datatable.
+        """
+        return Datatable(
+            table=problems, headers=["kind", "timers", "start", "stop", "elapsed"]
+        )
 
-    def summary_by_day_and_task(self, start, end):
+    def summary_by_task(
+        self, start, end, task_ids=None, plain=False, rollup=None, tags=None
+    ):
+        """
+        Tabulate the total time per task.
+
+        :param start: The starting time (inclusive)
+        :param end: The ending time (exclusive)
+        :param task_ids: If given, include only these tasks.
+        :param plain: If True, leave out the TOTAL row, for machine-readable
+                      output. (Default value = False)
+        :param rollup: If given, the level of the task hierarchy to which the
+                       time of subtasks is rolled up. (Default value = None)
+        :param tags: If given, a tt.reader.TagFilter of the records to include.
+        :returns: A Datatable.
+        """
+        groups = self.timer_service.aggregate(
+            ("task",),
+            start=start,
+            end=end,
+            task_ids=task_ids,
+            rollup=rollup,
+            tags=tags,
+        )
+        return tt.pivot.tabulate(groups, ("task",), totals=not plain, label_key="task")
+
+    def summary_by_day_and_task(
+        self, start, end, task_ids=None, plain=False, tags=None
+    ):
+        """
+        Tabulate the total time per day and task, one table per week.
+
+        :param start: The starting time (inclusive)
+        :param end: The ending time (exclusive)
+        :param task_ids: If given, include only these tasks.
+        :param plain: If True, list the date, task and elapsed time of each
+                      total rather than a grid of tasks by days with totals,
+                      for machine-readable output. (Default value = False)
+        :param tags: If given, a tt.reader.TagFilter of the records to include.
+        :yields: A Datatable for each week with any records.
+        """
         extended_start, _ = tt.datetime.week_boundaries(start)
 
         for week_start in tt.datetime.range_weeks(extended_start, end):
@@ -273,47 +686,39 @@ class ReportingService(object):
 
             week_end = week_start + timedelta(days=7)
 
-            slice_ = list(
-                self.timer_service.slice_grouped_by_date_task(
-                    start=week_start, end=week_end, elapsed=True
-                )
+            groups = self.timer_service.aggregate(
+                ("day", "task"),
+                start=week_start,
+                end=week_end,
+                task_ids=task_ids,
+                tags=tags,
             )
 
-            if not slice_:
+            if not groups:
                 continue
 
-            sheet = collections.defaultdict(dict)
-            task_totals = collections.defaultdict(timedelta)
-            day_totals = collections.defaultdict(timedelta)
-
-            for date_key, task_key, elapsed in slice_:
-                sheet[task_key][date_key] = elapsed
-                task_totals[task_key] += elapsed
-                day_totals[date_key] += elapsed
-
-            table = Datatable(
-                header_fn=lambda x: x.strftime("%a %b %d"),
-                label_header=" " * 16,
-                summary_header="Total",
-            )
-            for t in sheet:
-                row = {k: v for k, v in sheet[t].items()}
-                table.append(
-                    row,
-                    label=t,
-                    summary=tt.datetime.timedelta_to_string(task_totals[t]),
+            if plain:
+                table = Datatable(
+                    table=(
+                        {
+                            "date": date_key,
+                            "task": task_key,
+                            "elapsed": tt.pivot.value(measures, "elapsed"),
+                        }
+                        for (date_key, task_key), measures in groups
+                    ),
+                    headers=["date", "task", "elapsed"],
+                )
+            else:
+                table = tt.pivot.tabulate(
+                    (((task, day), measures) for (day, task), measures in groups),
+                    ("task",),
+                    ("day",),
+                    label_header=" " * 16,
+                    summary_header="Total",
                 )
-            total_time = timedelta(
-                seconds=sum([t.total_seconds() for t in day_totals.values()])
-            )
-            table.append(
-                day_totals,
-                label="TOTAL",
-                summary=tt.datetime.timedelta_to_string(total_time),
-            )
 
             table.caption = "Week %s" % week_start.strftime("%W")
-
             yield table
 
     def _formatter(self, value):
@@ -1,19 +1,271 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved.
 
+import calendar
+import collections
 import contextlib
+from datetime import datetime, timezone
 import logging
+import os
+import re
+import time
+from urllib.request import pathname2url
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, Integer, text
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.types import TypeDecorator
 import sqlite3
 
+import tt.profile
+
 log = logging.getLogger(__name__)
 Session = scoped_session(sessionmaker(expire_on_commit=False))
+ReadSession = scoped_session(sessionmaker())
 
 DB_CONNECT_ARGS = {"detect_types": sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES}
 
+statistics = None
+"""The active Statistics collector, if any."""
+
+_read_only = False
+
+generation = 0
+"""Incremented by each connect(), to invalidate data cached per connection."""
+
+SCHEMA_VERSION = 8
+"""The current schema version, stored in the database user_version."""
+
+DATABASE_ID = "database_id"
+"""The key of the random id of each database in the meta table."""
+
+NOTE_INDEX = [
+    "CREATE VIRTUAL TABLE timer_note USING fts5("
+    "note, content='timer', content_rowid='id')",
+    "CREATE TRIGGER timer_note_insert AFTER INSERT ON timer "
+    "WHEN new.note IS NOT NULL BEGIN "
+    "INSERT INTO timer_note (rowid, note) VALUES (new.id, new.note); "
+    "END",
+    "CREATE TRIGGER timer_note_delete AFTER DELETE ON timer "
+    "WHEN old.note IS NOT NULL BEGIN "
+    "INSERT INTO timer_note (timer_note, rowid, note) "
+    "VALUES ('delete', old.id, old.note); "
+    "END",
+    "CREATE TRIGGER timer_note_update AFTER UPDATE OF note ON timer BEGIN "
+    "INSERT INTO timer_note (timer_note, rowid, note) "
+    "SELECT 'delete', old.id, old.note WHERE old.note IS NOT NULL; "
+    "INSERT INTO timer_note (rowid, note) "
+    "SELECT new.id, new.note WHERE new.note IS NOT NULL; "
+    "END",
+]
+"""The statements creating the full-text index of the timer notes.
+
+The index is an FTS5 table reading its content from the timer table, and
+kept up to date by triggers on the timer table.
+"""
+
+MIGRATIONS = {
+    # Store the timer start and stop times as integer epoch seconds rather
+    # than text.
+    1: [
+        "CREATE TABLE timer_new ("
+        "id INTEGER NOT NULL, "
+        "start INTEGER NOT NULL, "
+        "stop INTEGER, "
+        "task_id INTEGER NOT NULL, "
+        "PRIMARY KEY (id), "
+        "FOREIGN KEY(task_id) REFERENCES task (id))",
+        "INSERT INTO timer_new (id, start, stop, task_id) "
+        "SELECT id, "
+        "CAST(strftime('%s', start) AS INTEGER), "
+        "CAST(strftime('%s', stop) AS INTEGER), "
+        "task_id FROM timer",
+        "DROP TABLE timer",
+        "ALTER TABLE timer_new RENAME TO timer",
+    ],
+    # Index the timers in chronological order, for paging through them.
+    2: ["CREATE INDEX IF NOT EXISTS ix_timer_start_id ON timer (start, id)"],
+    # Index the timers of each task, for reports restricted to some tasks.
+    3: ["CREATE INDEX IF NOT EXISTS ix_timer_task_id_start ON timer (task_id, start)"],
+    # Index the stop times, to select the timers started before a time range
+    # and stopped within or after it.
+    4: ["CREATE INDEX IF NOT EXISTS ix_timer_stop ON timer (stop)"],
+    # Add the closure table of the task hierarchy, in which the existing
+    # tasks have no parent.
+    5: [
+        "CREATE TABLE task_tree ("
+        "ancestor_id INTEGER NOT NULL, "
+        "descendant_id INTEGER NOT NULL, "
+        "depth INTEGER NOT NULL, "
+        "level INTEGER NOT NULL, "
+        "PRIMARY KEY (descendant_id, ancestor_id), "
+        "FOREIGN KEY(ancestor_id) REFERENCES task (id), "
+        "FOREIGN KEY(descendant_id) REFERENCES task (id))",
+        "CREATE INDEX ix_task_tree_ancestor_id_depth "
+        "ON task_tree (ancestor_id, depth)",
+        "INSERT INTO task_tree (ancestor_id, descendant_id, depth, level) "
+        "SELECT id, id, 0, 1 FROM task",
+    ],
+    # Add the tags of the timers.
+    6: [
+        "CREATE TABLE tag ("
+        "id INTEGER NOT NULL, "
+        "name VARCHAR(24) NOT NULL, "
+        "PRIMARY KEY (id), "
+        "UNIQUE (name))",
+        "CREATE TABLE timer_tag ("
+        "tag_id INTEGER NOT NULL, "
+        "timer_id INTEGER NOT NULL, "
+        "PRIMARY KEY (tag_id, timer_id), "
+        "FOREIGN KEY(tag_id) REFERENCES tag (id), "
+        "FOREIGN KEY(timer_id) REFERENCES timer (id))",
+        "CREATE INDEX ix_timer_tag_timer_id ON timer_tag (timer_id)",
+    ],
+    # Add the notes of the timers, and their full-text index.
+    7: ["ALTER TABLE timer ADD COLUMN note VARCHAR(255)"] + NOTE_INDEX,
+    # Assign the database id, done by migrate() once the meta table exists.
+    8: [],
+}
+"""The statements upgrading an existing database to each schema version."""
+
+
+class EpochDateTime(TypeDecorator):
+    """A timezone-aware datetime stored as integer seconds since the epoch.
+
+    Values are always returned in UTC.  Sub-second precision is discarded,
+    and naive datetimes are rejected.
+    """
+
+    impl = Integer
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, datetime):
+            raise TypeError("expected datetime.datetime, not %r" % value)
+        if value.tzinfo is None:
+            raise ValueError("naive datetime is disallowed")
+        return calendar.timegm(value.utctimetuple())
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return datetime.fromtimestamp(value, timezone.utc)
+
+
+class Statistics(object):
+    """Counters for the SQL statements executed, grouped by statement shape.
+
+    The shape of a statement is its text with whitespace normalized and
+    lists of bound parameters collapsed, so that e.g. the same query with
+    a different number of values in an IN clause is counted together.
+    """
+
+    _whitespace = re.compile(r"\s+")
+    _parameters = re.compile(r"\?(?:\s*,\s*\?)+")
+
+    def __init__(self):
+        self.statements = collections.OrderedDict()
+
+    @classmethod
+    def shape(cls, statement):
+        """
+        Determine the shape of a statement.
+
+        :param statement: The SQL text of the statement.
+        :returns: The normalized SQL text.
+        """
+        statement = cls._whitespace.sub(" ", statement).strip()
+        return cls._parameters.sub("?, ...", statement)
+
+    def _entry(self, shape):
+        try:
+            return self.statements[shape]
+        except KeyError:
+            entry = self.statements[shape] = {"count": 0, "rows": 0, "seconds": 0.0}
+            return entry
+
+    def executed(self, shape, seconds):
+        """
+        Count one execution of a statement.
+
+        :param shape: The statement shape.
+        :param seconds: The time spent executing the statement.
+        """
+        entry = self._entry(shape)
+        entry["count"] += 1
+        entry["seconds"] += seconds
+
+    def fetched(self, shape, rows):
+        """
+        Count rows fetched or affected by a statement.
+
+        :param shape: The statement shape.
+        :param rows: The number of rows.
+        """
+        self._entry(shape)["rows"] += rows
+
+    def totals(self):
+        """
+        Sum the counters over all statements.
+
+        :returns: A dictionary with the total count, rows and seconds.
+        """
+        return {
+            key: sum(entry[key] for entry in self.statements.values())
+            for key in ("count", "rows", "seconds")
+        }
+
+    def as_list(self):
+        """
+        List the counters per statement, the most expensive first.
+
+        :returns: A list of dictionaries, each with the statement shape and
+                  its count, rows and seconds.
+        """
+        return sorted(
+            (
+                dict(statement=shape, **entry)
+                for shape, entry in self.statements.items()
+            ),
+            key=lambda entry: entry["seconds"],
+            reverse=True,
+        )
+
+
+class _CountingCursor(sqlite3.Cursor):
+    """A cursor which counts the rows fetched from it."""
+
+    statement = None
+
+    def _count(self, rows):
+        if statistics is not None and self.statement is not None:
+            statistics.fetched(self.statement, rows)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+
+class _CountingConnection(sqlite3.Connection):
+    """A connection creating cursors which count the rows fetched."""
+
+    def cursor(self, factory=_CountingCursor):
+        return super().cursor(factory)
+
 
 class _Base(object):
     def __eq__(self, other):
@@ -47,31 +299,217 @@ Base = declarative_base(cls=_Base)
 
 @contextlib.contextmanager
 def transaction():
-    """Access the session."""
+    """Access the session.
+
+    Transactions may be nested, in which case only the outermost one is
+    committed, or rolled back if an exception is raised within it.  The
+    changes made within a nested transaction are flushed when it ends.
+    """
     session = Session()
+    depth = session.info.get("tt_depth", 0)
+    if depth:
+        session.info["tt_depth"] = depth + 1
+        try:
+            yield session
+            session.flush()
+        finally:
+            session.info["tt_depth"] = depth
+        return
+
+    session.info["tt_depth"] = 1
     try:
         yield session
         session.commit()
     except Exception:
         session.rollback()
+        session.info.pop("tt_after_commit", None)
         raise
     finally:
+        callbacks = session.info.pop("tt_after_commit", {})
         Session.remove()
 
+    for callback in callbacks:
+        callback()
+
+
+def in_transaction():
+    """True if called from within a transaction()."""
+    return Session.registry.has() and Session().info.get("tt_depth", 0) > 0
+
+
+def after_commit(callback):
+    """
+    Call a function once the current transaction is committed.
+
+    Outside of a transaction the function is called immediately.  Within
+    a transaction, it is called once after the outermost transaction
+    commits, however many times it was registered, and never if the
+    transaction is rolled back.
+
+    :param callback: A function taking no arguments.
+    """
+    if not in_transaction():
+        callback()
+        return
+    Session().info.setdefault("tt_after_commit", collections.OrderedDict())[
+        callback
+    ] = True
+
+
+@contextlib.contextmanager
+def read_transaction():
+    """Access a session for reading only.
+
+    For a database file, the session uses a separate read-only connection
+    which reads a consistent snapshot of the database without blocking, or
+    being blocked by, a concurrent write.  Nothing is ever committed.  For
+    an in-memory database, or within a transaction(), this is the same as
+    transaction() so that uncommitted changes are visible.
+    """
+    if not _read_only or in_transaction():
+        with transaction() as session:
+            yield session
+        return
+
+    session = ReadSession()
+    try:
+        yield session
+    finally:
+        ReadSession.remove()
+
 
 def connect(db_url="sqlite:///timetrack.db", echo=False):
     """
     Create a persistent connection to the given database.
 
+    A database file is switched to write-ahead logging, and a second,
+    read-only engine is configured for read_transaction().
+
     :param db_url:  The URL to the database.
                     (Default value = 'sqlite:///timetrack.db')
     :param echo:  Log all interactions with the database.
                   (Default value = False)
     """
+    global _read_only, generation
     log.info("Connecting to database %s", db_url)
 
-    engine = create_engine(
-        db_url, connect_args=DB_CONNECT_ARGS, native_datetime=True, echo=echo
-    )
-    Base.metadata.create_all(engine)
+    connect_args = dict(DB_CONNECT_ARGS)
+    if statistics is not None:
+        connect_args["factory"] = _CountingConnection
+
+    engine = _create_engine(db_url, connect_args=connect_args, echo=echo)
+
+    database = make_url(db_url).database
+    _read_only = database not in (None, "", ":memory:")
+    if _read_only:
+        with engine.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+
+    with engine.begin() as connection:
+        migrate(connection)
     Session.configure(bind=engine)
+    generation += 1
+
+    if _read_only:
+        read_engine = _create_engine(
+            db_url, creator=lambda: _connect_read_only(database), echo=echo
+        )
+        event.listen(read_engine, "begin", _begin_snapshot)
+        ReadSession.configure(bind=read_engine)
+
+
+def _create_engine(db_url, **kwargs):
+    engine = create_engine(db_url, native_datetime=True, **kwargs)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    return engine
+
+
+def _connect_read_only(database):
+    """Open a read-only DBAPI connection to a database file."""
+    connect_args = dict(DB_CONNECT_ARGS)
+    if statistics is not None:
+        connect_args["factory"] = _CountingConnection
+    uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(database))
+    connection = sqlite3.connect(uri, uri=True, **connect_args)
+    # Transactions are started explicitly by _begin_snapshot().
+    connection.isolation_level = None
+    return connection
+
+
+def _begin_snapshot(conn):
+    """Start a read transaction, so all statements see the same snapshot."""
+    conn.execute("BEGIN")
+
+
+def migrate(connection):
+    """
+    Create the schema, upgrading an existing database if needed.
+
+    The schema version is tracked in the SQLite user_version.  A database
+    created before versioning was introduced has version 0.  Each database
+    is given a random id when it is created or upgraded, which tells it
+    apart from any other database, e.g. in the report cache.
+
+    :param connection: A connection within a transaction.
+    """
+    version = connection.execute("PRAGMA user_version").scalar()
+    if version >= SCHEMA_VERSION:
+        return
+
+    if connection.dialect.has_table(connection, "timer"):
+        for upgrade in range(version + 1, SCHEMA_VERSION + 1):
+            log.info("Upgrading database schema to version %d", upgrade)
+            for statement in MIGRATIONS[upgrade]:
+                connection.execute(statement)
+
+    Base.metadata.create_all(connection)
+    connection.execute(
+        text("INSERT OR IGNORE INTO meta (key, value) VALUES (:key, random())"),
+        key=DATABASE_ID,
+    )
+    connection.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+
+def enable_statistics():
+    """
+    Start collecting statement statistics.
+
+    Rows fetched are only counted for connections made after this call.
+
+    :returns: The Statistics collector.
+    """
+    global statistics
+    statistics = Statistics()
+    return statistics
+
+
+def disable_statistics():
+    """Stop collecting statement statistics."""
+    global statistics
+    statistics = None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    started = time.perf_counter() if statistics is not None else None
+    conn.info.setdefault("tt_profile", []).append((tt.profile.begin(), started))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    token, started = conn.info["tt_profile"].pop()
+    tt.profile.end("sql", token)
+
+    if statistics is not None and started is not None:
+        shape = Statistics.shape(statement)
+        statistics.executed(shape, time.perf_counter() - started)
+        if cursor.description is None and cursor.rowcount > 0:
+            statistics.fetched(shape, cursor.rowcount)
+        if isinstance(cursor, _CountingCursor):
+            cursor.statement = shape
+
+
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get("tt_profile"):
+        token, _ = context.connection.info["tt_profile"].pop()
+        tt.profile.end("sql", token)
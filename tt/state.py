@@ -0,0 +1,99 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# This module is used by the fast path of the prompt command, and must only
+# import from the standard library.
+
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = "state.json"
+
+filename = None
+"""The state file maintained by save(), or None to not maintain one."""
+
+
+def configure(path):
+    """
+    Set the state file to maintain.
+
+    :param path: The filename, or None to stop maintaining the state file.
+    """
+    global filename
+    filename = path
+
+
+def save(timer):
+    """
+    Atomically record the active timer in the state file.
+
+    :param timer: An object with the id, task name and timezone-aware start
+                  of the active timer, such as a tt.reader.TimerRow, or None
+                  if no timer is running.
+    """
+    if filename is None:
+        return
+
+    state = {}
+    if timer is not None:
+        state = {"id": timer.id, "task": timer.task, "start": timer.start.timestamp()}
+
+    directory = os.path.dirname(filename) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".state-")
+    try:
+        with os.fdopen(fd, "w") as out:
+            json.dump(state, out)
+        os.replace(tmp, filename)
+    except Exception:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def load(path, db_file):
+    """
+    Read the state file, unless it is out of date.
+
+    The state file is out of date if the database was modified after it,
+    e.g. by a version of the application which did not maintain it.
+
+    :param path: The state filename.
+    :param db_file: The database filename.
+    :returns: The state dictionary, which is empty if no timer is running,
+              or None if the state file is missing, unreadable or out of
+              date.
+    """
+    try:
+        if os.path.getmtime(db_file) > os.path.getmtime(path):
+            return None
+        with open(path) as in_:
+            state = json.load(in_)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(state, dict):
+        return None
+    return state
+
+
+def format_prompt(state, now=None):
+    """
+    Format the active timer for a shell prompt.
+
+    :param state: The state dictionary.
+    :param now: The current time in seconds since the epoch.
+                (Default value = time.time())
+    :returns: The task name and elapsed "HH:MM", or an empty string if no
+              timer is running.
+    """
+    if not state:
+        return ""
+    now = time.time() if now is None else now
+    hours, remainder = divmod(max(int(now - state["start"]), 0), 3600)
+    return "%s %02d:%02d" % (state["task"], hours, remainder // 60)
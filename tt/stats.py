@@ -0,0 +1,126 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+import contextlib
+import json
+import sys
+import time
+
+import tabulate
+
+import tt.profile
+import tt.sql
+
+FORMATS = ("table", "json")
+STATEMENT_WIDTH = 60
+
+
+def as_dict(statistics, total):
+    """
+    Collect the statement statistics and phase timings.
+
+    :param statistics: A tt.sql.Statistics instance.
+    :param total: The total elapsed time, in seconds.
+    :returns: A dictionary suitable for serializing as JSON.
+    """
+    return {
+        "total": total,
+        "phases": dict(tt.profile.timings),
+        "sql": statistics.totals(),
+        "statements": statistics.as_list(),
+    }
+
+
+def write_table(data, stream):
+    """
+    Write the statistics as compact tables.
+
+    :param data: The dictionary returned by as_dict().
+    :param stream: A file-like object where to write the tables.
+    """
+    rows = [
+        (
+            _truncate(entry["statement"]),
+            entry["count"],
+            entry["rows"],
+            1000.0 * entry["seconds"],
+        )
+        for entry in data["statements"]
+    ]
+    rows.append(
+        (
+            "TOTAL",
+            data["sql"]["count"],
+            data["sql"]["rows"],
+            1000.0 * data["sql"]["seconds"],
+        )
+    )
+    stream.write(
+        tabulate.tabulate(
+            rows, headers=["Statement", "Count", "Rows", "ms"], floatfmt=".2f"
+        )
+    )
+    stream.write("\n\n")
+
+    phases = [
+        (tt.profile.PHASES.get(name, name), 1000.0 * data["phases"][name])
+        for name in sorted(data["phases"], key=_phase_order)
+    ]
+    phases.append(("TOTAL", 1000.0 * data["total"]))
+    stream.write(tabulate.tabulate(phases, headers=["Phase", "ms"], floatfmt=".2f"))
+    stream.write("\n")
+
+
+def _phase_order(name):
+    """Sort known phases in reporting order, followed by any others."""
+    order = list(tt.profile.PHASES)
+    return (order.index(name) if name in order else len(order), name)
+
+
+def _truncate(statement):
+    if len(statement) <= STATEMENT_WIDTH:
+        return statement
+    return statement[: STATEMENT_WIDTH - 3] + "..."
+
+
+@contextlib.contextmanager
+def collected(enabled=True, fmt="table", output=None, stream=None):
+    """
+    Collect statement statistics and phase timings for a block of code.
+
+    The database connection must be made within the block for the rows
+    fetched to be counted.
+
+    :param enabled: If False, the block is run without collecting.
+                    (Default value = True)
+    :param fmt: One of FORMATS. (Default value = "table")
+    :param output: Optional filename where to write the statistics.
+    :param stream: Where to write the statistics if no output file is
+                   given. (Default value = stderr)
+    """
+    if not enabled:
+        yield
+        return
+
+    statistics = tt.sql.enable_statistics()
+    tt.profile.enable()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        total = time.perf_counter() - t0
+        tt.profile.disable()
+        tt.sql.disable_statistics()
+
+        data = as_dict(statistics, total)
+        tt.profile.reset()
+
+        with contextlib.ExitStack() as stack:
+            out = stream or sys.stderr
+            if output:
+                out = stack.enter_context(open(output, "w"))
+            if fmt == "json":
+                json.dump(data, out)
+                out.write("\n")
+            else:
+                write_table(data, out)
@@ -0,0 +1,95 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+# Tags mark timers across tasks, e.g. as "billable" or "on-call".  Reports
+# are filtered by tag in tt.reader.
+
+import logging
+
+from tt.exc import ValidationError
+import tt.meta
+from tt.orm import Tag, Timer, TimerTag
+from tt.sql import read_transaction, transaction
+
+log = logging.getLogger(__name__)
+
+
+def attach(timer_id, names):
+    """
+    Tag a timer, creating the tags which do not exist yet.
+
+    :param timer_id: The ID of an existing timer.
+    :param names: The tag names.
+    :raises: ValidationError if there is no such timer, or a name is empty.
+    """
+    log.debug("tagging timer %s with %s", timer_id, names)
+
+    if "" in names:
+        raise ValidationError("Cannot use empty tag")
+
+    with transaction() as session:
+        if session.query(Timer.id).filter(Timer.id == timer_id).scalar() is None:
+            raise ValidationError("No such timer %s" % timer_id)
+
+        ids = _ids(session, names)
+        for name in names:
+            if name not in ids:
+                tag = Tag(name=name)
+                session.add(tag)
+                session.flush()
+                ids[name] = tag.id
+
+        tagged = {
+            row.tag_id
+            for row in session.query(TimerTag.tag_id).filter(
+                TimerTag.timer_id == timer_id
+            )
+        }
+        session.add_all(
+            TimerTag(tag_id=tag_id, timer_id=timer_id)
+            for tag_id in set(ids.values()) - tagged
+        )
+        tt.meta.bump(session)
+
+
+def detach(timer_id, names):
+    """
+    Remove tags from a timer.
+
+    :param timer_id: The ID of an existing timer.
+    :param names: The names of existing tags.
+    :raises: ValidationError if a tag does not exist.
+    """
+    log.debug("untagging timer %s from %s", timer_id, names)
+
+    with transaction() as session:
+        ids = _ids(session, names)
+        _check(names, ids)
+        session.query(TimerTag).filter(
+            TimerTag.timer_id == timer_id, TimerTag.tag_id.in_(ids.values())
+        ).delete(synchronize_session=False)
+        tt.meta.bump(session)
+
+
+def lookup(names):
+    """
+    Look up the ids of some tags by name.
+
+    :param names: The names of existing tags.
+    :returns: The sorted list of tag ids.
+    :raises: ValidationError if a tag does not exist.
+    """
+    with read_transaction() as session:
+        ids = _ids(session, names)
+    _check(names, ids)
+    return sorted(ids.values())
+
+
+def _ids(session, names):
+    return dict(session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)))
+
+
+def _check(names, ids):
+    for name in names:
+        if name not in ids:
+            raise ValidationError("No such tag %s" % name)
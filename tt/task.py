@@ -1,52 +1,147 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved
 
+import collections
+import fnmatch
+import functools
 import logging
 
+from sqlalchemy import and_, bindparam, select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
 from tt.exc import ValidationError
-from tt.orm import Task
-from tt.sql import transaction
+import tt.meta
+from tt.orm import Task, TaskTree, Timer
+import tt.sql
+from tt.sql import read_transaction, transaction
+import tt.timer
 
 log = logging.getLogger(__name__)
 
+_ids = None
+"""The task ids by name, loaded once per connection by lookup()."""
 
-def create(name, description=None):
+_ids_generation = None
+
+_task = Task.__table__
+_timer = Timer.__table__
+
+# Move all the timers of a task, selected on the ix_timer_task_id_start
+# index, then remove the task.
+_MOVE = (
+    _timer.update()
+    .where(_timer.c.task_id == bindparam("from_id"))
+    .values(task_id=bindparam("to_id"))
+)
+_REMOVE = _task.delete().where(_task.c.id == bindparam("from_id"))
+
+# Confirm that a registered id still belongs to a task, by primary key.
+_CONFIRM = select([_task.c.id]).where(
+    and_(_task.c.id == bindparam("id"), _task.c.name == bindparam("name"))
+)
+
+# Remove a task without subtasks from the hierarchy.
+_UNLINK = TaskTree.__table__.delete().where(
+    TaskTree.__table__.c.descendant_id == bindparam("from_id")
+)
+
+# Move a subtree of the hierarchy, rooted at the task bound to "id", under
+# the task bound to "parent_id": detach the subtree from the ancestors of
+# its root, shift the levels within it, then link it to the new parent and
+# each of its ancestors.
+_tree = TaskTree.__table__
+_subtree = select([_tree.c.descendant_id]).where(_tree.c.ancestor_id == bindparam("id"))
+_DETACH = _tree.delete().where(
+    and_(_tree.c.descendant_id.in_(_subtree), ~_tree.c.ancestor_id.in_(_subtree))
+)
+_RELEVEL = (
+    _tree.update()
+    .where(_tree.c.ancestor_id.in_(_subtree))
+    .values(level=_tree.c.level + bindparam("shift"))
+)
+_above = _tree.alias("above")
+_below = _tree.alias("below")
+_ATTACH = _tree.insert().from_select(
+    ["ancestor_id", "descendant_id", "depth", "level"],
+    select(
+        [
+            _above.c.ancestor_id,
+            _below.c.descendant_id,
+            _above.c.depth + _below.c.depth + 1,
+            _above.c.level,
+        ]
+    )
+    .where(_above.c.descendant_id == bindparam("parent_id"))
+    .where(_below.c.ancestor_id == bindparam("id")),
+)
+
+
+def create(name, description=None, parent=None):
     """
     Create a new task.
 
     :param name: The task name.
     :param description:  An optional description which will be shown when
                          listing tasks.
+    :param parent: The name of an existing task of which the new task is a
+                   subtask. (Default value = None)
     :raises: ValidationError If there is a database conflict because a task
-             with the given name already exists, or if the name is invalid.
+             with the given name already exists, if the name is invalid, or
+             if the parent does not exist.
     """
-    log.debug("creating task with name %s, description=%s", name, description)
+    log.debug(
+        "creating task with name %s, description=%s, parent=%s",
+        name,
+        description,
+        parent,
+    )
 
     if name == "":
         raise ValidationError("Cannot use empty name")
 
     try:
         with transaction() as session:
+            ancestors = []
+            if parent is not None:
+                ancestors = (
+                    session.query(TaskTree)
+                    .join(Task, Task.id == TaskTree.descendant_id)
+                    .filter(Task.name == parent)
+                    .all()
+                )
+                if not ancestors:
+                    raise ValidationError("No such task %s" % parent)
+
             task = Task(name=name, description=description)
             session.add(task)
+            session.flush()
+            session.add_all(
+                [
+                    TaskTree(
+                        ancestor_id=row.ancestor_id,
+                        descendant_id=task.id,
+                        depth=row.depth + 1,
+                        level=row.level,
+                    )
+                    for row in ancestors
+                ]
+                + [
+                    TaskTree(
+                        ancestor_id=task.id,
+                        descendant_id=task.id,
+                        depth=0,
+                        level=len(ancestors) + 1,
+                    )
+                ]
+            )
+            tt.meta.bump(session)
+            _changed(session)
+            tt.sql.after_commit(functools.partial(_register, name, task.id))
     except IntegrityError:
         raise ValidationError("A task with name %s already exists" % name)
 
 
-def get(name):
-    """
-    Get a task record by name.
-
-    :param name: The name of the task.
-    :return: A Task record.
-    """
-    with transaction() as session:
-        return session.query(Task).filter(Task.name == name).one()
-
-
 def update(id, name=None, description=None):
     """
     Update an existing task with the supplied name or desciption.
@@ -59,30 +154,86 @@ def update(id, name=None, description=None):
     :param id: The ID of an existing task.
     :param name: A new name for the task. (Default value = None)
     :param description:  A new description for the task. (Default value = None)
-    :raises: ValidationError If the name already exists on a different task,
-             or if the name is invalid.
+    :raises: ValidationError If there is no such task, the name already
+             exists on a different task, or the name is invalid.
     """
     log.debug("updating task %s with name=%s", id, name)
 
     try:
         with transaction() as session:
             task = session.query(Task).get(id)
+            if task is None:
+                raise ValidationError("No such task %s" % id)
             if name is not None:
+                _changed(session)
+                tt.sql.after_commit(functools.partial(_unregister, task.name))
+                tt.sql.after_commit(functools.partial(_register, name, id))
                 task.name = name
             if description is not None:
                 if description == "":
                     task.description = None
                 else:
                     task.description = description
+            tt.meta.bump(session)
     except IntegrityError:
         raise ValidationError("A task with name %s already exists" % name)
 
+    if name is not None:
+        # The active timer may belong to the renamed task.
+        tt.sql.after_commit(tt.timer.save_state)
+
+
+def move(name, parent=None):
+    """
+    Move a task, along with its subtasks, under another task.
+
+    The closure table rows linking the subtree of the task to its former
+    ancestors are replaced by a few statements, however deep or large the
+    subtree.
+
+    :param name: The name of an existing task.
+    :param parent: The name of the existing task to move it under, or None
+                   to make it a top-level task. (Default value = None)
+    :raises: ValidationError if a task does not exist, or if the parent is
+             the task itself or one of its subtasks.
+    """
+    log.debug("moving task %s under %s", name, parent)
 
-def tasks():
-    """Generator for iterating through all tasks."""
     with transaction() as session:
-        for task in session.query(Task).all():
-            yield task
+        task = _node(session, name)
+        params = {"id": task.descendant_id, "shift": 1 - task.level}
+        if parent is not None:
+            node = _node(session, parent)
+            cycle = session.query(TaskTree).filter(
+                TaskTree.ancestor_id == task.descendant_id,
+                TaskTree.descendant_id == node.descendant_id,
+            )
+            if session.query(cycle.exists()).scalar():
+                raise ValidationError(
+                    "Cannot move task %s under its own subtask %s" % (name, parent)
+                )
+            params.update(
+                parent_id=node.descendant_id, shift=node.level + 1 - task.level
+            )
+
+        session.execute(_DETACH, params)
+        session.execute(_RELEVEL, params)
+        if parent is not None:
+            session.execute(_ATTACH, params)
+        tt.meta.bump(session)
+
+
+def _node(session, name):
+    """The closure table row of a task at a depth of 0."""
+    row = (
+        session.query(TaskTree)
+        .join(Task, Task.id == TaskTree.descendant_id)
+        .filter(Task.name == name, TaskTree.depth == 0)
+        .one_or_none()
+    )
+    if row is None:
+        raise ValidationError("No such task %s" % name)
+    return row
 
 
 def remove(name):
@@ -90,7 +241,7 @@ def remove(name):
     Remove a task by name.
 
     A task may be removed only if there are no timers, active or stopped,
-    using the existing task.
+    using the existing task, and it has no subtasks.
 
     :param name: The name of an existing task.
     :raises: ValidationError if no task exists with the given name, or if
@@ -105,6 +256,175 @@ def remove(name):
             except NoResultFound:
                 raise ValidationError("no such task with name %s", name)
 
+            if _parent_among(session, [task.id]) is not None:
+                raise ValidationError("Can not remove a task with subtasks")
+
             session.delete(task)
+            session.execute(_UNLINK, {"from_id": task.id})
+            tt.meta.bump(session)
+            _changed(session)
+            tt.sql.after_commit(functools.partial(_unregister, name))
     except IntegrityError:
         raise ValidationError("Can not remove a task with existing records")
+
+
+def merge(names, into):
+    """
+    Merge tasks into another task.
+
+    The timers of each task are moved to the other task by a single UPDATE
+    statement, and the task removed, all in one transaction however many
+    timers there are.
+
+    :param names: The names of the existing tasks to merge.
+    :param into: The name of the existing task to merge them into.
+    :returns: The number of timers moved.
+    :raises: ValidationError if a task does not exist, if a task to merge
+             has subtasks, or if the task to merge into is among the tasks
+             to merge.
+    """
+    log.debug("merge tasks %s into %s", names, into)
+
+    names = list(collections.OrderedDict.fromkeys(names))
+    if into in names:
+        raise ValidationError("Cannot merge task %s into itself" % into)
+
+    with transaction() as session:
+        ids = dict(
+            session.query(Task.name, Task.id).filter(Task.name.in_(names + [into]))
+        )
+        for name in names + [into]:
+            if name not in ids:
+                raise ValidationError("No such task %s" % name)
+
+        parent = _parent_among(session, [ids[name] for name in names])
+        if parent is not None:
+            raise ValidationError("Cannot merge task %s with subtasks" % parent)
+
+        count = 0
+        for name in names:
+            params = {"from_id": ids[name], "to_id": ids[into]}
+            count += session.execute(_MOVE, params).rowcount
+            session.execute(_UNLINK, params)
+            session.execute(_REMOVE, params)
+            tt.sql.after_commit(functools.partial(_unregister, name))
+        tt.meta.bump(session)
+        _changed(session)
+
+    # The active timer may belong to a merged task.
+    tt.sql.after_commit(tt.timer.save_state)
+    return count
+
+
+def lookup(name):
+    """
+    Look up the id of a task by name.
+
+    The ids of all tasks are loaded on first use after connecting, and kept
+    up to date by create(), update() and remove() once their changes are
+    committed.  Within a transaction which changed tasks, the database is
+    queried instead.  Tasks created by other processes are looked up in the
+    database when first used, and the ids written are confirmed by
+    resolve().
+
+    :param name: The name of the task.
+    :returns: The id of the task, or None if there is no such task.
+    """
+    global _ids, _ids_generation
+
+    if _in_changed_transaction():
+        return _query_id(name)
+
+    if _ids is None or _ids_generation != tt.sql.generation:
+        _ids = _load_ids()
+        _ids_generation = tt.sql.generation
+
+    if name not in _ids:
+        id = _query_id(name)
+        if id is None:
+            return None
+        _ids[name] = id
+    return _ids[name]
+
+
+def resolve(session, name):
+    """
+    Look up the id of a task by name within a write transaction.
+
+    The id registered by lookup() is stale if another process removed,
+    renamed or merged the task since, and the database does not enforce
+    the references to it.  It is confirmed within the transaction before
+    it is written, and the task looked up again if it has changed.
+
+    :param session: The session of the transaction making the change.
+    :param name: The name of the task.
+    :returns: The id of the task, or None if there is no such task.
+    """
+    id = lookup(name)
+    if id is None or session.execute(_CONFIRM, {"id": id, "name": name}).scalar():
+        return id
+
+    log.debug("task %s changed since id %s was registered", name, id)
+    _unregister(name)
+    return lookup(name)
+
+
+def matching(pattern):
+    """
+    Find the tasks whose names match a shell-style pattern.
+
+    The task names are read from the database, and also refresh the ids
+    used by lookup().
+
+    :param pattern: A case-sensitive pattern as understood by fnmatch,
+                    e.g. "client-*".
+    :returns: The sorted list of matching task ids.
+    """
+    global _ids, _ids_generation
+
+    ids = _load_ids()
+    if not _in_changed_transaction():
+        _ids = dict(ids)
+        _ids_generation = tt.sql.generation
+    return sorted(id for name, id in ids.items() if fnmatch.fnmatchcase(name, pattern))
+
+
+def _load_ids():
+    with read_transaction() as session:
+        return dict(session.query(Task.name, Task.id))
+
+
+def _parent_among(session, task_ids):
+    """The name of one of the tasks which has subtasks, or None."""
+    row = (
+        session.query(Task.name)
+        .join(TaskTree, TaskTree.ancestor_id == Task.id)
+        .filter(TaskTree.ancestor_id.in_(task_ids), TaskTree.depth > 0)
+        .first()
+    )
+    return row and row.name
+
+
+def _in_changed_transaction():
+    return tt.sql.in_transaction() and tt.sql.Session().info.get("tt_tasks_changed")
+
+
+def _query_id(name):
+    with read_transaction() as session:
+        row = session.query(Task.id).filter(Task.name == name).one_or_none()
+    return row and row.id
+
+
+def _changed(session):
+    """Mark the transaction as having changed tasks, see lookup()."""
+    session.info["tt_tasks_changed"] = True
+
+
+def _register(name, id):
+    if _ids is not None:
+        _ids[name] = id
+
+
+def _unregister(name):
+    if _ids is not None:
+        _ids.pop(name, None)
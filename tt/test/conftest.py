@@ -2,10 +2,41 @@
 # All rights reserved.
 
 import logging
+import time
 
 import pytest
 
-from tt.sql import connect, transaction
+import tt.sql
+from tt.sql import connect, Session
+import tt.state
+
+
+class StatementCounter(object):
+    """Count the SQL statements executed within a block of code."""
+
+    def __enter__(self):
+        self.statistics = tt.sql.enable_statistics()
+        return self
+
+    def __exit__(self, *exc_info):
+        tt.sql.disable_statistics()
+
+    @property
+    def count(self):
+        """The total number of statements executed."""
+        return self.statistics.totals()["count"]
+
+    def selects(self, table):
+        """
+        The number of SELECT statements reading from a table.
+
+        :param table: The table name.
+        """
+        return sum(
+            entry["count"]
+            for shape, entry in self.statistics.statements.items()
+            if shape.startswith("SELECT") and " FROM %s" % table in shape
+        )
 
 
 @pytest.fixture(scope="module")
@@ -19,5 +50,37 @@ def log():
 def session(log):
     connect(db_url="sqlite:///", echo=False)
 
-    with transaction() as session:
-        yield session
+    # Not a transaction(), which the functions under test would join
+    # rather than commit their own.
+    session = Session()
+    yield session
+    Session.remove()
+
+
+@pytest.fixture
+def count_statements():
+    """
+    Count the SQL statements executed within a block, e.g.
+
+        with count_statements() as counter:
+            ...
+        assert counter.count == 1
+    """
+    return StatementCounter
+
+
+@pytest.fixture(autouse=True)
+def state_file():
+    """Stop maintaining any state file configured by a test."""
+    yield
+    tt.state.configure(None)
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    """Use a local time zone other than UTC, with daylight saving time."""
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
@@ -0,0 +1,109 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved
+
+import os
+
+import pytest
+
+from tt.cache import ReportCache
+
+
+@pytest.fixture
+def filename(tmpdir):
+    return str(tmpdir.join("reports.cache"))
+
+
+def test_get_missing():
+    cache = ReportCache()
+    assert cache.get("foo", 1) is None
+
+
+def test_put_get():
+    cache = ReportCache()
+    cache.put("foo", 1, {"bar": 2})
+
+    assert cache.get("foo", 1) == {"bar": 2}
+
+
+def test_get_stale_version():
+    cache = ReportCache()
+    cache.put("foo", 1, "bar")
+
+    assert cache.get("foo", 2) is None
+    assert "foo" not in cache.entries
+
+
+def test_lru_eviction():
+    cache = ReportCache(size=2)
+    cache.put("one", 1, 1)
+    cache.put("two", 1, 2)
+
+    # Touch "one" so that "two" becomes the least recently used.
+    assert cache.get("one", 1) == 1
+    cache.put("three", 1, 3)
+
+    assert cache.get("two", 1) is None
+    assert cache.get("one", 1) == 1
+    assert cache.get("three", 1) == 3
+
+
+def test_clear():
+    cache = ReportCache()
+    cache.put("foo", 1, "bar")
+    cache.clear()
+
+    assert cache.get("foo", 1) is None
+
+
+def test_flush_and_load(filename):
+    cache = ReportCache(filename)
+    cache.put("foo", 1, "bar")
+    cache.flush()
+
+    assert ReportCache(filename).get("foo", 1) == "bar"
+
+
+def test_flush_unchanged(filename):
+    cache = ReportCache(filename)
+    assert cache.get("foo", 1) is None
+    cache.flush()
+
+    assert not os.path.exists(filename)
+
+
+def test_flush_after_get(filename):
+    cache = ReportCache(filename)
+    cache.put("foo", 1, "bar")
+    cache.flush()
+    os.remove(filename)
+
+    # Reading alone does not rewrite the file.
+    assert cache.get("foo", 1) == "bar"
+    cache.flush()
+
+    assert not os.path.exists(filename)
+
+
+def test_flush_in_memory():
+    cache = ReportCache()
+    cache.put("foo", 1, "bar")
+    cache.flush()
+
+
+def test_flush_error_removes_temporary_file(filename, mocker):
+    mocker.patch("pickle.dump", side_effect=ValueError)
+    cache = ReportCache(filename)
+    cache.put("foo", 1, "bar")
+
+    with pytest.raises(ValueError):
+        cache.flush()
+
+    assert os.listdir(os.path.dirname(filename)) == []
+
+
+@pytest.mark.parametrize("content", [b"garbage", b"\x80\x03]q\x00."])
+def test_load_invalid(filename, content):
+    with open(filename, "wb") as out:
+        out.write(content)
+
+    assert ReportCache(filename).get("foo", 1) is None
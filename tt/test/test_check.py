@@ -0,0 +1,64 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tt.check import Problem, sweep
+from tt.reader import TimerRow
+
+T0 = datetime(2018, 2, 12, 9, 0, tzinfo=timezone.utc)
+NOW = T0 + timedelta(hours=8)
+
+
+def row(id, start, stop=None):
+    return TimerRow(
+        id,
+        "foo",
+        T0 + timedelta(hours=start),
+        None if stop is None else T0 + timedelta(hours=stop),
+    )
+
+
+def hours(h):
+    return T0 + timedelta(hours=h)
+
+
+def test_sweep_clean():
+    rows = [row(1, 0, 1), row(2, 1, 2), row(3, 3)]
+    assert list(sweep(rows, NOW)) == []
+
+
+def test_sweep_overlap():
+    rows = [row(1, 0, 2), row(2, 1, 3)]
+    assert list(sweep(rows, NOW)) == [Problem("overlap", hours(1), hours(2), (1, 2))]
+
+
+def test_sweep_overlap_contained():
+    # The second timer is checked against the first, which ends last.
+    rows = [row(1, 0, 4), row(2, 1, 2), row(3, 3, 5)]
+    assert list(sweep(rows, NOW)) == [
+        Problem("overlap", hours(1), hours(2), (1, 2)),
+        Problem("overlap", hours(3), hours(4), (1, 3)),
+    ]
+
+
+def test_sweep_running_overlap():
+    rows = [row(1, 0), row(2, 1, 2)]
+    assert list(sweep(rows, NOW)) == [Problem("overlap", hours(1), hours(2), (1, 2))]
+
+
+def test_sweep_negative():
+    rows = [row(1, 0, 1), row(2, 3, 2), row(3, 4, 5)]
+    assert list(sweep(rows, NOW)) == [Problem("negative", hours(3), hours(2), (2,))]
+
+
+@pytest.mark.parametrize("gaps,expected", [(False, []), (True, [(1, 2), (2, 3)])])
+def test_sweep_gaps(gaps, expected):
+    rows = [row(1, 0, 1), row(2, 2, 3), row(3, 5)]
+    problems = list(sweep(rows, NOW, gaps=gaps))
+    assert [p.timers for p in problems] == expected
+    assert all(p.kind == "gap" for p in problems)
+    if gaps:
+        assert (problems[1].start, problems[1].stop) == (hours(3), hours(5))
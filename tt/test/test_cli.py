@@ -2,19 +2,33 @@
 # All rights reserved.
 
 import calendar
-from datetime import datetime, timedelta
+import contextlib
+from datetime import datetime, time, timedelta, timezone
 import logging
 import io
+import json
+import shlex
 from unittest import mock
 
 import pytest
 
 import tt
 import tt.cli
+import tt.reader
+import tt.task
 from tt.datatable import Datatable
-from tt.datetime import tz_local, start_of_day
+from tt.datetime import frozen, start_of_day, tz_local, utc_now
 from tt.exc import BadRequest, ParseError
 
+SETTINGS = dict(tt.cli.DATEPARSER_SETTINGS, RELATIVE_BASE=mock.ANY)
+
+
+@pytest.fixture
+def freeze():
+    """Freeze the clock of the commands at an instant, until the test ends."""
+    with contextlib.ExitStack() as stack:
+        yield lambda instant: stack.enter_context(frozen(instant))
+
 
 @pytest.fixture
 def task_service(mocker):
@@ -27,6 +41,7 @@ def task_service(mocker):
 @pytest.fixture
 def timer_service(mocker):
     service = mocker.MagicMock(spec=tt.cli.TimerService)
+    service.tag_filter.return_value = None
     init = mocker.patch("tt.cli.TimerService")
     init.return_value = service
     return service
@@ -75,9 +90,13 @@ def test_create(options, task_service):
     tt.cli.main(options)
 
     if len(options) == 2:
-        task_service.add.assert_called_with(name=options[1], description=None)
+        task_service.add.assert_called_with(
+            name=options[1], description=None, parent=None
+        )
     else:
-        task_service.add.assert_called_with(name=options[1], description=options[2])
+        task_service.add.assert_called_with(
+            name=options[1], description=options[2], parent=None
+        )
 
 
 def test_describe(task_service):
@@ -86,6 +105,44 @@ def test_describe(task_service):
     task_service.describe.assert_called_with(name="foo", description="bar")
 
 
+def test_create_subtask(task_service):
+    tt.cli.main(["create", "web", "--parent", "acme"])
+    task_service.add.assert_called_with(name="web", description=None, parent="acme")
+
+
+@pytest.mark.parametrize(
+    "options,parent,out",
+    [
+        (["--parent", "acme"], "acme", 'Moved task "web" under "acme"\n'),
+        (["--top"], None, 'Moved task "web" to the top level\n'),
+    ],
+)
+def test_move(options, parent, out, task_service, capsys):
+    tt.cli.main(["move", "web"] + options)
+
+    task_service.move.assert_called_once_with(name="web", parent=parent)
+    assert capsys.readouterr().out == out
+
+
+@pytest.mark.parametrize("options", [[], ["--parent", "acme", "--top"]])
+def test_move_needs_one_target(options, task_service):
+    with pytest.raises(SystemExit):
+        tt.cli.main(["move", "web"] + options)
+
+    assert not task_service.move.called
+
+
+def test_merge_tasks(task_service, capsys):
+    task_service.merge.return_value = 3
+
+    tt.cli.main(["merge-tasks", "foo", "bar", "baz"])
+
+    task_service.merge.assert_called_once_with(names=["foo", "bar"], into="baz")
+    assert (
+        capsys.readouterr().out == 'Merged "foo", "bar" into "baz", moving 3 records\n'
+    )
+
+
 def test_rename(task_service):
     options = ["rename", "foo", "bar"]
     tt.cli.main(options)
@@ -117,15 +174,24 @@ def test_start(parse, options, mocker, timer_service):
     tt.cli.main(options)
 
     if len(options) == 3:
-        parse.assert_called_with(options[2], settings=tt.cli.DATEPARSER_SETTINGS)
+        parse.assert_called_with(options[2], settings=SETTINGS)
     else:
-        parse.assert_called_with("now", settings=tt.cli.DATEPARSER_SETTINGS)
+        parse.assert_called_with("now", settings=SETTINGS)
 
     timer_service.start.assert_called_with(
-        task=options[1], timestamp=timestamp.replace().replace().astimezone()
+        task=options[1],
+        timestamp=timestamp.replace().replace().astimezone(),
+        tags=None,
+        note=None,
     )
 
 
+def test_start_tags(timer_service):
+    tt.cli.main(["start", "foo", "--tag", "billable", "--tag", "meeting"])
+
+    assert timer_service.start.call_args[1]["tags"] == ["billable", "meeting"]
+
+
 @pytest.mark.parametrize("options", [["stop", "now"], ["stop"]])
 @mock.patch("dateparser.parse")
 def test_stop(parse, options, mocker, timer_service):
@@ -136,9 +202,9 @@ def test_stop(parse, options, mocker, timer_service):
     tt.cli.main(options)
 
     if len(options) == 2:
-        parse.assert_called_with(options[1], settings=tt.cli.DATEPARSER_SETTINGS)
+        parse.assert_called_with(options[1], settings=SETTINGS)
     else:
-        parse.assert_called_with("now", settings=tt.cli.DATEPARSER_SETTINGS)
+        parse.assert_called_with("now", settings=SETTINGS)
 
     timer_service.stop.assert_called_with(
         timestamp=timestamp.replace().replace().astimezone()
@@ -150,13 +216,51 @@ def test_edit_delete_timer(timer_service):
     timer_service.delete.assert_called_once_with(id=1)
 
 
+@pytest.mark.parametrize("dry_run,verb", [(False, "Moved"), (True, "Would move")])
+def test_retag(dry_run, verb, timer_service, capsys):
+    t0 = datetime.now(tz_local()).replace(microsecond=0) - timedelta(days=2)
+    t1 = t0 + timedelta(days=1)
+    timer_service.retag.return_value = 3
+
+    argv = ["retag", "--from", "foo", "--to", "bar"]
+    argv += ["--begin", t0.isoformat(), "--end", t1.isoformat()]
+    tt.cli.main(argv + (["--dry-run"] if dry_run else []))
+
+    timer_service.retag.assert_called_once_with("foo", "bar", t0, t1, dry_run=dry_run)
+    assert capsys.readouterr().out == '%s 3 records from "foo" to "bar"\n' % verb
+
+
+@pytest.mark.parametrize("dry_run,verb", [(False, "Deleted"), (True, "Would delete")])
+def test_delete(dry_run, verb, timer_service, capsys):
+    t0 = datetime.now(tz_local()).replace(microsecond=0) - timedelta(days=2)
+    t1 = t0 + timedelta(days=1)
+    timer_service.delete_range.return_value = 2
+
+    argv = ["delete", "--task", "foo", "--begin", t0.isoformat()]
+    argv += ["--end", t1.isoformat()]
+    tt.cli.main(argv + (["--dry-run"] if dry_run else []))
+
+    timer_service.delete_range.assert_called_once_with("foo", t0, t1, dry_run=dry_run)
+    assert capsys.readouterr().out == '%s 2 records of "foo"\n' % verb
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [["delete", "--begin", "today", "--end", "now"], ["delete", "--task", "foo"]],
+)
+def test_delete_required_arguments(argv, timer_service):
+    with pytest.raises(SystemExit):
+        tt.cli.main(argv)
+    assert not timer_service.delete_range.called
+
+
 @mock.patch("dateparser.parse")
 def test_edit_start_time(parse, mocker, timer_service):
     now = mocker.MagicMock(spec=datetime)
     parse.return_value = now
 
     tt.cli.main(["edit", "1", "--start", "now"])
-    parse.assert_called_once_with("now", settings=tt.cli.DATEPARSER_SETTINGS)
+    parse.assert_called_once_with("now", settings=SETTINGS)
     timer_service.update.assert_called_once_with(
         id=1, task=None, start=now.replace().replace().astimezone(), stop=None
     )
@@ -168,7 +272,7 @@ def test_edit_stop_time(parse, mocker, timer_service):
     parse.return_value = now
 
     tt.cli.main(["edit", "1", "--stop", "now"])
-    parse.assert_called_once_with("now", settings=tt.cli.DATEPARSER_SETTINGS)
+    parse.assert_called_once_with("now", settings=SETTINGS)
     timer_service.update.assert_called_once_with(
         id=1, task=None, start=None, stop=now.replace().replace().astimezone()
     )
@@ -186,16 +290,59 @@ def test_edit_make_active(timer_service):
     timer_service.update.assert_called_once_with(id=1, stop="")
 
 
-@mock.patch("tt.cli.datetime", spec=datetime)
-def test_summary(mock_datetime, timer_service, reporting_service):
+def test_edit_tags(timer_service, capsys):
+    tt.cli.main(["edit", "1", "--tag", "billable", "--untag", "a", "--untag", "b"])
+
+    timer_service.tag.assert_called_once_with(id=1, names=["billable"])
+    timer_service.untag.assert_called_once_with(id=1, names=["a", "b"])
+    assert not timer_service.update.called
+    assert capsys.readouterr().out == (
+        'Tagged timer "1" with billable\nUntagged timer "1" from a, b\n'
+    )
+
+
+def test_summary(freeze, timer_service, reporting_service):
     t0 = start_of_day(datetime.now(tz_local()))
     t1 = t0 + timedelta(days=1)
 
-    mock_datetime.now.return_value = t0
+    freeze(t0)
 
     tt.cli.main(["summary"])
 
-    reporting_service.summary_by_task.assert_called_once_with(start=t0, end=t1)
+    reporting_service.summary_by_task.assert_called_once_with(
+        start=t0, end=t1, task_ids=None, plain=False, rollup=None, tags=None
+    )
+
+
+@pytest.mark.parametrize(
+    "command,count",
+    [
+        (["summary"], 1),
+        (["records"], 1),
+        (["report"], 1),
+        (["pivot"], 1),
+        (["status"], 2),
+        (["search", "planning"], 1),
+    ],
+)
+def test_report_tag_filter(command, count, timer_service, reporting_service):
+    reporting_service.pivot.return_value = Datatable(table=[])
+    timer_service.tag_filter.return_value = tt.reader.TagFilter([1], [2])
+    timer_service.search.return_value = []
+
+    tt.cli.main(command + ["--tag", "billable", "--not-tag", "meeting"])
+
+    timer_service.tag_filter.assert_called_once_with(
+        tags=["billable"], not_tags=["meeting"]
+    )
+    calls = (
+        reporting_service.summary_by_task.call_args_list
+        + reporting_service.timers_by_day.call_args_list
+        + reporting_service.summary_by_day_and_task.call_args_list
+        + reporting_service.pivot.call_args_list
+        + timer_service.search.call_args_list
+    )
+    assert [c[1]["tags"] for c in calls] == [tt.reader.TagFilter([1], [2])] * count
 
 
 def test_summary_begin_end(timer_service, reporting_service):
@@ -204,18 +351,21 @@ def test_summary_begin_end(timer_service, reporting_service):
 
     tt.cli.main(["summary", "--begin", t0.isoformat(), "--end", t1.isoformat()])
 
-    reporting_service.summary_by_task.assert_called_once_with(start=t0, end=t1)
+    reporting_service.summary_by_task.assert_called_once_with(
+        start=t0, end=t1, task_ids=None, plain=False, rollup=None, tags=None
+    )
 
 
-@mock.patch("tt.cli.datetime", spec=datetime)
-def test_records(mock_datetime, timer_service, reporting_service):
+def test_records(freeze, timer_service, reporting_service):
     t0 = start_of_day(datetime.now(tz_local()))
     t1 = t0 + timedelta(days=1)
 
-    mock_datetime.now.return_value = t0
+    freeze(t0)
     tt.cli.main(["records"])
 
-    reporting_service.timers_by_day.assert_called_once_with(start=t0, end=t1)
+    reporting_service.timers_by_day.assert_called_once_with(
+        start=t0, end=t1, task_ids=None, tags=None
+    )
 
 
 def test_records_begin_end(mocker, timer_service, reporting_service):
@@ -224,7 +374,449 @@ def test_records_begin_end(mocker, timer_service, reporting_service):
 
     tt.cli.main(["records", "--begin", t0.isoformat(), "--end", t1.isoformat()])
 
-    reporting_service.timers_by_day.assert_called_once_with(start=t0, end=t1)
+    reporting_service.timers_by_day.assert_called_once_with(
+        start=t0, end=t1, task_ids=None, tags=None
+    )
+
+
+def test_records_limit(timer_service, reporting_service, datatable, capsys):
+    t0 = datetime.now(tz_local()).replace(microsecond=0) - timedelta(hours=4)
+    t1 = t0 + timedelta(hours=3)
+    timer_service.page.return_value = [{"id": 7}, {"id": 9}]
+    reporting_service.records_by_day.return_value = iter([datatable])
+
+    tt.cli.main(
+        ["records", "--begin", t0.isoformat(), "--end", t1.isoformat(), "--limit", "2"]
+    )
+
+    timer_service.page.assert_called_once_with(
+        (t0, 0), t1, limit=2, task_ids=None, tags=None
+    )
+    reporting_service.records_by_day.assert_called_once_with(
+        timer_service.page.return_value
+    )
+    end = timer_service.page.call_args[0][1]
+    assert capsys.readouterr().out.endswith(
+        "More records: tt records --end %s --limit 2 --after 9\n" % end.isoformat()
+    )
+
+
+def test_records_limit_keeps_filters(
+    task_service, timer_service, reporting_service, capsys
+):
+    task_service.select.return_value = [1, 2]
+    timer_service.position.return_value = (datetime(2018, 2, 14), 9)
+    timer_service.page.return_value = [{"id": 7}, {"id": 9}]
+    reporting_service.records_by_day.return_value = iter([])
+    options = ["--task", "foo", "--task-glob", "client-*", "--tag", "on call"]
+    options += ["--not-tag", "x"]
+
+    tt.cli.main(["records", "--week"] + options + ["--limit", "2"])
+
+    hint = capsys.readouterr().out.splitlines()[-1]
+    assert hint.startswith("More records: tt records --end ")
+    assert "--task foo --task-glob 'client-*' --tag 'on call' --not-tag x" in hint
+
+    # Following the hint pages through the same records.
+    first = timer_service.page.call_args
+    reporting_service.records_by_day.return_value = iter([])
+    tt.cli.main(shlex.split(hint.split(" tt ", 1)[1]))
+
+    assert timer_service.page.call_args == mock.call(
+        (datetime(2018, 2, 14), 9),
+        first[0][1],
+        limit=2,
+        task_ids=[1, 2],
+        tags=first[1]["tags"],
+    )
+    assert (
+        task_service.select.call_args_list
+        == [mock.call(names=["foo"], patterns=["client-*"])] * 2
+    )
+    assert (
+        timer_service.tag_filter.call_args_list
+        == [mock.call(tags=["on call"], not_tags=["x"])] * 2
+    )
+
+
+def test_records_last_page(timer_service, reporting_service, capsys):
+    timer_service.page.return_value = [{"id": 7}]
+    reporting_service.records_by_day.return_value = iter([])
+
+    tt.cli.main(["records", "--limit", "2"])
+
+    assert "--after" not in capsys.readouterr().out
+
+
+def test_records_after_id(timer_service, reporting_service):
+    timer_service.position.return_value = (datetime(2018, 2, 14), 3)
+    reporting_service.records_by_day.return_value = iter([])
+
+    tt.cli.main(["records", "--after", "3", "--year"])
+
+    timer_service.position.assert_called_once_with(3)
+    after, end = timer_service.page.call_args[0]
+    assert after == (datetime(2018, 2, 14), 3)
+    assert (end.year, end.month, end.day) == (datetime.now().year + 1, 1, 1)
+    assert timer_service.page.call_args[1] == {
+        "limit": None,
+        "task_ids": None,
+        "tags": None,
+    }
+
+
+def test_records_after_timestamp(timer_service, reporting_service):
+    t0 = datetime.now(tz_local()).replace(microsecond=0) - timedelta(hours=4)
+    reporting_service.records_by_day.return_value = iter([])
+
+    tt.cli.main(["records", "--after", t0.isoformat()])
+
+    assert timer_service.page.call_args[0][0] == (t0, 0)
+
+
+def test_log(timer_service, reporting_service, capsys):
+    timer_service.recent.return_value = [{"id": 9}, {"id": 7}]
+    reporting_service.log.return_value = "TABLE"
+
+    tt.cli.main(["log", "-n", "2"])
+
+    timer_service.recent.assert_called_once_with(2, before=None)
+    reporting_service.log.assert_called_once_with(timer_service.recent.return_value)
+    out = capsys.readouterr().out
+    assert out.startswith("TABLE\n")
+    assert "tt log --limit 2 --before 7" in out
+
+
+def test_log_before(timer_service, reporting_service, capsys):
+    timer_service.position.return_value = (datetime(2018, 2, 14), 3)
+    timer_service.recent.return_value = [{"id": 2}]
+    reporting_service.log.return_value = "TABLE"
+
+    tt.cli.main(["log", "--before", "3"])
+
+    timer_service.recent.assert_called_once_with(
+        tt.cli.DEFAULT_LOG_LIMIT, before=(datetime(2018, 2, 14), 3)
+    )
+    assert "--before" not in capsys.readouterr().out
+
+
+def test_log_no_records(timer_service, reporting_service, capsys):
+    timer_service.recent.return_value = []
+
+    tt.cli.main(["log"])
+
+    assert capsys.readouterr().out == "No records\n"
+
+
+@pytest.mark.parametrize(
+    "command", ["summary", "records", "report", "pivot", "status", "search"]
+)
+def test_task_filter(command, mocker, timer_service, reporting_service):
+    select = mocker.patch("tt.cli.TaskService.select", return_value=[1, 2])
+    timer_service.search.return_value = []
+    query = ["planning"] if command == "search" else []
+
+    tt.cli.main(
+        [command]
+        + query
+        + ["--task", "foo", "--task", "bar", "--task-glob", "client-*"]
+    )
+
+    select.assert_called_once_with(names=["foo", "bar"], patterns=["client-*"])
+    methods = {
+        "summary": [reporting_service.summary_by_task],
+        "records": [reporting_service.timers_by_day],
+        "report": [reporting_service.summary_by_day_and_task],
+        "pivot": [reporting_service.pivot],
+        "status": [
+            reporting_service.summary_by_day_and_task,
+            reporting_service.timers_by_day,
+        ],
+        "search": [timer_service.search],
+    }[command]
+    assert [method.call_args[1]["task_ids"] for method in methods] == [[1, 2]] * len(
+        methods
+    )
+
+
+def test_records_limit_task_filter(mocker, timer_service, reporting_service):
+    mocker.patch("tt.cli.TaskService.select", return_value=[1])
+    reporting_service.records_by_day.return_value = iter([])
+
+    tt.cli.main(["records", "--limit", "5", "--task", "foo"])
+
+    assert timer_service.page.call_args[1]["task_ids"] == [1]
+
+
+@pytest.mark.parametrize(
+    "command,method",
+    [
+        ("summary", "summary_by_task"),
+        ("records", "timers_by_day"),
+        ("report", "summary_by_day_and_task"),
+        ("pivot", "pivot"),
+    ],
+)
+def test_output(command, method, mocker, timer_service, reporting_service, datatable):
+    write = mocker.patch("tt.datatable.write")
+    getattr(reporting_service, method).return_value = (
+        datatable if command in ("summary", "pivot") else [datatable]
+    )
+
+    tt.cli.main([command, "--output", "csv"])
+
+    tables, stream, fmt = write.call_args[0]
+    assert list(tables) == [datatable]
+    assert fmt == "csv"
+    if command != "records":
+        assert getattr(reporting_service, method).call_args[1]["plain"]
+
+
+def test_pivot(timer_service, reporting_service):
+    t0 = datetime.now(tz_local()).replace(microsecond=0) - timedelta(hours=4)
+    t1 = t0 + timedelta(hours=3)
+
+    tt.cli.main(
+        [
+            "pivot",
+            "--begin",
+            t0.isoformat(),
+            "--end",
+            t1.isoformat(),
+            "--rows",
+            "task, weekday",
+            "--cols",
+            "hour",
+            "--measure",
+            "count",
+        ]
+    )
+
+    reporting_service.pivot.assert_called_once_with(
+        t0,
+        t1,
+        ("task", "weekday"),
+        ("hour",),
+        measure="count",
+        task_ids=None,
+        plain=False,
+        rollup=None,
+        tags=None,
+    )
+
+
+def test_pivot_defaults(freeze, timer_service, reporting_service):
+    t0 = start_of_day(datetime.now(tz_local()))
+    freeze(t0)
+
+    tt.cli.main(["pivot"])
+
+    reporting_service.pivot.assert_called_once_with(
+        t0,
+        t0 + timedelta(days=1),
+        ("task",),
+        (),
+        measure="elapsed",
+        task_ids=None,
+        plain=False,
+        rollup=None,
+        tags=None,
+    )
+
+
+@pytest.mark.parametrize("command", ["summary", "pivot"])
+def test_rollup(command, timer_service, reporting_service):
+    tt.cli.main([command, "--rollup", "2"])
+
+    method = getattr(
+        reporting_service, "pivot" if command == "pivot" else "summary_by_task"
+    )
+    assert method.call_args[1]["rollup"] == 2
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "top"])
+def test_rollup_invalid(value, timer_service, reporting_service):
+    with pytest.raises(SystemExit):
+        tt.cli.main(["summary", "--rollup", value])
+    assert not reporting_service.summary_by_task.called
+
+
+def test_pivot_same_dimension(timer_service, reporting_service, capsys):
+    assert tt.cli.main(["pivot", "--rows", "task", "--cols", "task,week"]) == 1
+    assert "both a row and a column" in capsys.readouterr().out
+    assert not reporting_service.pivot.called
+
+
+def test_start_note(timer_service):
+    tt.cli.main(["start", "foo", "-m", "Sprint planning"])
+
+    assert timer_service.start.call_args[1]["note"] == "Sprint planning"
+
+
+def test_search(timer_service, reporting_service, datatable, capsys):
+    t0 = datetime.now(tz_local()).replace(microsecond=0) - timedelta(days=2)
+    timer_service.search.return_value = [{"id": 1}]
+    reporting_service.matches.return_value = datatable
+
+    tt.cli.main(["search", "sprint", "plan*", "--begin", t0.isoformat(), "-n", "5"])
+
+    timer_service.search.assert_called_once_with(
+        "sprint plan*", start=t0, end=None, limit=5, task_ids=None, tags=None
+    )
+    reporting_service.matches.assert_called_once_with([{"id": 1}])
+    assert str(datatable) in capsys.readouterr().out
+
+
+def test_search_none(timer_service, reporting_service, capsys):
+    timer_service.search.return_value = []
+
+    tt.cli.main(["search", "planning"])
+
+    assert timer_service.search.call_args[1]["limit"] == tt.cli.DEFAULT_SEARCH_LIMIT
+    assert capsys.readouterr().out == "No matching records\n"
+
+
+def test_check_none(timer_service, reporting_service, capsys):
+    timer_service.check.return_value = iter([])
+
+    assert tt.cli.main(["check"]) is None
+
+    timer_service.check.assert_called_once_with(gaps=False)
+    assert capsys.readouterr().out == "No problems found\n"
+
+
+@pytest.mark.parametrize("kind,expected", [("gap", None), ("overlap", 1)])
+def test_check(kind, expected, timer_service, reporting_service, datatable, capsys):
+    problems = [{"kind": kind, "timers": "1, 2"}]
+    timer_service.check.return_value = iter(problems)
+    reporting_service.problems.return_value = datatable
+
+    assert tt.cli.main(["check", "--gaps"]) == expected
+
+    timer_service.check.assert_called_once_with(gaps=True)
+    reporting_service.problems.assert_called_once_with(problems)
+    assert "No problems found" not in capsys.readouterr().out
+
+
+def test_check_output_empty(mocker, timer_service, reporting_service, datatable):
+    write = mocker.patch("tt.datatable.write")
+    timer_service.check.return_value = iter([])
+    reporting_service.problems.return_value = datatable
+
+    tt.cli.main(["check", "--output", "json"])
+
+    reporting_service.problems.assert_called_once_with([])
+    assert write.call_args[0][2] == "json"
+
+
+def test_gaps(timer_service, reporting_service, datatable, capsys):
+    t0 = datetime.now(tz_local()).replace(microsecond=0) - timedelta(days=7)
+    t1 = t0 + timedelta(days=5)
+    timer_service.untracked.return_value = iter([{"elapsed": timedelta(hours=1)}])
+    reporting_service.untracked.return_value = datatable
+
+    tt.cli.main(
+        [
+            "gaps",
+            "--begin",
+            t0.isoformat(),
+            "--end",
+            t1.isoformat(),
+            "--hours",
+            "08:30-16:00",
+            "--weekdays",
+        ]
+    )
+
+    timer_service.untracked.assert_called_once_with(
+        t0, t1, (time(8, 30), time(16)), weekdays=True
+    )
+    reporting_service.untracked.assert_called_once_with(
+        [{"elapsed": timedelta(hours=1)}]
+    )
+    assert str(datatable) in capsys.readouterr().out
+
+
+def test_gaps_none(timer_service, reporting_service, capsys):
+    timer_service.untracked.return_value = iter([])
+
+    tt.cli.main(["gaps"])
+
+    begin, end, hours = timer_service.untracked.call_args[0]
+    assert hours == (time(9), time(17))
+    assert begin < end
+    assert timer_service.untracked.call_args[1] == {"weekdays": False}
+    assert capsys.readouterr().out == "No untracked time\n"
+
+
+def test_gaps_output_empty(mocker, timer_service, reporting_service, datatable):
+    write = mocker.patch("tt.datatable.write")
+    timer_service.untracked.return_value = iter([])
+    reporting_service.untracked.return_value = datatable
+
+    tt.cli.main(["gaps", "--output", "csv"])
+
+    reporting_service.untracked.assert_called_once_with([])
+    assert write.call_args[0][2] == "csv"
+
+
+@pytest.mark.parametrize(
+    "value", ["bogus", "09:00", "9-17", "17:00-09:00", "09:00-09:00"]
+)
+def test_gaps_invalid_hours(value, timer_service, reporting_service):
+    with pytest.raises(SystemExit):
+        tt.cli.main(["gaps", "--hours", value])
+
+
+@pytest.mark.parametrize("value", ["bogus", "task,bogus", ","])
+def test_pivot_invalid_dimension(value, timer_service, reporting_service):
+    with pytest.raises(SystemExit):
+        tt.cli.main(["pivot", "--rows", value])
+
+
+def test_output_records_limit(mocker, timer_service, reporting_service, capsys):
+    timer_service.page.return_value = [{"id": 7}]
+    reporting_service.records_by_day.return_value = iter([])
+
+    tt.cli.main(["records", "--limit", "1", "--output", "json"])
+
+    assert capsys.readouterr().out == "[\n]\n"
+
+
+@pytest.mark.parametrize("records", [[], [{"id": 7}]])
+def test_output_log(records, timer_service, reporting_service, datatable, capsys):
+    timer_service.recent.return_value = records
+    reporting_service.log.return_value = datatable
+
+    tt.cli.main(["log", "--limit", "1", "--output", "ndjson"])
+
+    out = capsys.readouterr().out
+    assert json.loads(out) == {
+        "label": "foobar",
+        "bar": 2,
+        "foo": 1,
+        "summary": "bazboom",
+    }
+
+
+def test_output_status(freeze, mocker, timer_service, reporting_service):
+    freeze(datetime(2018, 2, 19, tzinfo=tz_local()))
+    write = mocker.patch("tt.datatable.write")
+    week = mocker.MagicMock(spec=Datatable)
+    day = mocker.MagicMock(spec=Datatable)
+    reporting_service.summary_by_day_and_task.return_value = iter([week])
+    reporting_service.timers_by_day.return_value = iter([day])
+
+    tt.cli.main(["status", "--output", "tsv"])
+
+    reporting_service.summary_by_day_and_task.assert_called_once_with(
+        start=datetime(2018, 2, 19, tzinfo=tz_local()),
+        end=datetime(2018, 2, 26, tzinfo=tz_local()),
+        plain=True,
+        task_ids=None,
+        tags=None,
+    )
+    assert write.call_args[0][0] == [week, day]
 
 
 def test_report(timer_service, reporting_service):
@@ -234,6 +826,20 @@ def test_report(timer_service, reporting_service):
     assert reporting_service.summary_by_day_and_task.called
 
 
+def test_report_frozen_clock(freeze, timer_service, reporting_service):
+    freeze(datetime(2018, 2, 19, 12, tzinfo=tz_local()))
+
+    tt.cli.main(["report"])
+
+    reporting_service.summary_by_day_and_task.assert_called_once_with(
+        start=datetime(2018, 2, 1, tzinfo=tz_local()),
+        end=datetime(2018, 2, 28, tzinfo=tz_local()),
+        task_ids=None,
+        plain=False,
+        tags=None,
+    )
+
+
 @pytest.mark.parametrize("month", range(1, 13))
 def test_report_with_month(month, timer_service, reporting_service):
     options = ["report", "--month", str(month)]
@@ -249,29 +855,33 @@ def test_report_with_month(month, timer_service, reporting_service):
     end = today.replace(day=last_day_of_month, month=month)
 
     reporting_service.summary_by_day_and_task.assert_called_once_with(
-        start=start, end=end
+        start=start, end=end, task_ids=None, plain=False, tags=None
     )
 
 
-@mock.patch("tt.cli.datetime", autospec=datetime)
-def test_status(mock_datetime, timer_service, reporting_service):
+def test_status(freeze, timer_service, reporting_service):
     options = ["status"]
-    mock_datetime.now.return_value = datetime(2018, 2, 19)
+    freeze(datetime(2018, 2, 19, tzinfo=tz_local()))
 
     tt.cli.main(options)
 
     reporting_service.summary_by_day_and_task.assert_called_once_with(
-        start=datetime(2018, 2, 19), end=datetime(2018, 2, 26)
+        start=datetime(2018, 2, 19, tzinfo=tz_local()),
+        end=datetime(2018, 2, 26, tzinfo=tz_local()),
+        task_ids=None,
+        tags=None,
     )
     reporting_service.timers_by_day.assert_called_once_with(
-        start=datetime(2018, 2, 19), end=datetime(2018, 2, 20)
+        start=datetime(2018, 2, 19, tzinfo=tz_local()),
+        end=datetime(2018, 2, 20, tzinfo=tz_local()),
+        task_ids=None,
+        tags=None,
     )
 
 
-@mock.patch("tt.cli.datetime", autospec=datetime)
-def test_status_no_records(mock_datetime, timer_service, reporting_service):
+def test_status_no_records(freeze, timer_service, reporting_service):
     options = ["status"]
-    mock_datetime.now.return_value = datetime(2018, 2, 19)
+    freeze(datetime(2018, 2, 19, tzinfo=tz_local()))
     reporting_service.timers_by_day.side_effect = StopIteration
 
     tt.cli.main(options)
@@ -321,6 +931,9 @@ def test_bad_request(mock_argparse, mocker):
     args = mocker.MagicMock()
     args.version = False
     args.verbose = False
+    args.profile = None
+    args.profile_output = None
+    args.stats = False
     parser.parse_args.return_value = args
     args.func.side_effect = BadRequest
 
@@ -336,11 +949,19 @@ def test_parse_timestamp(parse, mocker):
     parse.return_value = timestamp
 
     tt.cli._parse_timestamp("foo")
-    parse.assert_called_with("foo", settings=tt.cli.DATEPARSER_SETTINGS)
+    parse.assert_called_with("foo", settings=SETTINGS)
 
     timestamp.replace.assert_called_with(microsecond=0)
 
 
+def test_parse_timestamp_relative_to_frozen_clock(freeze):
+    freeze(datetime(2018, 2, 14, 12, tzinfo=tz_local()))
+
+    assert tt.cli._parse_timestamp("1 hour ago") == datetime(
+        2018, 2, 14, 11, tzinfo=tz_local()
+    )
+
+
 @mock.patch("dateparser.parse")
 def test_parse_timestamp_raises_error(parse):
     parse.return_value = None
@@ -348,11 +969,10 @@ def test_parse_timestamp_raises_error(parse):
         tt.cli._parse_timestamp("foo")
 
 
-@mock.patch("tt.cli.datetime")
-def test_from_timerange(mock_datetime, mocker):
+def test_from_timerange(freeze, mocker):
     t = datetime(2018, 2, 23, 15, 16, 00, tzinfo=tz_local())
 
-    mock_datetime.now.return_value = t
+    freeze(t)
 
     args = mocker.MagicMock()
     args.yesterday = False
@@ -369,11 +989,10 @@ def test_from_timerange(mock_datetime, mocker):
     )
 
 
-@mock.patch("tt.cli.datetime")
-def test_from_timerange_yesterday(mock_datetime, mocker):
+def test_from_timerange_yesterday(freeze, mocker):
     t = datetime(2018, 2, 23, 15, 16, 00, tzinfo=tz_local())
 
-    mock_datetime.now.return_value = t
+    freeze(t)
 
     args = mocker.MagicMock()
     args.yesterday = True
@@ -390,11 +1009,10 @@ def test_from_timerange_yesterday(mock_datetime, mocker):
     )
 
 
-@mock.patch("tt.cli.datetime")
-def test_from_timerange_week(mock_datetime, mocker):
+def test_from_timerange_week(freeze, mocker):
     t = datetime(2018, 2, 23, 15, 16, 00, tzinfo=tz_local())
 
-    mock_datetime.now.return_value = t
+    freeze(t)
 
     args = mocker.MagicMock()
     args.yesterday = False
@@ -411,11 +1029,10 @@ def test_from_timerange_week(mock_datetime, mocker):
     )
 
 
-@mock.patch("tt.cli.datetime")
-def test_from_timerange_last_week(mock_datetime, mocker):
+def test_from_timerange_last_week(freeze, mocker):
     t = datetime(2018, 2, 23, 15, 16, 00, tzinfo=tz_local())
 
-    mock_datetime.now.return_value = t
+    freeze(t)
 
     args = mocker.MagicMock()
     args.yesterday = False
@@ -432,11 +1049,10 @@ def test_from_timerange_last_week(mock_datetime, mocker):
     )
 
 
-@mock.patch("tt.cli.datetime")
-def test_from_timerange_month(mock_datetime, mocker):
+def test_from_timerange_month(freeze, mocker):
     t = datetime(2018, 2, 23, 15, 16, 00, tzinfo=tz_local())
 
-    mock_datetime.now.return_value = t
+    freeze(t)
 
     args = mocker.MagicMock()
     args.yesterday = False
@@ -453,11 +1069,10 @@ def test_from_timerange_month(mock_datetime, mocker):
     )
 
 
-@mock.patch("tt.cli.datetime")
-def test_from_timerange_last_month(mock_datetime, mocker):
+def test_from_timerange_last_month(freeze, mocker):
     t = datetime(2018, 2, 23, 15, 16, 00, tzinfo=tz_local())
 
-    mock_datetime.now.return_value = t
+    freeze(t)
 
     args = mocker.MagicMock()
     args.yesterday = False
@@ -474,11 +1089,10 @@ def test_from_timerange_last_month(mock_datetime, mocker):
     )
 
 
-@mock.patch("tt.cli.datetime")
-def test_from_timerange_year(mock_datetime, mocker):
+def test_from_timerange_year(freeze, mocker):
     t = datetime(2018, 2, 23, 15, 16, 00, tzinfo=tz_local())
 
-    mock_datetime.now.return_value = t
+    freeze(t)
 
     args = mocker.MagicMock()
     args.yesterday = False
@@ -495,11 +1109,10 @@ def test_from_timerange_year(mock_datetime, mocker):
     )
 
 
-@mock.patch("tt.cli.datetime")
-def test_from_timetrange_last_year(mock_datetime, mocker):
+def test_from_timetrange_last_year(freeze, mocker):
     t = datetime(2018, 2, 23, 15, 16, 00, tzinfo=tz_local())
 
-    mock_datetime.now.return_value = t
+    freeze(t)
 
     args = mocker.MagicMock()
     args.yesterday = False
@@ -524,3 +1137,352 @@ def test_init():
                 tt.cli.__init__()
 
                 assert mock_exit.call_args[0][0] == 42
+
+
+@pytest.mark.parametrize(
+    "argv,expected",
+    [
+        (["--profile", "status"], ["--profile=cprofile", "status"]),
+        (["--profile=wall", "status"], ["--profile=wall", "status"]),
+        (
+            ["--profile-limit", "5", "--profile", "status"],
+            ["--profile-limit", "5", "--profile=cprofile", "status"],
+        ),
+        (["start", "--profile"], ["start", "--profile"]),
+        (["status"], ["status"]),
+    ],
+)
+def test_expand_profile_flag(argv, expected):
+    assert tt.cli._expand_profile_flag(argv) == expected
+
+
+@pytest.mark.parametrize(
+    "options,mode", [(["status"], None), (["--profile", "status"], "cprofile")]
+)
+@mock.patch("tt.profile.profiled")
+def test_profile(profiled, options, mode, timer_service, reporting_service):
+    tt.cli.main(options)
+
+    profiled.assert_called_once_with(mode, output=None, limit=mock.ANY)
+    assert reporting_service.summary_by_day_and_task.called
+
+
+@mock.patch("tt.profile.profiled")
+def test_profile_output(profiled, timer_service, reporting_service):
+    tt.cli.main(["--profile", "--profile-output", "status.prof", "status"])
+
+    profiled.assert_called_once_with("cprofile", output="status.prof", limit=mock.ANY)
+
+
+@pytest.mark.parametrize(
+    "options", [["--profile=wall"], []], ids=["wall", "no profile"]
+)
+def test_profile_output_requires_cprofile(options, capsys):
+    with pytest.raises(SystemExit) as exit:
+        tt.cli.main(options + ["--profile-output", "status.prof", "status"])
+
+    assert exit.value.code == 2
+    assert "--profile-output requires --profile=cprofile" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("options", [["summary"], ["report"], ["status"]])
+def test_report_cache(options, tmpdir, mocker, reporting_service):
+    mocker.patch("tt.cli.APP_DATA_DIR", str(tmpdir))
+    init = mocker.patch("tt.cli.TimerService")
+
+    tt.cli.main(options)
+
+    cache = init.call_args[1]["cache"]
+    assert cache.filename == str(tmpdir.join(tt.cli.REPORT_CACHE_FILE))
+
+
+@pytest.mark.parametrize("options", [["summary"], ["report"], ["status"]])
+def test_report_no_cache(options, mocker, reporting_service):
+    init = mocker.patch("tt.cli.TimerService")
+
+    tt.cli.main(["--no-cache"] + options)
+
+    init.assert_called_once_with(cache=None)
+
+
+@mock.patch("tt.state.save")
+@mock.patch("tt.reader.active")
+def test_prompt(active, save, capsys):
+    now = datetime(2018, 2, 14, 10, 30, tzinfo=timezone.utc)
+    active.return_value = tt.reader.TimerRow(1, "foo", now - timedelta(hours=2), None)
+
+    with tt.datetime.frozen(now):
+        tt.cli.do_prompt(mock.MagicMock())
+
+    save.assert_called_once_with(active.return_value)
+    assert capsys.readouterr().out == "foo 02:00\n"
+
+
+@mock.patch("tt.state.save")
+@mock.patch("tt.reader.active")
+def test_prompt_no_active_timer(active, save, capsys):
+    active.return_value = None
+
+    tt.cli.do_prompt(mock.MagicMock())
+
+    save.assert_called_once_with(None)
+    assert capsys.readouterr().out == "\n"
+
+
+@pytest.fixture
+def batch_file(tmpdir):
+    def write(*lines):
+        path = tmpdir.join("batch.txt")
+        path.write("\n".join(lines) + "\n")
+        return mock.MagicMock(source=str(path))
+
+    return write
+
+
+def test_batch(session, batch_file, task_service, timer_service, capsys):
+    args = batch_file(
+        "# Corrections",
+        "create foo 'Foo task'",
+        "",
+        "start foo '2018-02-14 09:00'",
+        "stop '2018-02-14 10:00'  # end of meeting",
+    )
+
+    tt.cli.do_batch(args)
+
+    task_service.add.assert_called_once_with(
+        name="foo", description="Foo task", parent=None
+    )
+    assert timer_service.start.call_args[1]["task"] == "foo"
+    assert timer_service.stop.called
+    assert capsys.readouterr().out.endswith("Ran 3 commands\n")
+
+
+def test_batch_stdin(session, task_service, mocker):
+    mocker.patch("sys.stdin", io.StringIO("create foo\ncreate bar\n"))
+
+    tt.cli.do_batch(mock.MagicMock(source="-"))
+
+    assert task_service.add.call_count == 2
+
+
+def test_batch_parse_errors(session, batch_file, task_service):
+    args = batch_file(
+        "create foo",
+        "bogus",
+        "edit",
+        "create 'foo",
+        "batch",
+        "-v",
+        "--profile=wall --profile-output foo.prof list",
+    )
+
+    with pytest.raises(BadRequest) as err:
+        tt.cli.do_batch(args)
+
+    assert not task_service.add.called
+    lines = str(err.value).splitlines()
+    assert [line.split(":")[0] for line in lines] == [
+        "line 2",
+        "line 3",
+        "line 4",
+        "line 5",
+        "line 6",
+        "line 7",
+    ]
+
+
+def test_batch_is_all_or_nothing(session, batch_file):
+    args = batch_file("create foo", "create bar", "start nosuch")
+
+    with pytest.raises(BadRequest) as err:
+        tt.cli.do_batch(args)
+
+    assert str(err.value).startswith("line 3: ")
+    assert list(tt.reader.tasks()) == []
+
+
+def test_batch_validation_error(session, batch_file):
+    args = batch_file("create foo", "create bar", "create foo")
+
+    with pytest.raises(BadRequest) as err:
+        tt.cli.do_batch(args)
+
+    assert str(err.value) == (
+        "line 3: A task with name foo already exists, no changes were made"
+    )
+    assert list(tt.reader.tasks()) == []
+
+
+def test_batch_commits(session, batch_file):
+    tt.cli.do_batch(batch_file("create foo", "create bar"))
+
+    assert sorted(task.name for task in tt.reader.tasks()) == ["bar", "foo"]
+
+
+def test_batch_disables_report_cache(session, batch_file, mocker):
+    do_summary = mocker.patch("tt.cli.do_summary")
+    parser = tt.cli.build_parser(tt.cli._CommandParser)
+    parser.set_defaults(func=do_summary)
+    mocker.patch("tt.cli.build_parser", return_value=parser)
+
+    tt.cli.do_batch(batch_file("summary"))
+
+    assert do_summary.call_args[0][0].no_cache
+
+
+@pytest.fixture
+def shell(mocker, tmpdir):
+    mocker.patch("tt.cli.APP_DATA_DIR", str(tmpdir))
+    mocker.patch("tt.cli._parse_timestamp")
+
+    def run(*lines):
+        mocker.patch("builtins.input", side_effect=list(lines) + [EOFError])
+        tt.cli.do_shell(mock.MagicMock())
+
+    return run
+
+
+def test_shell(session, shell, task_service, capsys):
+    shell("create foo", "", "describe foo 'Foo task'  # comment", "create bar")
+
+    assert task_service.add.call_count == 2
+    task_service.describe.assert_called_once_with(name="foo", description="Foo task")
+    assert capsys.readouterr().err.count(" ms)\n") == 3
+
+
+def test_shell_exit(session, shell, task_service):
+    shell("create foo", "exit", "create bar")
+
+    assert task_service.add.call_count == 1
+
+
+def test_shell_errors(session, shell, capsys):
+    shell("bogus", "-v", "shell", "create 'foo", "start nosuch", "--help", "create x")
+
+    out = capsys.readouterr().out
+    assert out.count("Error: ") == 5
+    assert "Error: already in the shell" in out
+    assert [task.name for task in tt.reader.tasks()] == ["x"]
+
+
+def test_shell_bad_timestamp(session, shell, mocker, capsys):
+    def parse(timestamp):
+        if timestamp == "garbage":
+            raise ParseError("Unable")
+
+    tt.task.create("foo")
+    mocker.patch("tt.cli._parse_timestamp", side_effect=parse)
+
+    shell("start foo garbage")
+
+    assert "Error: Unable" in capsys.readouterr().out
+
+
+def test_shell_clock(session, shell, mocker):
+    instants = []
+    mocker.patch("tt.cli.do_tasks", side_effect=lambda args: instants.append(utc_now()))
+    parser = tt.cli.build_parser(tt.cli._CommandParser)
+    parser.set_defaults(func=tt.cli.do_tasks)
+    mocker.patch("tt.cli.build_parser", return_value=parser)
+    past = datetime(2018, 2, 14, tzinfo=timezone.utc)
+
+    with frozen(past):
+        shell("tasks")
+
+    assert instants[0] > past
+
+
+def test_shell_invalid_timer(session, shell, mocker, capsys):
+    mocker.patch(
+        "tt.cli._parse_timestamp", return_value=datetime(2001, 1, 1, tzinfo=tz_local())
+    )
+
+    shell("create foo", "start foo", "stop", "tasks")
+
+    out = capsys.readouterr().out
+    assert "Error: Invalid timer" in out
+    assert "Foo" in out.split("Error: Invalid timer")[1]
+
+
+def test_shell_missing_timer(session, shell, mocker, capsys):
+    mocker.patch(
+        "tt.cli._parse_timestamp", return_value=datetime(2001, 1, 1, tzinfo=tz_local())
+    )
+
+    shell("create foo", "edit 999 --start-time yesterday", "create bar")
+
+    assert "Error: No such timer 999" in capsys.readouterr().out
+    assert sorted(task.name for task in tt.reader.tasks()) == ["bar", "foo"]
+
+
+def test_shell_unexpected_error(session, shell, mocker, capsys):
+    mocker.patch("tt.cli.do_tasks", side_effect=RuntimeError("boom"))
+
+    shell("tasks", "create foo")
+
+    assert "Error: RuntimeError: boom" in capsys.readouterr().out
+    assert [task.name for task in tt.reader.tasks()] == ["foo"]
+
+
+def test_shell_interrupt(session, shell, mocker, task_service):
+    mocker.patch(
+        "builtins.input", side_effect=[KeyboardInterrupt, "create foo", "quit"]
+    )
+
+    tt.cli.do_shell(mock.MagicMock())
+
+    assert task_service.add.called
+
+
+def test_shell_keeps_report_cache(session, shell, mocker):
+    caches = []
+
+    def summary(args):
+        with tt.cli._report_cache(args) as cache:
+            caches.append(cache)
+
+    mocker.patch("tt.cli.do_summary", side_effect=summary)
+    parser = tt.cli.build_parser(tt.cli._CommandParser)
+    parser.set_defaults(func=tt.cli.do_summary)
+    mocker.patch("tt.cli.build_parser", return_value=parser)
+    flush = mocker.patch("tt.cache.ReportCache.flush")
+
+    shell("summary", "summary")
+
+    assert caches[0] is caches[1] is not None
+    assert flush.call_count == 1
+    assert tt.cli._shell_report_cache is None
+
+
+def test_shell_history(session, shell, tmpdir):
+    shell("tasks")
+
+    assert tmpdir.join(tt.cli.SHELL_HISTORY_FILE).check()
+
+
+def test_completer(session):
+    tt.task.create("foo")
+    tt.task.create("bar")
+    completer = tt.cli._Completer(tt.cli.build_parser().commands)
+
+    assert completer.matches("", "st") == ["start", "status", "stop"]
+    assert completer.matches("start ", "") == ["bar", "foo"]
+    assert completer.matches("start ", "f") == ["foo"]
+
+    tt.task.create("fizz")
+    assert completer.matches("start ", "f") == ["foo"]
+    completer.invalidate()
+    assert completer.matches("start ", "f") == ["fizz", "foo"]
+
+
+def test_completer_readline(session, mocker):
+    tt.task.create("foo")
+    tt.task.create("fizz")
+    mocker.patch("readline.get_line_buffer", return_value="start f")
+    mocker.patch("readline.get_begidx", return_value=6)
+    completer = tt.cli._Completer([])
+
+    assert completer.complete("f", 0) == "fizz"
+    assert completer.complete("f", 1) == "foo"
+    assert completer.complete("f", 2) is None
@@ -1,7 +1,14 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved
 
+from datetime import date, datetime, timedelta, timezone
+import io
+import json
+
+import pytest
+
 from tt.datatable import Datatable
+import tt.datatable
 
 from unittest import mock
 
@@ -181,3 +188,83 @@ def test_table_string_conversion_with_caption(tabulate, mocker):
     t.caption = "Foo"
     tabulate.return_value = "Bar"
     assert "Foo\nBar" == str(t)
+
+
+@pytest.fixture
+def timers():
+    start = datetime(2018, 2, 14, 9, 0, tzinfo=timezone.utc)
+    return Datatable(
+        table=[
+            {"id": 1, "start": start, "elapsed": timedelta(minutes=90)},
+            {"id": 2, "start": start, "elapsed": timedelta(seconds=1.5)},
+        ],
+        headers=["id", "start", "elapsed"],
+        value_fn=str,
+    )
+
+
+def test_rows(timers):
+    assert [dict(row) for row in timers.rows()] == [
+        {"id": 1, "start": "2018-02-14T09:00:00+00:00", "elapsed": 5400},
+        {"id": 2, "start": "2018-02-14T09:00:00+00:00", "elapsed": 1.5},
+    ]
+
+
+def test_rows_labels_and_summaries():
+    t = Datatable(
+        table=[{date(2018, 2, 14): timedelta(hours=1)}, {}],
+        labels=["foo"],
+        summaries=["x", "y"],
+        label_key="task",
+        summary_key="total",
+    )
+
+    assert [list(row.items()) for row in t.rows()] == [
+        [("task", "foo"), ("2018-02-14", 3600), ("total", "x")],
+        [("task", None), ("2018-02-14", None), ("total", "y")],
+    ]
+
+
+def test_rows_falsy_labels_and_tuples():
+    t = Datatable(table=[{("foo", 9): 1}], labels=[0], summaries=[0])
+
+    assert [dict(row) for row in t.rows()] == [{"label": 0, "foo/9": 1, "summary": 0}]
+
+
+def test_write_json(timers):
+    out = io.StringIO()
+    tt.datatable.write([timers, timers], out, "json")
+    assert len(json.loads(out.getvalue())) == 4
+
+
+def test_write_json_empty():
+    out = io.StringIO()
+    tt.datatable.write([], out, "json")
+    assert json.loads(out.getvalue()) == []
+
+
+def test_write_ndjson(timers):
+    out = io.StringIO()
+    tt.datatable.write([timers], out, "ndjson")
+    lines = out.getvalue().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [1, 2]
+
+
+@pytest.mark.parametrize("fmt,sep", [("csv", ","), ("tsv", "\t")])
+def test_write_csv(timers, fmt, sep):
+    other = Datatable(table=[{"task": "foo"}])
+    out = io.StringIO()
+
+    tt.datatable.write([timers, timers, other], out, fmt)
+
+    assert out.getvalue().split("\n") == [
+        sep.join(["id", "start", "elapsed"]),
+        sep.join(["1", "2018-02-14T09:00:00+00:00", "5400"]),
+        sep.join(["2", "2018-02-14T09:00:00+00:00", "1.5"]),
+        sep.join(["1", "2018-02-14T09:00:00+00:00", "5400"]),
+        sep.join(["2", "2018-02-14T09:00:00+00:00", "1.5"]),
+        "",
+        "task",
+        "foo",
+        "",
+    ]
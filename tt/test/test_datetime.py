@@ -2,7 +2,6 @@
 # All rights reserved
 
 from datetime import datetime, timedelta
-from unittest import mock
 
 from dateutil import tz
 import pandas
@@ -122,13 +121,12 @@ def test_start_of_day():
     assert expected == actual
 
 
-@mock.patch("tt.datetime.datetime")
-def test_start_of_day_no_param(mock_dt):
-    t = datetime.now(tz.tzlocal())
+def test_start_of_day_no_param():
+    t = datetime(2018, 2, 14, 9, 30, tzinfo=tz.tzlocal())
 
-    mock_dt.now.return_value = t
     expected = t.replace(hour=0, minute=0, second=0, microsecond=0)
-    actual = tt.datetime.start_of_day()
+    with tt.datetime.frozen(t):
+        actual = tt.datetime.start_of_day()
 
     assert expected == actual
 
@@ -144,16 +142,14 @@ def test_start_of_week():
     assert expected == actual
 
 
-@mock.patch("tt.datetime.datetime")
-def test_start_of_week_no_param(mock_dt):
-    t = datetime.now(tz.tzlocal())
-
-    mock_dt.now.return_value = t
+def test_start_of_week_no_param():
+    t = datetime(2018, 2, 14, 9, 30, tzinfo=tz.tzlocal())
 
     expected = (t - timedelta(days=t.weekday())).replace(
         hour=0, minute=0, second=0, microsecond=0
     )
-    actual = tt.datetime.start_of_week()
+    with tt.datetime.frozen(t):
+        actual = tt.datetime.start_of_week()
 
     assert expected == actual
 
@@ -167,14 +163,12 @@ def test_start_of_month():
     assert expected == actual
 
 
-@mock.patch("tt.datetime.datetime")
-def test_start_of_month_no_param(mock_dt):
-    t = datetime.now(tz.tzlocal())
-
-    mock_dt.now.return_value = t
+def test_start_of_month_no_param():
+    t = datetime(2018, 2, 14, 9, 30, tzinfo=tz.tzlocal())
 
     expected = t.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    actual = tt.datetime.start_of_month()
+    with tt.datetime.frozen(t):
+        actual = tt.datetime.start_of_month()
 
     assert expected == actual
 
@@ -188,13 +182,138 @@ def test_start_of_year():
     assert expected == actual
 
 
-@mock.patch("tt.datetime.datetime")
-def test_start_of_year_no_param(mock_dt):
-    t = datetime.now(tz.tzlocal())
-
-    mock_dt.now.return_value = t
+def test_start_of_year_no_param():
+    t = datetime(2018, 2, 14, 9, 30, tzinfo=tz.tzlocal())
 
     expected = t.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-    actual = tt.datetime.start_of_year()
+    with tt.datetime.frozen(t):
+        actual = tt.datetime.start_of_year()
 
     assert expected == actual
+
+
+def test_utc_now():
+    now = tt.datetime.utc_now()
+    assert now.tzinfo is not None
+    assert now.utcoffset() == timedelta(0)
+    assert now.microsecond == 0
+
+
+def test_frozen():
+    instant = datetime(2018, 2, 14, 9, 0, 0, 123, tzinfo=tt.datetime.tz_local())
+
+    with tt.datetime.frozen(instant) as frozen:
+        assert frozen == instant.replace(microsecond=0)
+        assert tt.datetime.utc_now() == frozen
+        assert tt.datetime.utc_now().utcoffset() == timedelta(0)
+
+    assert tt.datetime.utc_now() != frozen
+
+
+def test_local_now():
+    instant = datetime(2018, 2, 14, 9, 0, 0, tzinfo=tz.tzutc())
+
+    with tt.datetime.frozen(instant):
+        now = tt.datetime.local_now()
+
+    assert now == instant
+    assert now.utcoffset() == tz.tzlocal().utcoffset(now)
+
+
+def test_clock_ignores_frozen():
+    with tt.datetime.frozen(datetime(2018, 2, 14, tzinfo=tz.tzutc())):
+        now = tt.datetime.clock()
+
+    assert now.year > 2018
+    assert now.microsecond == 0
+
+
+def test_frozen_nested():
+    with tt.datetime.frozen() as outer:
+        with tt.datetime.frozen() as inner:
+            assert inner is outer
+
+        instant = datetime(2018, 2, 14, tzinfo=tt.datetime.tz_local())
+        with tt.datetime.frozen(instant) as inner:
+            assert inner == instant
+        assert tt.datetime.utc_now() is outer
+
+
+def _epoch(*args):
+    return int(datetime(*args, tzinfo=tt.datetime.tz_local()).timestamp())
+
+
+def test_split_days():
+    start = datetime(2018, 2, 14, tzinfo=tt.datetime.tz_local())
+    end = datetime(2018, 2, 20, tzinfo=tt.datetime.tz_local())
+
+    index, starts, stops = tt.datetime.split_days(
+        [_epoch(2018, 2, 13, 22), _epoch(2018, 2, 17, 10), _epoch(2018, 2, 1)],
+        [_epoch(2018, 2, 16, 3), _epoch(2018, 2, 17, 11), _epoch(2018, 2, 2)],
+        start,
+        end,
+    )
+
+    assert list(index) == [0, 0, 0, 1]
+    assert list(starts) == [
+        _epoch(2018, 2, 14),
+        _epoch(2018, 2, 15),
+        _epoch(2018, 2, 16),
+        _epoch(2018, 2, 17, 10),
+    ]
+    assert list(stops) == [
+        _epoch(2018, 2, 15),
+        _epoch(2018, 2, 16),
+        _epoch(2018, 2, 16, 3),
+        _epoch(2018, 2, 17, 11),
+    ]
+
+
+def test_split_days_until_midnight():
+    start = datetime(2018, 2, 1, tzinfo=tt.datetime.tz_local())
+    end = datetime(2018, 3, 1, tzinfo=tt.datetime.tz_local())
+
+    index, starts, stops = tt.datetime.split_days(
+        [_epoch(2018, 2, 13, 22)], [_epoch(2018, 2, 14)], start, end
+    )
+
+    assert list(index) == [0]
+    assert list(stops) == [_epoch(2018, 2, 14)]
+
+
+def test_split_hours():
+    start = datetime(2018, 2, 14, tzinfo=tt.datetime.tz_local())
+    end = datetime(2018, 2, 15, tzinfo=tt.datetime.tz_local())
+
+    index, starts, stops = tt.datetime.split_hours(
+        [_epoch(2018, 2, 14, 10, 30), _epoch(2018, 2, 14, 13), _epoch(2018, 2, 13)],
+        [
+            _epoch(2018, 2, 14, 12, 15),
+            _epoch(2018, 2, 14, 13, 40),
+            _epoch(2018, 2, 13, 1),
+        ],
+        start,
+        end,
+    )
+
+    assert list(index) == [0, 0, 0, 1]
+    assert list(starts) == [
+        _epoch(2018, 2, 14, 10, 30),
+        _epoch(2018, 2, 14, 11),
+        _epoch(2018, 2, 14, 12),
+        _epoch(2018, 2, 14, 13),
+    ]
+    assert list(stops) == [
+        _epoch(2018, 2, 14, 11),
+        _epoch(2018, 2, 14, 12),
+        _epoch(2018, 2, 14, 12, 15),
+        _epoch(2018, 2, 14, 13, 40),
+    ]
+
+
+def test_split_days_none():
+    start = datetime(2018, 2, 1, tzinfo=tt.datetime.tz_local())
+
+    index, starts, stops = tt.datetime.split_days([], [], start, start)
+
+    assert not len(index)
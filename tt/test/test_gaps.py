@@ -0,0 +1,106 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+from datetime import datetime, time, timedelta
+
+import pytest
+
+from tt.datetime import tz_local
+from tt.gaps import Gap, untracked, working_hours
+from tt.reader import TimerRow
+
+MONDAY = datetime(2018, 2, 12, tzinfo=tz_local())
+HOURS = (time(9), time(17))
+
+
+def _at(day, hour, minute=0):
+    return MONDAY + timedelta(days=day, hours=hour, minutes=minute)
+
+
+def _row(id, start, stop):
+    return TimerRow(id, "foo", start, stop)
+
+
+@pytest.mark.parametrize(
+    "weekdays,expected", [(False, [0, 1, 2, 3, 4, 5, 6]), (True, [0, 1, 2, 3, 4])]
+)
+def test_working_hours(weekdays, expected):
+    windows = list(working_hours(MONDAY, _at(7, 0), HOURS, weekdays))
+
+    assert windows == [(_at(day, 9), _at(day, 17)) for day in expected]
+
+
+def test_working_hours_clipped():
+    windows = list(working_hours(_at(0, 12), _at(1, 10), HOURS))
+
+    assert windows == [(_at(0, 12), _at(0, 17)), (_at(1, 9), _at(1, 10))]
+
+
+def test_working_hours_daylight_saving(new_york):
+    # Daylight saving time ends at 02:00 on Sunday, 2018-11-04.
+    sunday = datetime(2018, 11, 4, tzinfo=tz_local())
+
+    (window,) = working_hours(sunday, sunday + timedelta(days=1), (time(0), time(4)))
+
+    assert [bound.hour for bound in window] == [0, 4]
+    assert window[1] - window[0] == timedelta(hours=5)
+
+
+@pytest.mark.parametrize("start,end", [(_at(0, 18), _at(1, 8)), (_at(1, 0), MONDAY)])
+def test_working_hours_none(start, end):
+    assert list(working_hours(start, end, HOURS)) == []
+
+
+def test_untracked():
+    rows = [
+        _row(1, _at(0, 8), _at(0, 10)),
+        _row(2, _at(0, 11), _at(0, 12)),
+        _row(3, _at(0, 11, 30), _at(0, 13)),
+        _row(4, _at(0, 13), _at(0, 14)),
+    ]
+    windows = [(_at(0, 9), _at(0, 17)), (_at(1, 9), _at(1, 17))]
+
+    assert list(untracked(rows, windows, _at(7, 0))) == [
+        Gap(_at(0, 10), _at(0, 11)),
+        Gap(_at(0, 14), _at(0, 17)),
+        Gap(_at(1, 9), _at(1, 17)),
+    ]
+
+
+def test_untracked_across_windows():
+    rows = [_row(1, _at(0, 16), _at(2, 10)), _row(2, _at(2, 12), _at(2, 17))]
+    windows = list(working_hours(MONDAY, _at(3, 0), HOURS))
+
+    assert list(untracked(rows, windows, _at(7, 0))) == [
+        Gap(_at(0, 9), _at(0, 16)),
+        Gap(_at(2, 10), _at(2, 12)),
+    ]
+
+
+def test_untracked_running_until_now():
+    rows = [_row(1, _at(0, 10), None)]
+    windows = list(working_hours(MONDAY, _at(3, 0), HOURS))
+
+    assert list(untracked(rows, windows, _at(1, 12))) == [Gap(_at(0, 9), _at(0, 10))]
+
+
+def test_untracked_ignores_negative_timers():
+    rows = [_row(1, _at(0, 12), _at(0, 10)), _row(2, _at(0, 13), _at(0, 17))]
+    windows = [(_at(0, 9), _at(0, 17))]
+
+    assert list(untracked(rows, windows, _at(7, 0))) == [Gap(_at(0, 9), _at(0, 13))]
+
+
+def test_untracked_single_pass():
+    read = []
+
+    def rows():
+        for day in range(365):
+            read.append(day)
+            yield _row(day, _at(day, 9), _at(day, 16))
+
+    windows = working_hours(MONDAY, _at(365, 0), HOURS)
+    gaps = list(untracked(rows(), windows, _at(365, 0)))
+
+    assert read == list(range(365))
+    assert gaps == [Gap(_at(day, 16), _at(day, 17)) for day in range(365)]
@@ -0,0 +1,55 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+import time
+from unittest import mock
+
+import pytest
+
+import tt
+import tt.__main__
+import tt.state
+
+
+@pytest.fixture
+def data_dir(tmpdir, mocker):
+    mocker.patch("tt.APP_DATA_DIR", str(tmpdir))
+    tmpdir.join(tt.DB_FILE).write("")
+    return tmpdir
+
+
+@mock.patch("tt.cli.main")
+def test_prompt_from_state_file(cli_main, data_dir, capsys):
+    tt.state.configure(str(data_dir.join(tt.state.STATE_FILE)))
+    tt.state.save(None)
+    data_dir.join(tt.state.STATE_FILE).write(
+        '{"id": 1, "task": "foo", "start": %d}' % (time.time() - 90 * 60)
+    )
+
+    assert tt.__main__.main(["prompt"]) == 0
+
+    assert capsys.readouterr().out == "foo 01:30\n"
+    assert not cli_main.called
+
+
+@mock.patch("tt.cli.main")
+def test_prompt_without_state_file(cli_main, data_dir):
+    cli_main.return_value = None
+    assert tt.__main__.main(["prompt"]) is None
+    cli_main.assert_called_once_with(["prompt"])
+
+
+@mock.patch("tt.cli.main")
+def test_other_commands(cli_main, data_dir):
+    tt.__main__.main(["status"])
+    cli_main.assert_called_once_with(["status"])
+
+
+def test_init():
+    """Test the module initialization when __main__ module."""
+    with mock.patch.object(tt.__main__, "main", return_value=42):
+        with mock.patch.object(tt.__main__, "__name__", "__main__"):
+            with mock.patch.object(tt.__main__.sys, "exit") as mock_exit:
+                tt.__main__.__init__()
+
+                assert mock_exit.call_args[0][0] == 42
@@ -0,0 +1,43 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved
+
+import tt.meta
+from tt.sql import transaction
+
+
+def test_get_default(session):
+    assert tt.meta.get() == 0
+
+
+def test_bump(session):
+    with transaction() as session:
+        tt.meta.bump(session)
+    assert tt.meta.get() == 1
+
+    with transaction() as session:
+        tt.meta.bump(session)
+        tt.meta.bump(session)
+    assert tt.meta.get() == 3
+
+
+def test_bump_other_key(session):
+    with transaction() as session:
+        tt.meta.bump(session, "other")
+
+    assert tt.meta.get("other") == 1
+    assert tt.meta.get() == 0
+
+
+def test_version(session):
+    database_id, revision = tt.meta.version()
+    assert database_id is not None
+    assert revision is None
+
+    revisions = set()
+    for _ in range(3):
+        with transaction() as session:
+            tt.meta.bump(session)
+        assert tt.meta.version()[0] == database_id
+        revisions.add(tt.meta.version()[1])
+    assert None not in revisions
+    assert len(revisions) == 3
@@ -1,8 +1,9 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
+from tt.datetime import frozen
 from tt.orm import Task, Timer
 
 
@@ -57,3 +58,26 @@ def test_equals_different_types(mocker):
     timer = Timer(task=task, start=ts, stop=None)
 
     assert task != timer
+
+
+def test_timer_elapsed_at():
+    start = datetime(2018, 2, 14, 9, 0, tzinfo=timezone.utc)
+    now = start + timedelta(hours=2)
+
+    assert Timer(start=start).elapsed_at(now) == timedelta(hours=2)
+    assert Timer(start=start, stop=start + timedelta(hours=1)).elapsed_at(
+        now
+    ) == timedelta(hours=1)
+
+
+def test_timer_elapsed_frozen():
+    start = datetime(2018, 2, 14, 9, 0, tzinfo=timezone.utc)
+    timer = Timer(task=Task(name="foo"), start=start)
+
+    with frozen(start + timedelta(minutes=5)):
+        assert timer.elapsed == timedelta(minutes=5)
+        assert timer.as_dict()["elapsed"] == timedelta(minutes=5)
+
+    assert timer.as_dict(start + timedelta(minutes=10))["elapsed"] == timedelta(
+        minutes=10
+    )
@@ -0,0 +1,135 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+from datetime import date, timedelta
+
+import pytest
+
+import tt.pivot
+from tt.reader import Measures
+
+MONDAY = date(2018, 2, 12)
+TUESDAY = date(2018, 2, 13)
+
+
+@pytest.fixture
+def groups():
+    return [
+        (("foo", MONDAY), Measures(600, 1, 600, 600)),
+        (("bar", MONDAY), Measures(300, 2, 100, 200)),
+        (("foo", TUESDAY), Measures(900, 3, 100, 500)),
+    ]
+
+
+@pytest.mark.parametrize(
+    "measure,expected",
+    [
+        ("elapsed", timedelta(seconds=600)),
+        ("count", 3),
+        ("min", timedelta(seconds=100)),
+        ("max", timedelta(seconds=300)),
+    ],
+)
+def test_value(measure, expected):
+    assert tt.pivot.value(Measures(600, 3, 100, 300), measure) == expected
+
+
+@pytest.mark.parametrize(
+    "dimensions,key,expected",
+    [
+        (("task",), "foo", "Foo"),
+        (("day",), MONDAY, "Mon Feb 12"),
+        (("week",), MONDAY, "Week 07 2018"),
+        (("month",), date(2018, 2, 1), "Feb 2018"),
+        (("weekday",), 0, "Mon"),
+        (("hour",), 9, "09:00"),
+        (("task", "hour"), ("foo", 9), "Foo 09:00"),
+        (("hour",), "TOTAL", "Total"),
+    ],
+)
+def test_label(dimensions, key, expected):
+    assert tt.pivot.label(dimensions, key) == expected
+
+
+def test_tabulate(groups):
+    table = tt.pivot.tabulate(groups, ["task"], ["day"])
+
+    assert table.labels == ["foo", "bar", "TOTAL"]
+    assert table.headers == [MONDAY, TUESDAY]
+    assert table.table == [
+        {MONDAY: timedelta(seconds=600), TUESDAY: timedelta(seconds=900)},
+        {MONDAY: timedelta(seconds=300)},
+        {MONDAY: timedelta(seconds=900), TUESDAY: timedelta(seconds=900)},
+    ]
+    assert table.summaries == [
+        timedelta(seconds=1500),
+        timedelta(seconds=300),
+        timedelta(seconds=1800),
+    ]
+    assert table.header_fn(MONDAY) == "Mon Feb 12"
+
+
+def test_tabulate_measure(groups):
+    groups = [((day, task), measures) for (task, day), measures in groups]
+
+    table = tt.pivot.tabulate(groups, ["day"], ["task"], measure="count")
+
+    assert table.labels == [MONDAY, TUESDAY, "TOTAL"]
+    assert table.table == [{"foo": 1, "bar": 2}, {"foo": 3}, {"foo": 4, "bar": 2}]
+    assert table.summaries == [3, 3, 6]
+
+
+def test_tabulate_without_columns(groups):
+    table = tt.pivot.tabulate(groups, ["task", "day"], measure="max")
+
+    assert table.headers == ["max"]
+    assert table.labels == [
+        ("foo", MONDAY),
+        ("bar", MONDAY),
+        ("foo", TUESDAY),
+        "TOTAL",
+    ]
+    assert table.table[-1] == {"max": timedelta(seconds=600)}
+    assert not any(table.summaries)
+
+
+def test_tabulate_sorts_time_rows():
+    groups = [((9,), Measures(60, 1, 60, 60)), ((8,), Measures(60, 1, 60, 60))]
+
+    table = tt.pivot.tabulate(groups, ["hour"], totals=False)
+
+    assert table.labels == [8, 9]
+
+
+def test_tabulate_plain(groups):
+    table = tt.pivot.tabulate(groups, ["task"], ["day"], totals=False)
+
+    assert [dict(row) for row in table.rows()] == [
+        {"label": "foo", "2018-02-12": 600, "2018-02-13": 900},
+        {"label": "bar", "2018-02-12": 300, "2018-02-13": None},
+    ]
+
+
+def test_tabulate_empty():
+    table = tt.pivot.tabulate([], ["task"], ["day"])
+
+    assert table.labels == ["TOTAL"]
+    assert table.table == [{}]
+    assert table.summaries == [timedelta(0)]
+    assert "Total" in str(table)
+
+
+@pytest.mark.parametrize("measure,total", [("elapsed", timedelta(0)), ("count", 0)])
+def test_tabulate_empty_without_columns(measure, total):
+    table = tt.pivot.tabulate([], ["task"], measure=measure)
+
+    assert table.headers == [measure]
+    assert table.labels == ["TOTAL"]
+    assert table.table == [{measure: total}]
+
+
+def test_tabulate_empty_plain():
+    table = tt.pivot.tabulate([], ["task"], totals=False)
+
+    assert table.headers == ["elapsed"]
+    assert table.table == []
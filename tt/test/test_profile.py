@@ -0,0 +1,123 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved
+
+import io
+import pstats
+
+import pytest
+
+import tt.profile
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    tt.profile.reset()
+    yield
+    tt.profile.disable()
+    tt.profile.reset()
+
+
+def test_phase_disabled():
+    with tt.profile.phase("sql"):
+        pass
+
+    assert not tt.profile.timings
+
+
+def test_phase_enabled():
+    tt.profile.enable()
+    with tt.profile.phase("sql"):
+        pass
+
+    assert tt.profile.timings["sql"] > 0
+
+
+def test_nested_phases_are_exclusive(mocker):
+    clock = mocker.patch("time.perf_counter")
+    clock.side_effect = [0.0, 1.0, 3.0, 10.0]
+
+    tt.profile.enable()
+    with tt.profile.phase("orm"):
+        with tt.profile.phase("sql"):
+            pass
+
+    assert tt.profile.timings["sql"] == 2.0
+    assert tt.profile.timings["orm"] == 8.0
+
+
+def test_record():
+    tt.profile.record("imports", 1.0)
+    assert "imports" not in tt.profile.timings
+
+    tt.profile.enable()
+    tt.profile.record("imports", 1.0)
+    assert tt.profile.timings["imports"] == 1.0
+
+
+def test_end_without_begin():
+    tt.profile.enable()
+    tt.profile.end("sql", 1.0)
+
+    assert not tt.profile.timings
+
+
+def test_report():
+    tt.profile.enable()
+    tt.profile.record("imports", 0.5)
+    tt.profile.record("sql", 1.0)
+    tt.profile.record("custom", 0.5)
+
+    out = io.StringIO()
+    tt.profile.report(2.0, out)
+
+    lines = out.getvalue().splitlines()
+    assert lines[0].split() == ["Phase", "Seconds", "%"]
+    assert "SQL execution" in out.getvalue()
+    assert any(line.split() == ["custom", "0.5000", "25.0000"] for line in lines)
+    assert any(line.split() == ["Other", "0.5000", "25.0000"] for line in lines)
+    assert any(line.split() == ["TOTAL", "2.0000", "100.0000"] for line in lines)
+
+
+def test_report_zero_total():
+    out = io.StringIO()
+    tt.profile.report(0.0, out)
+    assert "TOTAL" in out.getvalue()
+
+
+def test_profiled_none():
+    out = io.StringIO()
+    with tt.profile.profiled(None, stream=out):
+        pass
+
+    assert out.getvalue() == ""
+
+
+def test_profiled_wall():
+    out = io.StringIO()
+    with tt.profile.profiled("wall", stream=out):
+        with tt.profile.phase("render"):
+            pass
+
+    assert "Table rendering" in out.getvalue()
+    assert "function calls" not in out.getvalue()
+    assert not tt.profile.timings
+
+
+def test_profiled_cprofile():
+    out = io.StringIO()
+    with tt.profile.profiled("cprofile", limit=5, stream=out):
+        sorted(range(10))
+
+    assert "function calls" in out.getvalue()
+    assert "TOTAL" in out.getvalue()
+
+
+def test_profiled_cprofile_output(tmpdir):
+    out = io.StringIO()
+    filename = str(tmpdir.join("tt.prof"))
+    with tt.profile.profiled("cprofile", output=filename, stream=out):
+        sorted(range(10))
+
+    assert pstats.Stats(filename).total_calls > 0
+    assert "function calls" not in out.getvalue()
+    assert "TOTAL" in out.getvalue()
@@ -0,0 +1,662 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+from tt.datetime import tz_local
+from tt.orm import Tag, Task, TaskTree, Timer, TimerTag
+import tt.reader
+
+
+@pytest.fixture
+def now(session):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    foo = Task(name="foo")
+    bar = Task(name="bar", description="Bar")
+    session.add_all(
+        [
+            Timer(
+                id=1,
+                task=foo,
+                start=now - timedelta(hours=3),
+                stop=now - timedelta(hours=2),
+            ),
+            Timer(
+                id=2,
+                task=bar,
+                start=now - timedelta(hours=2),
+                stop=now - timedelta(hours=1),
+            ),
+            Timer(id=3, task=foo, start=now - timedelta(hours=1)),
+        ]
+    )
+    session.commit()
+    return now
+
+
+@pytest.mark.parametrize("running,expected", [(None, 3), (True, 1), (False, 2)])
+def test_slice(now, running, expected):
+    rows = tt.reader.slice(now - timedelta(days=1), now, running=running)
+    assert len(rows) == expected
+    for row in rows:
+        assert isinstance(row, tt.reader.TimerRow)
+        assert row.task in ("foo", "bar")
+        assert row.start >= now - timedelta(days=1)
+        assert (row.stop is None) == (row.id == 3)
+
+
+def test_slice_range(now):
+    rows = tt.reader.slice(now - timedelta(minutes=150), now - timedelta(minutes=90))
+    assert [row.id for row in rows] == [1, 2]
+
+    rows = tt.reader.slice(now - timedelta(minutes=90), now - timedelta(minutes=80))
+    assert [row.id for row in rows] == [2]
+
+    # The running timer overlaps any range after its start.
+    rows = tt.reader.slice(now + timedelta(days=1), now + timedelta(days=2))
+    assert [row.id for row in rows] == [3]
+
+
+def test_slice_overlapping(session):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    task = Task(name="foo")
+    session.add_all(
+        [
+            Timer(id=1, task=task, start=now - timedelta(hours=26), stop=now),
+            Timer(id=2, task=task, start=now - timedelta(hours=30), stop=now),
+            Timer(id=3, task=task, start=now - timedelta(hours=27)),
+            Timer(id=4, task=task, start=now - timedelta(hours=28), stop=now),
+        ]
+    )
+    session.commit()
+
+    rows = tt.reader.slice(now - timedelta(hours=29), now)
+
+    assert [row.id for row in rows] == [2, 4, 3, 1]
+
+
+@pytest.mark.parametrize("count", [1, 10, 50])
+def test_statement_count(session, count_statements, count):
+    now = datetime.now(timezone.utc)
+    for i in range(count):
+        start = now - timedelta(hours=count - i + 1)
+        task = Task(name="task%d" % i)
+        session.add(Timer(task=task, start=start, stop=start + timedelta(hours=1)))
+    session.add(Timer(task=task, start=now - timedelta(minutes=30)))
+    session.commit()
+    session.close()
+
+    with count_statements() as counter:
+        rows = tt.reader.slice(now - timedelta(days=7), now)
+        assert tt.reader.last().task == "task%d" % (count - 1)
+        assert tt.reader.active().task == "task%d" % (count - 1)
+
+    assert len(rows) == count + 1
+    assert counter.count == 3
+    assert counter.selects("task") == 0
+
+
+def test_slice_reuses_compiled_statement(now):
+    tt.reader.slice(now - timedelta(days=1), now)
+    compiled = len(tt.reader._compiled_cache)
+    tt.reader.slice(now - timedelta(days=2), now)
+    assert len(tt.reader._compiled_cache) == compiled
+
+
+def test_active(now):
+    assert tt.reader.active() == (3, "foo", now - timedelta(hours=1), None)
+
+
+def test_active_none(session):
+    assert tt.reader.active() is None
+
+
+def test_last(now):
+    assert tt.reader.last().id == 3
+
+
+def test_last_none(session):
+    assert tt.reader.last() is None
+
+
+def test_tasks(now):
+    tasks = sorted(tt.reader.tasks(), key=lambda task: task.name)
+    assert [(task.name, task.description) for task in tasks] == [
+        ("bar", "Bar"),
+        ("foo", None),
+    ]
+
+
+def test_elapsed_and_as_dict(now):
+    stopped, _, running = sorted(tt.reader.slice(now - timedelta(days=1), now))
+
+    assert tt.reader.elapsed(stopped, now) == timedelta(hours=1)
+    assert tt.reader.elapsed(running, now + timedelta(hours=1)) == timedelta(hours=2)
+
+    record = tt.reader.as_dict(running, now)
+    assert record["id"] == 3
+    assert record["task"] == "foo"
+    assert record["start"] == now - timedelta(hours=1)
+    assert record["stop"] is None
+    assert record["elapsed"] == timedelta(hours=1)
+
+
+@pytest.mark.parametrize(
+    "running,expected",
+    [(True, [("foo", 5400)]), (False, [("foo", 3600), ("bar", 3600)])],
+)
+def test_aggregate_running(now, running, expected):
+    groups = tt.reader.aggregate(
+        ("task",),
+        now - timedelta(days=1),
+        now + timedelta(hours=1),
+        now + timedelta(minutes=30),
+        running=running,
+    )
+    assert [(key, measures.elapsed) for (key,), measures in groups] == expected
+
+
+def test_page(now):
+    end = now + timedelta(days=1)
+    assert [row.id for row in tt.reader.page((now - timedelta(days=1), 0), end)] == [
+        1,
+        2,
+        3,
+    ]
+    assert [row.id for row in tt.reader.page((now - timedelta(hours=2), 0), end)] == [
+        2,
+        3,
+    ]
+    assert [row.id for row in tt.reader.page(tt.reader.position(1), end, 1)] == [2]
+    assert tt.reader.page(tt.reader.position(3), end) == []
+
+
+def test_page_end(now):
+    rows = tt.reader.page((now - timedelta(days=1), 0), now - timedelta(hours=1))
+    assert [row.id for row in rows] == [1, 2]
+
+
+def test_recent(now):
+    assert [row.id for row in tt.reader.recent(2)] == [3, 2]
+    assert [row.id for row in tt.reader.recent(5, tt.reader.position(3))] == [2, 1]
+    assert [row.id for row in tt.reader.recent(5, (now - timedelta(hours=2), 0))] == [1]
+
+
+@pytest.mark.parametrize("batch", [1, 2, 1000])
+def test_timeline(now, session, batch):
+    session.add(Timer(id=4, task_id=1, start=now - timedelta(hours=3)))
+    session.commit()
+
+    assert [row.id for row in tt.reader.timeline(batch=batch)] == [1, 4, 2, 3]
+
+
+@pytest.mark.parametrize(
+    "start,end,expected",
+    [(150, 90, [1, 2]), (120, 90, [2]), (30, 0, [3]), (200, 170, [1])],
+)
+def test_timeline_range(now, start, end, expected):
+    rows = tt.reader.timeline(
+        batch=1,
+        start=now - timedelta(minutes=start),
+        end=now - timedelta(minutes=end),
+    )
+    assert [row.id for row in rows] == expected
+
+
+def test_timeline_range_uses_indexes(now, session):
+    for statement, index in [
+        (tt.reader._COVERING, "ix_timer_stop"),
+        (tt.reader._TIMELINE_RANGE, "ix_timer_start_id"),
+    ]:
+        plan = session.execute(
+            "EXPLAIN QUERY PLAN %s" % statement, {"start": 0, "end": 0}
+        ).fetchall()
+        details = " ".join(row[-1] for row in plan)
+        assert index in details
+        assert "SCAN timer" not in details
+
+
+def test_timeline_empty(session):
+    assert list(tt.reader.timeline()) == []
+
+
+def test_position(now):
+    assert tt.reader.position(2) == (now - timedelta(hours=2), 2)
+    assert tt.reader.position(4) is None
+
+
+def test_page_uses_index(now, session):
+    for statement in (tt.reader._PAGE[False, (False, False)], tt.reader._RECENT):
+        plan = session.execute(
+            "EXPLAIN QUERY PLAN %s" % statement,
+            {"start": 0, "id": 0, "end": 0, "limit": 1},
+        ).fetchall()
+        details = " ".join(row[-1] for row in plan)
+        assert "ix_timer_start_id" in details
+        assert "TEMP B-TREE" not in details
+
+
+def test_slice_tasks(now):
+    start = now - timedelta(days=1)
+    assert [row.id for row in tt.reader.slice(start, now, task_ids=[1])] == [1, 3]
+    assert [row.id for row in tt.reader.slice(start, now, task_ids=[2, 3])] == [2]
+    assert tt.reader.slice(start, now, task_ids=[]) == []
+
+
+def test_aggregate_tasks(now):
+    groups = tt.reader.aggregate(
+        ("task",), now - timedelta(days=1), now, now, task_ids=[2]
+    )
+    assert groups == [(("bar",), tt.reader.Measures(3600, 1, 3600, 3600))]
+
+
+def test_page_tasks(now):
+    rows = tt.reader.page((now - timedelta(days=1), 0), now, task_ids=[1])
+    assert [row.id for row in rows] == [1, 3]
+
+
+def test_task_filter_uses_index(now, session):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, many):
+        statements.append((statement, parameters))
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        tt.reader.aggregate(
+            ("task",), now - timedelta(days=1), now, now, task_ids=[1, 2]
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    statement, parameters = statements[-1]
+    plan = engine.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+    assert "ix_timer_task_id_start" in " ".join(row[-1] for row in plan)
+
+
+@pytest.fixture
+def tagged(now, session):
+    session.add_all([Tag(id=1, name="billable"), Tag(id=2, name="meeting")])
+    session.add_all(
+        [
+            TimerTag(tag_id=1, timer_id=1),
+            TimerTag(tag_id=1, timer_id=2),
+            TimerTag(tag_id=2, timer_id=2),
+        ]
+    )
+    session.commit()
+    return now
+
+
+@pytest.mark.parametrize(
+    "include,exclude,expected",
+    [
+        ([1], [], [1, 2]),
+        ([2], [], [2]),
+        ([1, 2], [], [1, 2]),
+        ([], [2], [1, 3]),
+        ([1], [2], [1]),
+        ([], [], [1, 2, 3]),
+    ],
+)
+def test_slice_tags(tagged, include, exclude, expected):
+    tags = tt.reader.TagFilter(include, exclude)
+    rows = tt.reader.slice(tagged - timedelta(days=1), tagged, tags=tags)
+    assert [row.id for row in rows] == expected
+
+
+def test_aggregate_tags(tagged):
+    tags = tt.reader.TagFilter([1], [])
+    groups = tt.reader.aggregate(
+        ("task",), tagged - timedelta(days=1), tagged, tagged, tags=tags
+    )
+    assert [(key, measures.elapsed) for (key,), measures in groups] == [
+        ("foo", 3600),
+        ("bar", 3600),
+    ]
+
+
+def test_page_tags(tagged):
+    tags = tt.reader.TagFilter([], [1])
+    rows = tt.reader.page((tagged - timedelta(days=1), 0), tagged, tags=tags)
+    assert [row.id for row in rows] == [3]
+
+
+def test_tag_filter_uses_index(tagged, session):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, many):
+        statements.append((statement, parameters))
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        tt.reader.slice(
+            tagged - timedelta(days=1), tagged, tags=tt.reader.TagFilter([1], [2])
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    statement, parameters = statements[-1]
+    plan = engine.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+    details = " ".join(row[-1] for row in plan)
+    assert "sqlite_autoindex_timer_tag_1" in details
+    assert "SCAN timer_tag" not in details
+
+
+@pytest.fixture
+def notes(now, session):
+    notes = {
+        1: "Sprint planning with the backend team",
+        2: "Planning the release, then more planning",
+        3: "Backend code review",
+    }
+    for timer in session.query(Timer):
+        timer.note = notes[timer.id]
+    session.commit()
+    return now
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        ("planning", [2, 1]),
+        ("backend planning", [1]),
+        ("BACKEND", [3, 1]),
+        ("plan*", [2, 1]),
+        ("plan", []),
+        ('review"', [3]),
+        ("* ", []),
+    ],
+)
+def test_search(notes, text, expected):
+    rows = tt.reader.search(text, notes - timedelta(days=1), notes)
+    assert [row.id for row in rows] == expected
+
+
+def test_search_range_and_limit(notes):
+    start = notes - timedelta(days=1)
+    rows = tt.reader.search("backend", notes - timedelta(minutes=90), notes)
+    assert [row.id for row in rows] == [3]
+    assert [row.id for row in tt.reader.search("planning", start, notes, 1)] == [2]
+
+
+def test_search_filters(notes, tagged, session):
+    start = notes - timedelta(days=1)
+    foo = session.query(Task.id).filter(Task.name == "foo").scalar()
+    not_meeting = tt.reader.TagFilter([], [2])
+
+    rows = tt.reader.search("planning", start, notes, task_ids=[foo])
+    assert [row.id for row in rows] == [1]
+    rows = tt.reader.search("planning", start, notes, tags=not_meeting)
+    assert [row.id for row in rows] == [1]
+    billable = tt.reader.TagFilter([1], [])
+    rows = tt.reader.search("backend", start, notes, task_ids=[foo], tags=billable)
+    assert [row.id for row in rows] == [1]
+
+
+def test_search_snippet(notes):
+    (row,) = tt.reader.search("review", notes - timedelta(days=1), notes)
+    assert row == tt.reader.SearchRow(
+        3, "foo", notes - timedelta(hours=1), None, "Backend code [review]"
+    )
+
+
+def test_search_uses_note_index(notes, session):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, many):
+        statements.append((statement, parameters))
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        tt.reader.search("planning", notes - timedelta(days=1), notes)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    statement, parameters = statements[-1]
+    plan = engine.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+    details = " ".join(row[-1] for row in plan)
+    assert "timer_note VIRTUAL TABLE INDEX" in details
+    assert "SCAN timer " not in details + " "
+
+
+def test_aggregate_measures(now):
+    groups = tt.reader.aggregate(
+        ("task",),
+        now - timedelta(days=1),
+        now + timedelta(hours=1),
+        now + timedelta(minutes=30),
+    )
+    assert groups == [
+        (("foo",), tt.reader.Measures(3600 + 5400, 2, 3600, 5400)),
+        (("bar",), tt.reader.Measures(3600, 1, 3600, 3600)),
+    ]
+
+
+def test_aggregate_time_dimensions(session):
+    # Wednesday, 2018-02-14 09:30 and Sunday, 2018-02-18 23:30 local time.
+    foo = Task(name="foo")
+    for start in (datetime(2018, 2, 14, 9, 30), datetime(2018, 2, 18, 23, 30)):
+        start = start.replace(tzinfo=tz_local())
+        session.add(Timer(task=foo, start=start, stop=start + timedelta(minutes=20)))
+    session.commit()
+
+    groups = tt.reader.aggregate(
+        ("day", "week", "month", "weekday", "hour"),
+        datetime(2018, 2, 1, tzinfo=tz_local()),
+        datetime(2018, 3, 1, tzinfo=tz_local()),
+        datetime(2018, 3, 1, tzinfo=tz_local()),
+    )
+
+    assert [key for key, _ in groups] == [
+        (date(2018, 2, 14), date(2018, 2, 12), date(2018, 2, 1), 2, 9),
+        (date(2018, 2, 18), date(2018, 2, 12), date(2018, 2, 1), 6, 23),
+    ]
+
+
+def test_aggregate_reuses_statement(now):
+    for _ in range(2):
+        tt.reader.aggregate(("weekday", "task"), now - timedelta(days=1), now, now)
+    assert (
+        ("weekday", "task"),
+        None,
+        False,
+        False,
+        (False, False),
+    ) in tt.reader._AGGREGATES
+
+
+def test_merge():
+    a = tt.reader.Measures(600, 1, 600, 600)
+    b = tt.reader.Measures(300, 2, 100, 200)
+
+    assert tt.reader.merge(None, a) == a
+    assert tt.reader.merge(a, b) == tt.reader.Measures(900, 3, 100, 600)
+
+
+@pytest.fixture
+def overnight(session):
+    # From Tuesday 22:00 to Wednesday 02:00, then Sunday 23:00 to Monday 01:00
+    # local time.
+    foo = Task(name="foo")
+    bar = Task(name="bar")
+    for task, start, hours in (
+        (foo, datetime(2018, 2, 13, 22), 4),
+        (bar, datetime(2018, 2, 14, 9), 1),
+        (foo, datetime(2018, 2, 18, 23), 2),
+    ):
+        start = start.replace(tzinfo=tz_local())
+        session.add(Timer(task=task, start=start, stop=start + timedelta(hours=hours)))
+    session.commit()
+
+
+def test_aggregate_splits_at_midnight(overnight):
+    groups = tt.reader.aggregate(
+        ("day", "task"),
+        datetime(2018, 2, 12, tzinfo=tz_local()),
+        datetime(2018, 2, 26, tzinfo=tz_local()),
+        datetime(2018, 3, 1, tzinfo=tz_local()),
+    )
+
+    assert {key: measures.elapsed for key, measures in groups} == {
+        (date(2018, 2, 13), "foo"): 2 * 3600,
+        (date(2018, 2, 14), "foo"): 2 * 3600,
+        (date(2018, 2, 14), "bar"): 3600,
+        (date(2018, 2, 18), "foo"): 3600,
+        (date(2018, 2, 19), "foo"): 3600,
+    }
+
+
+def test_aggregate_splits_at_hours(overnight, session):
+    # From 10:30 to 12:15 local time, and from 13:00 to 13:40 within an hour.
+    baz = Task(name="baz")
+    for start, minutes in (((10, 30), 105), ((13, 0), 40)):
+        start = datetime(2018, 2, 15, *start, tzinfo=tz_local())
+        session.add(
+            Timer(task=baz, start=start, stop=start + timedelta(minutes=minutes))
+        )
+    session.commit()
+
+    groups = tt.reader.aggregate(
+        ("task", "hour"),
+        datetime(2018, 2, 12, tzinfo=tz_local()),
+        datetime(2018, 2, 26, tzinfo=tz_local()),
+        datetime(2018, 3, 1, tzinfo=tz_local()),
+    )
+
+    assert dict(groups) == {
+        ("foo", 22): tt.reader.Measures(3600, 1, 3600, 3600),
+        ("foo", 23): tt.reader.Measures(2 * 3600, 2, 3600, 3600),
+        ("foo", 0): tt.reader.Measures(2 * 3600, 2, 3600, 3600),
+        ("foo", 1): tt.reader.Measures(3600, 1, 3600, 3600),
+        ("bar", 9): tt.reader.Measures(3600, 1, 3600, 3600),
+        ("baz", 10): tt.reader.Measures(1800, 1, 1800, 1800),
+        ("baz", 11): tt.reader.Measures(3600, 1, 3600, 3600),
+        ("baz", 12): tt.reader.Measures(900, 1, 900, 900),
+        ("baz", 13): tt.reader.Measures(2400, 1, 2400, 2400),
+    }
+
+
+def test_aggregate_splits_at_week_boundaries(overnight):
+    groups = tt.reader.aggregate(
+        ("week",),
+        datetime(2018, 2, 12, tzinfo=tz_local()),
+        datetime(2018, 2, 26, tzinfo=tz_local()),
+        datetime(2018, 3, 1, tzinfo=tz_local()),
+    )
+
+    assert groups == [
+        ((date(2018, 2, 12),), tt.reader.Measures(6 * 3600, 4, 3600, 2 * 3600)),
+        ((date(2018, 2, 19),), tt.reader.Measures(3600, 1, 3600, 3600)),
+    ]
+
+
+def test_aggregate_clips_to_range(overnight):
+    # From Wednesday 01:00 to Monday 00:30, overlapping the first and last
+    # timers.
+    groups = tt.reader.aggregate(
+        ("task",),
+        datetime(2018, 2, 14, 1, tzinfo=tz_local()),
+        datetime(2018, 2, 19, 0, 30, tzinfo=tz_local()),
+        datetime(2018, 3, 1, tzinfo=tz_local()),
+    )
+
+    assert groups == [
+        (("foo",), tt.reader.Measures(3600 + 5400, 2, 3600, 5400)),
+        (("bar",), tt.reader.Measures(3600, 1, 3600, 3600)),
+    ]
+
+
+def test_aggregate_running_clipped(now):
+    groups = tt.reader.aggregate(
+        ("task",), now - timedelta(days=1), now, now + timedelta(hours=1), True
+    )
+    assert groups == [(("foo",), tt.reader.Measures(3600, 1, 3600, 3600))]
+
+
+def test_slice_uses_indexes(now, session):
+    statement = tt.reader._SLICE[None, False, (False, False)]
+    plan = session.execute(
+        "EXPLAIN QUERY PLAN %s" % statement, {"start": 0, "end": 0}
+    ).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert "ix_timer_start_id" in details
+    assert "ix_timer_stop" in details
+
+
+def test_aggregate_running_after_now(now):
+    groups = tt.reader.aggregate(
+        ("task",), now + timedelta(days=1), now + timedelta(days=2), now
+    )
+    assert groups == []
+
+
+@pytest.fixture
+def tree(session):
+    # acme > web > api, and other, with a timer of 1 to 4 hours from 22:00
+    # local time on consecutive days, in the order acme, other, web, api.
+    names = ["acme", "web", "api", "other"]
+    tasks = [Task(id=id, name=name) for id, name in enumerate(names, 1)]
+    paths = {1: [1], 2: [1, 2], 3: [1, 2, 3], 4: [4]}
+    session.add_all(tasks)
+    session.add_all(
+        TaskTree(
+            ancestor_id=ancestor_id,
+            descendant_id=id,
+            depth=len(path) - level,
+            level=level,
+        )
+        for id, path in paths.items()
+        for level, ancestor_id in enumerate(path, 1)
+    )
+    start = datetime(2018, 2, 14, 22, tzinfo=tz_local())
+    for hours, task in enumerate([tasks[0], tasks[3], tasks[1], tasks[2]], 1):
+        session.add(Timer(task=task, start=start, stop=start + timedelta(hours=hours)))
+        start += timedelta(days=1)
+    session.commit()
+    return datetime(2018, 2, 14, tzinfo=tz_local())
+
+
+@pytest.mark.parametrize(
+    "rollup,expected",
+    [
+        (None, [("acme", 1), ("other", 2), ("web", 3), ("api", 4)]),
+        (1, [("acme", 8), ("other", 2)]),
+        (2, [("acme", 1), ("other", 2), ("web", 7)]),
+        (3, [("acme", 1), ("other", 2), ("web", 3), ("api", 4)]),
+    ],
+)
+def test_aggregate_rollup(tree, rollup, expected):
+    groups = tt.reader.aggregate(
+        ("task",), tree, tree + timedelta(days=7), tree, rollup=rollup
+    )
+    assert [(key, measures.elapsed // 3600) for (key,), measures in groups] == (
+        expected
+    )
+
+
+def test_aggregate_rollup_split(tree):
+    # The web and api timers crossing midnight are split, then rolled up.
+    groups = tt.reader.aggregate(
+        ("day", "task"), tree, tree + timedelta(days=7), tree, rollup=1
+    )
+    assert [(key[0].day, key[1], m.elapsed // 3600) for key, m in groups] == [
+        (14, "acme", 1),
+        (15, "other", 2),
+        (16, "acme", 2),
+        (17, "acme", 3),
+        (18, "acme", 2),
+    ]
+
+
+def test_aggregate_rollup_ignored_without_task(tree):
+    groups = tt.reader.aggregate(
+        ("weekday",), tree, tree + timedelta(days=7), tree, rollup=1
+    )
+    assert sum(measures.elapsed for _, measures in groups) == 10 * 3600
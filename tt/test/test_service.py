@@ -1,15 +1,22 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved.
 
-from datetime import date, datetime, timedelta
+import os
+from datetime import date, datetime, time, timedelta, timezone
 from unittest import mock
 
 import pytest
-from sqlalchemy.orm.exc import NoResultFound
 
-from tt.datetime import tz_local
+from tt.cache import ReportCache
+import tt.datetime
+from tt.datetime import local_time, tz_local
 from tt.exc import BadRequest, ValidationError
 from tt.orm import Task, Timer
+import tt.reader
+from tt.reader import Measures
+import tt.service
+import tt.sql
+import tt.task
 from tt.service import TaskService, TimerService, ReportingService
 
 
@@ -31,13 +38,19 @@ def reporting_service(mocker):
 @mock.patch("tt.task.create")
 def test_add_task(create, task_service):
     task_service.add("foo")
-    create.assert_called_once_with(name="foo", description=None)
+    create.assert_called_once_with(name="foo", description=None, parent=None)
 
 
 @mock.patch("tt.task.create")
 def test_add_task_with_description(create, task_service):
     task_service.add("foo", "bar")
-    create.assert_called_once_with(name="foo", description="bar")
+    create.assert_called_once_with(name="foo", description="bar", parent=None)
+
+
+@mock.patch("tt.task.create")
+def test_add_subtask(create, task_service):
+    task_service.add("web", parent="acme")
+    create.assert_called_once_with(name="web", description=None, parent="acme")
 
 
 @mock.patch("tt.task.create")
@@ -60,73 +73,124 @@ def test_remove_invalid_task(remove, task_service):
         task_service.remove("foo")
 
 
-@mock.patch("tt.task.get")
+@mock.patch("tt.task.merge")
+def test_merge_tasks(merge, task_service):
+    merge.return_value = 3
+
+    assert task_service.merge(["foo", "bar"], "baz") == 3
+    merge.assert_called_once_with(["foo", "bar"], "baz")
+
+
+@mock.patch("tt.task.merge")
+def test_merge_invalid_tasks(merge, task_service):
+    merge.side_effect = ValidationError
+    with pytest.raises(BadRequest):
+        task_service.merge(["foo"], "foo")
+
+
+@mock.patch("tt.task.move")
+def test_move_task(move, task_service):
+    task_service.move("web", parent="acme")
+    move.assert_called_once_with("web", parent="acme")
+
+
+@mock.patch("tt.task.move")
+def test_move_invalid_task(move, task_service):
+    move.side_effect = ValidationError
+    with pytest.raises(BadRequest):
+        task_service.move("acme", parent="acme")
+
+
+@mock.patch("tt.task.lookup")
 @mock.patch("tt.task.update")
-def test_rename_task(update, get, task_service, mocker):
-    old_task = mocker.MagicMock(spec=Task)
-    old_task.id = 1
-    get.return_value = old_task
+def test_rename_task(update, lookup, task_service):
+    lookup.return_value = 1
 
     task_service.rename("old", "new")
 
-    get.assert_called_once_with(name="old")
+    lookup.assert_called_once_with("old")
     update.assert_called_with(1, name="new")
 
 
-@mock.patch("tt.task.get")
+@mock.patch("tt.task.lookup")
 @mock.patch("tt.task.update")
-def test_rename_invalid_task(update, get, task_service, mocker):
-    get.side_effect = NoResultFound
+def test_rename_invalid_task(update, lookup, task_service):
+    lookup.return_value = None
 
     with pytest.raises(BadRequest):
         task_service.rename("old", "new")
 
-    get.assert_called_once_with(name="old")
+    lookup.assert_called_once_with("old")
     assert not update.called
 
 
-@mock.patch("tt.task.get")
+@mock.patch("tt.task.lookup")
 @mock.patch("tt.task.update")
-def test_describe_task(update, get, task_service, mocker):
-    task = mocker.MagicMock(spec=Task)
-    task.id = 1
-    get.return_value = task
+def test_describe_task(update, lookup, task_service):
+    lookup.return_value = 1
 
     task_service.describe("some task", "description")
 
-    get.assert_called_once_with(name="some task")
+    lookup.assert_called_once_with("some task")
     update.assert_called_with(1, description="description")
 
 
-@mock.patch("tt.task.get")
+@mock.patch("tt.task.lookup")
 @mock.patch("tt.task.update")
-def test_describe_invalid_task(update, get, task_service, mocker):
-    get.side_effect = NoResultFound
+def test_describe_invalid_task(update, lookup, task_service):
+    lookup.return_value = None
 
     with pytest.raises(BadRequest):
         task_service.describe("some task", "description")
 
-    get.assert_called_once_with(name="some task")
+    lookup.assert_called_once_with("some task")
     assert not update.called
 
 
-@mock.patch("tt.task.get")
+@mock.patch("tt.task.lookup")
 @mock.patch("tt.task.update")
-def test_describe_task_blank(update, get, task_service, mocker):
-    task = mocker.MagicMock(spec=Task)
-    task.id = 1
-    get.return_value = task
+def test_describe_task_blank(update, lookup, task_service):
+    lookup.return_value = 1
 
     task_service.describe("some task", "")
 
-    get.assert_called_once_with(name="some task")
+    lookup.assert_called_once_with("some task")
     update.assert_called_with(1, description="")
 
 
-@mock.patch("tt.task.tasks")
+def test_select_all(task_service):
+    assert task_service.select() is None
+    assert task_service.select(names=[], patterns=[]) is None
+
+
+@mock.patch("tt.task.matching")
+@mock.patch("tt.task.lookup")
+def test_select(lookup, matching, task_service):
+    lookup.side_effect = {"foo": 3, "bar": 1}.get
+    matching.side_effect = {"client-*": [5, 4], "b*": [1]}.get
+
+    assert task_service.select(names=["foo", "bar"], patterns=["client-*", "b*"]) == [
+        1,
+        3,
+        4,
+        5,
+    ]
+
+
+@mock.patch("tt.task.lookup")
+def test_select_invalid_task(lookup, task_service):
+    lookup.return_value = None
+
+    with pytest.raises(BadRequest):
+        task_service.select(names=["foo"])
+
+
+@mock.patch("tt.reader.tasks")
 def test_list(tasks, task_service):
     expected = [("foo", None), ("bar", None), ("baz", "bam boom")]
-    tasks.return_value = [Task(name=n, description=d) for n, d in expected]
+    tasks.return_value = [
+        tt.reader.TaskRow(i, n, d) for i, (n, d) in enumerate(expected)
+    ]
 
     actual = list(task_service.list())
 
@@ -140,24 +204,24 @@ def test_start(create, mocker, timer_service):
     timestamp = mocker.MagicMock(spec=datetime)
     timer_service.start("foo", timestamp)
 
-    create.assert_called_once_with(task="foo", start=timestamp)
+    create.assert_called_once_with(task="foo", start=timestamp, tags=None, note=None)
 
 
 @mock.patch("tt.timer.create")
-@mock.patch("tt.timer.last")
+@mock.patch("tt.reader.last")
 def test_start_resume_last_task(last, create, mocker, timer_service):
 
-    last.return_value = {"task": "foo"}
+    last.return_value = tt.reader.TimerRow(1, "foo", None, None)
 
     timestamp = mocker.MagicMock(spec=datetime)
     timer_service.start(None, timestamp)
 
     assert last.called
-    create.assert_called_once_with(task="foo", start=timestamp)
+    create.assert_called_once_with(task="foo", start=timestamp, tags=None, note=None)
 
 
 @mock.patch("tt.timer.create")
-@mock.patch("tt.timer.last")
+@mock.patch("tt.reader.last")
 def test_start_resume_no_last_task(last, create, mocker, timer_service):
 
     last.return_value = None
@@ -178,12 +242,11 @@ def test_start_raises(create, mocker, timer_service):
         timer_service.start("foo", timestamp)
 
 
-@mock.patch("tt.timer.active")
+@mock.patch("tt.reader.active")
 @mock.patch("tt.timer.update")
 def test_stop_with_active(update, active, mocker, timer_service):
 
-    timer = Timer(id=1, task=Task(name="foo"), start=mocker.MagicMock(spec=datetime))
-    active.return_value = timer
+    active.return_value = tt.reader.TimerRow(1, "foo", mocker.MagicMock(), None)
 
     timestamp = mocker.MagicMock(spec=datetime)
     timer_service.stop(timestamp)
@@ -192,7 +255,7 @@ def test_stop_with_active(update, active, mocker, timer_service):
     update.assert_called_once_with(1, stop=timestamp)
 
 
-@mock.patch("tt.timer.active")
+@mock.patch("tt.reader.active")
 @mock.patch("tt.timer.update")
 def test_stop_without_active(update, active, mocker, timer_service):
     active.return_value = None
@@ -241,113 +304,193 @@ def test_delete(remove, timer_service):
     remove.assert_called_once_with(id=1234)
 
 
+@mock.patch("tt.timer.retag")
+def test_retag(retag, mocker, timer_service):
+    start, end = mocker.MagicMock(spec=datetime), mocker.MagicMock(spec=datetime)
+    retag.return_value = 3
+
+    assert timer_service.retag("foo", "bar", start, end, dry_run=True) == 3
+    retag.assert_called_once_with("foo", "bar", start, end, dry_run=True)
+
+
+@mock.patch("tt.timer.retag")
+def test_retag_raises(retag, timer_service):
+    retag.side_effect = ValidationError
+
+    with pytest.raises(BadRequest):
+        timer_service.retag("foo", "foo", None, None)
+
+
+@mock.patch("tt.timer.remove_range")
+def test_delete_range(remove_range, mocker, timer_service):
+    start, end = mocker.MagicMock(spec=datetime), mocker.MagicMock(spec=datetime)
+    remove_range.return_value = 2
+
+    assert timer_service.delete_range("foo", start, end) == 2
+    remove_range.assert_called_once_with("foo", start, end, dry_run=False)
+
+
+@mock.patch("tt.timer.remove_range")
+def test_delete_range_raises(remove_range, timer_service):
+    remove_range.side_effect = ValidationError
+
+    with pytest.raises(BadRequest):
+        timer_service.delete_range("foo", None, None)
+
+
+@mock.patch("tt.tag.detach")
+@mock.patch("tt.tag.attach")
+def test_tag_untag(attach, detach, timer_service):
+    timer_service.tag(1, ["billable"])
+    timer_service.untag(1, ["meeting"])
+
+    attach.assert_called_once_with(1, ["billable"])
+    detach.assert_called_once_with(1, ["meeting"])
+
+
+@pytest.mark.parametrize("method,function", [("tag", "attach"), ("untag", "detach")])
+def test_tag_raises(method, function, mocker, timer_service):
+    mocker.patch("tt.tag.%s" % function, side_effect=ValidationError)
+
+    with pytest.raises(BadRequest):
+        getattr(timer_service, method)(1, ["billable"])
+
+
+@mock.patch("tt.tag.lookup")
+def test_tag_filter(lookup, timer_service):
+    lookup.side_effect = lambda names: [len(name) for name in names]
+
+    assert timer_service.tag_filter() is None
+    assert timer_service.tag_filter(["ab"]) == tt.reader.TagFilter([2], [])
+    assert timer_service.tag_filter(not_tags=["abc"]) == tt.reader.TagFilter([], [3])
+
+
+@mock.patch("tt.tag.lookup")
+def test_tag_filter_raises(lookup, timer_service):
+    lookup.side_effect = ValidationError
+
+    with pytest.raises(BadRequest):
+        timer_service.tag_filter(["other"])
+
+
+def _row(id, task, start, hours):
+    start = start.astimezone(timezone.utc)
+    return tt.reader.TimerRow(id, task, start, start + timedelta(hours=hours))
+
+
 @pytest.fixture
 def slices():
     return [
-        {
-            "start": datetime(2018, 2, 28, 9, 0, tzinfo=tz_local()),
-            "elapsed": timedelta(hours=1),
-            "task": "one",
-        },
-        {
-            "start": datetime(2018, 2, 28, 10, 0, tzinfo=tz_local()),
-            "elapsed": timedelta(hours=2),
-            "task": "two",
-        },
-        {
-            "start": datetime(2018, 2, 28, 11, 0, tzinfo=tz_local()),
-            "elapsed": timedelta(hours=4),
-            "task": "one",
-        },
-        {
-            "start": datetime(2018, 3, 1, 9, 0, tzinfo=tz_local()),
-            "elapsed": timedelta(hours=8),
-            "task": "two",
-        },
-        {
-            "start": datetime(2018, 3, 1, 10, 0, tzinfo=tz_local()),
-            "elapsed": timedelta(hours=16),
-            "task": "one",
-        },
-        {
-            "start": datetime(2018, 3, 1, 11, 0, tzinfo=tz_local()),
-            "elapsed": timedelta(hours=32),
-            "task": "two",
-        },
+        _row(1, "one", datetime(2018, 2, 28, 9, 0, tzinfo=tz_local()), 1),
+        _row(2, "two", datetime(2018, 2, 28, 10, 0, tzinfo=tz_local()), 2),
+        _row(3, "one", datetime(2018, 2, 28, 11, 0, tzinfo=tz_local()), 4),
+        _row(4, "two", datetime(2018, 3, 1, 9, 0, tzinfo=tz_local()), 8),
+        _row(5, "one", datetime(2018, 3, 1, 10, 0, tzinfo=tz_local()), 16),
+        _row(6, "two", datetime(2018, 3, 1, 11, 0, tzinfo=tz_local()), 32),
     ]
 
 
-@mock.patch("tt.timer.slice")
-def test_slice_grouped_by_date(mocked_slice, slices, timer_service):
+@pytest.fixture
+def records(slices):
+    return [tt.reader.as_dict(row, now=None) for row in slices]
+
+
+@mock.patch("tt.reader.slice")
+def test_slice_grouped_by_date(mocked_slice, slices, records, timer_service):
 
     mocked_slice.return_value = slices
 
     results = list(timer_service.slice_grouped_by_date())
 
-    assert results == [(date(2018, 2, 28), slices[:3]), (date(2018, 3, 1), slices[3:])]
+    assert results == [
+        (date(2018, 2, 28), records[:3]),
+        (date(2018, 3, 1), records[3:]),
+    ]
 
 
-@mock.patch("tt.timer.slice")
-def test_slice_grouped_by_date_elapsed(mocked_slice, slices, timer_service):
+@mock.patch("tt.reader.position")
+def test_position(position, timer_service):
+    position.return_value = (datetime(2018, 2, 28, tzinfo=timezone.utc), 3)
 
-    mocked_slice.return_value = slices
+    assert timer_service.position(3) == position.return_value
+    position.assert_called_once_with(3)
 
-    results = list(timer_service.slice_grouped_by_date(elapsed=True))
-    assert results == [
-        (date(2018, 2, 28), timedelta(hours=7)),
-        (date(2018, 3, 1), timedelta(hours=56)),
-    ]
 
+@mock.patch("tt.reader.position")
+def test_position_invalid(position, timer_service):
+    position.return_value = None
 
-@mock.patch("tt.timer.slice")
-def test_slice_grouped_by_task(mocked_slice, slices, timer_service):
+    with pytest.raises(BadRequest):
+        timer_service.position(3)
 
-    mocked_slice.return_value = slices
 
-    results = list(timer_service.slice_grouped_by_task())
-    assert results == [
-        ("one", [slices[0], slices[2], slices[4]]),
-        ("two", [slices[1], slices[3], slices[5]]),
-    ]
+@mock.patch("tt.reader.page")
+def test_page(page, slices, records, timer_service):
+    page.return_value = slices
+    after = (datetime(2018, 2, 28, tzinfo=timezone.utc), 0)
+    end = datetime(2018, 3, 2, tzinfo=timezone.utc)
 
+    assert timer_service.page(after, end, limit=6) == records
+    page.assert_called_once_with(after, end, 6, None, None)
 
-@mock.patch("tt.timer.slice")
-def test_slice_grouped_by_task_elapsed(mocked_slice, slices, timer_service):
 
-    mocked_slice.return_value = slices
+@mock.patch("tt.reader.recent")
+def test_recent(recent, slices, records, timer_service):
+    recent.return_value = slices[::-1]
 
-    results = list(timer_service.slice_grouped_by_task(elapsed=True))
+    assert timer_service.recent(6) == records[::-1]
+    recent.assert_called_once_with(6, None)
 
-    assert results == [("one", timedelta(hours=21)), ("two", timedelta(hours=42))]
 
+def test_records_by_day(records, reporting_service):
+    tables = list(reporting_service.records_by_day(records))
 
-@mock.patch("tt.timer.slice")
-def test_slice_grouped_by_date_task(mocked_slice, slices, timer_service):
+    assert [table.caption for table in tables] == [
+        "Wednesday February 28, 2018",
+        "Thursday March 01, 2018",
+    ]
+    assert [len(table.table) for table in tables] == [3, 3]
 
-    mocked_slice.return_value = slices
 
-    results = list(timer_service.slice_grouped_by_date_task())
+def test_log(records, reporting_service):
+    table = reporting_service.log(records)
 
-    assert results == [
-        (date(2018, 2, 28), "one", [slices[0], slices[2]]),
-        (date(2018, 2, 28), "two", [slices[1]]),
-        (date(2018, 3, 1), "two", [slices[3], slices[5]]),
-        (date(2018, 3, 1), "one", [slices[4]]),
+    assert table.headers == ["id", "task", "start", "stop", "elapsed"]
+    assert len(table.table) == 6
+
+
+def test_summary_by_task_plain(reporting_service):
+    reporting_service.timer_service.aggregate.return_value = [
+        (("foo",), Measures(3600, 1, 3600, 3600)),
+        (("bar",), Measures(7200, 2, 3600, 3600)),
     ]
 
+    table = reporting_service.summary_by_task(None, None, plain=True)
 
-@mock.patch("tt.timer.slice")
-def test_slice_grouped_by_date_task_elapsed(mocked_slice, slices, timer_service):
+    assert [dict(row) for row in table.rows()] == [
+        {"task": "foo", "elapsed": 3600},
+        {"task": "bar", "elapsed": 7200},
+    ]
 
-    mocked_slice.return_value = slices
 
-    results = list(timer_service.slice_grouped_by_date_task(elapsed=True))
+def test_summary_by_day_and_task_plain(reporting_service):
+    reporting_service.timer_service.aggregate.return_value = [
+        ((date(2018, 2, 14), "foo"), Measures(3600, 1, 3600, 3600)),
+        ((date(2018, 2, 15), "bar"), Measures(7200, 1, 7200, 7200)),
+    ]
+    start = datetime(2018, 2, 12, tzinfo=tz_local())
 
-    assert results == [
-        (date(2018, 2, 28), "one", timedelta(hours=5)),
-        (date(2018, 2, 28), "two", timedelta(hours=2)),
-        (date(2018, 3, 1), "two", timedelta(hours=40)),
-        (date(2018, 3, 1), "one", timedelta(hours=16)),
+    tables = list(
+        reporting_service.summary_by_day_and_task(
+            start, start + timedelta(days=7), plain=True
+        )
+    )
+
+    assert len(tables) == 1
+    assert tables[0].caption == "Week 07"
+    assert [dict(row) for row in tables[0].rows()] == [
+        {"date": "2018-02-14", "task": "foo", "elapsed": 3600},
+        {"date": "2018-02-15", "task": "bar", "elapsed": 7200},
     ]
 
 
@@ -363,55 +506,75 @@ def test_timers_by_day(mocker, reporting_service):
     assert tables
 
     reporting_service.timer_service.slice_grouped_by_date.assert_called_once_with(
-        start=start, end=end
+        start=start, end=end, task_ids=None, tags=None
     )
 
 
 def test_summary_by_task(mocker, reporting_service):
-    slice_ = [(mocker.MagicMock(spec=str), mocker.MagicMock(spec=timedelta))]
-    reporting_service.timer_service.slice_grouped_by_task.return_value = slice_
+    reporting_service.timer_service.aggregate.return_value = [
+        (("foo",), Measures(600, 1, 600, 600)),
+        (("bar",), Measures(1200, 2, 300, 900)),
+    ]
 
     start = mocker.MagicMock(spec=datetime)
     end = mocker.MagicMock(spec=datetime)
 
     table = reporting_service.summary_by_task(start, end)
 
-    assert table
+    assert table.labels == ["foo", "bar", "TOTAL"]
+    assert table.table[-1] == {"elapsed": timedelta(seconds=1800)}
 
-    reporting_service.timer_service.slice_grouped_by_task.assert_called_once_with(
-        start=start, end=end, elapsed=True
+    reporting_service.timer_service.aggregate.assert_called_once_with(
+        ("task",), start=start, end=end, task_ids=None, rollup=None, tags=None
     )
 
 
+def test_summary_by_task_no_data(reporting_service):
+    reporting_service.timer_service.aggregate.return_value = []
+
+    table = reporting_service.summary_by_task(None, None)
+
+    assert table.headers == ["elapsed"]
+    assert table.labels == ["TOTAL"]
+    assert table.table == [{"elapsed": timedelta(0)}]
+    assert "Total" in str(table)
+
+
 @mock.patch("tt.datetime.range_weeks")
 @mock.patch("tt.datetime.week_boundaries")
 def test_summary_by_day_and_task(
     mock_week_boundaries, mock_range_weeks, mocker, reporting_service
 ):
-    slice_ = [
-        (
-            mocker.MagicMock(spec=datetime),
-            mocker.MagicMock(spec=str),
-            timedelta(seconds=600),
-        )
+    reporting_service.timer_service.aggregate.return_value = [
+        ((date(2018, 2, 14), "foo"), Measures(600, 1, 600, 600)),
+        ((date(2018, 2, 15), "foo"), Measures(300, 1, 300, 300)),
+        ((date(2018, 2, 15), "bar"), Measures(900, 1, 900, 900)),
     ]
-    reporting_service.timer_service.slice_grouped_by_date_task.return_value = slice_
 
     start = mocker.MagicMock(spec=datetime)
     end = mocker.MagicMock(spec=datetime)
 
-    week_start = mocker.MagicMock(spec=datetime)
+    week_start = datetime(2018, 2, 12, tzinfo=tz_local())
     mock_week_boundaries.return_value = (week_start, None)
 
     mock_range_weeks.return_value = [week_start]
 
-    table = list(reporting_service.summary_by_day_and_task(start, end))
-    assert table
+    tables = list(reporting_service.summary_by_day_and_task(start, end))
+    assert len(tables) == 1
+    table = tables[0]
+    assert table.caption == "Week 07"
+    assert table.labels == ["foo", "bar", "TOTAL"]
+    assert table.headers == [date(2018, 2, 14), date(2018, 2, 15)]
+    assert table.summaries == [
+        timedelta(seconds=900),
+        timedelta(seconds=900),
+        timedelta(seconds=1800),
+    ]
 
     mock_week_boundaries.assert_called_once_with(start)
     mock_range_weeks.assert_called_once_with(week_start, end)
-    reporting_service.timer_service.slice_grouped_by_date_task.assert_called_once_with(
-        start=week_start, end=mock.ANY, elapsed=True
+    reporting_service.timer_service.aggregate.assert_called_once_with(
+        ("day", "task"), start=week_start, end=mock.ANY, task_ids=None, tags=None
     )
 
 
@@ -420,14 +583,9 @@ def test_summary_by_day_and_task(
 def test_summary_by_day_and_task_week_start_is_end(
     mock_week_boundaries, mock_range_weeks, mocker, reporting_service
 ):
-    slice_ = [
-        (
-            mocker.MagicMock(spec=datetime),
-            mocker.MagicMock(spec=str),
-            timedelta(seconds=600),
-        )
+    reporting_service.timer_service.aggregate.return_value = [
+        ((date(2018, 2, 14), "foo"), Measures(600, 1, 600, 600))
     ]
-    reporting_service.timer_service.slice_grouped_by_date_task.return_value = slice_
 
     start = mocker.MagicMock(spec=datetime)
     end = mocker.MagicMock(spec=datetime)
@@ -444,8 +602,7 @@ def test_summary_by_day_and_task_week_start_is_end(
 def test_summary_by_day_and_task_no_data(
     mock_week_boundaries, mock_range_weeks, mocker, reporting_service
 ):
-    slice_ = []
-    reporting_service.timer_service.slice_grouped_by_date_task.return_value = slice_
+    reporting_service.timer_service.aggregate.return_value = []
 
     start = mocker.MagicMock(spec=datetime)
     end = mocker.MagicMock(spec=datetime)
@@ -462,3 +619,406 @@ def test_summary_by_day_and_task_no_data(
 @pytest.mark.parametrize("value", [datetime(1970, 1, 1), timedelta(hours=1), "foo"])
 def test_formatter(value, reporting_service):
     assert reporting_service._formatter(value) is not None
+
+
+@pytest.fixture
+def cached_timer_service():
+    return TimerService(cache=ReportCache())
+
+
+@mock.patch("tt.meta.version")
+@mock.patch("tt.reader.aggregate")
+def test_aggregate_cached_per_tag_filter(aggregate, version, cached_timer_service):
+    version.return_value = (7, 1)
+    aggregate.return_value = []
+
+    start = datetime(2018, 2, 1, tzinfo=tz_local())
+    end = datetime(2018, 3, 1, tzinfo=tz_local())
+
+    filters = [None, tt.reader.TagFilter([1], []), tt.reader.TagFilter([], [1])]
+    for tags in filters + filters:
+        cached_timer_service.aggregate(["task"], start, end, tags=tags)
+
+    stopped = [call for call in aggregate.call_args_list if not call[1]["running"]]
+    assert [call[1]["tags"] for call in stopped] == filters
+
+
+@mock.patch("tt.meta.version")
+@mock.patch("tt.reader.aggregate")
+def test_aggregate_cached(aggregate, version, cached_timer_service):
+    version.return_value = (7, 1)
+    stopped = [(("foo",), Measures(600, 1, 600, 600))]
+    running_groups = [
+        (("foo",), Measures(60, 1, 60, 60)),
+        (("bar",), Measures(5, 1, 5, 5)),
+    ]
+    aggregate.side_effect = (
+        lambda *args, running=None, task_ids=None, rollup=None, tags=None: (
+            running_groups if running else stopped
+        )
+    )
+
+    start = datetime(2018, 2, 1, tzinfo=tz_local())
+    end = datetime(2018, 3, 1, tzinfo=tz_local())
+
+    expected = [
+        (("foo",), Measures(660, 2, 60, 600)),
+        (("bar",), Measures(5, 1, 5, 5)),
+    ]
+    assert cached_timer_service.aggregate(["task"], start, end) == expected
+    assert aggregate.call_count == 2
+
+    # The stopped timers are now cached, only the running timer is fetched.
+    assert cached_timer_service.aggregate(["task"], start, end) == expected
+    assert aggregate.call_count == 3
+    aggregate.assert_called_with(
+        ("task",),
+        start,
+        end,
+        mock.ANY,
+        running=True,
+        task_ids=None,
+        rollup=None,
+        tags=None,
+    )
+
+    # A new data version invalidates the cached measures.
+    version.return_value = (7, 2)
+    assert cached_timer_service.aggregate(["task"], start, end) == expected
+    assert aggregate.call_count == 5
+
+
+@mock.patch("tt.meta.version")
+@mock.patch("tt.reader.aggregate")
+def test_aggregate_cached_per_task_filter(aggregate, version, cached_timer_service):
+    version.return_value = (7, 1)
+    aggregate.return_value = []
+
+    start = datetime(2018, 2, 1, tzinfo=tz_local())
+    end = datetime(2018, 3, 1, tzinfo=tz_local())
+
+    for task_ids in (None, [1], [1, 2], None, [1]):
+        cached_timer_service.aggregate(["task"], start, end, task_ids=task_ids)
+
+    stopped = [call for call in aggregate.call_args_list if not call[1]["running"]]
+    assert [call[1]["task_ids"] for call in stopped] == [None, [1], [1, 2]]
+
+
+@mock.patch("tt.meta.version")
+@mock.patch("tt.reader.aggregate")
+def test_aggregate_cached_per_rollup(aggregate, version, cached_timer_service):
+    version.return_value = (7, 1)
+    aggregate.return_value = []
+    start = datetime(2018, 2, 1, tzinfo=tz_local())
+    end = datetime(2018, 3, 1, tzinfo=tz_local())
+
+    cached_timer_service.aggregate(["task"], start, end)
+    cached_timer_service.aggregate(["task"], start, end, rollup=1)
+    cached_timer_service.aggregate(["task"], start, end, rollup=1)
+
+    stopped = [c for c in aggregate.call_args_list if not c[1]["running"]]
+    assert [c[1]["rollup"] for c in stopped] == [None, 1]
+
+
+@mock.patch("tt.reader.aggregate")
+def test_aggregate_uncacheable(aggregate, cached_timer_service):
+    aggregate.return_value = [(("foo",), Measures(600, 1, 600, 600))]
+
+    assert cached_timer_service.aggregate(["day"], task_ids=[1]) == (
+        aggregate.return_value
+    )
+    aggregate.assert_called_once_with(
+        ("day",), mock.ANY, mock.ANY, mock.ANY, task_ids=[1], rollup=None, tags=None
+    )
+
+
+def _cached_totals(db_file, cache_file, task, hours):
+    tt.sql.connect(db_url="sqlite:///%s" % db_file)
+    start = datetime(2018, 2, 12, 9, 0, tzinfo=tz_local())
+    if task is not None:
+        tt.task.create(task)
+        service = TimerService()
+        service.start(task, start)
+        service.stop(start + timedelta(hours=hours))
+
+    cache = ReportCache(cache_file)
+    groups = TimerService(cache=cache).aggregate(
+        ["task"], start - timedelta(days=1), start + timedelta(days=1)
+    )
+    cache.flush()
+    return [(key, measures.elapsed) for key, measures in groups]
+
+
+def test_aggregate_cached_per_database(tmpdir):
+    db_file = str(tmpdir.join("timetrack.db"))
+    cache_file = str(tmpdir.join("reports.cache"))
+    try:
+        assert _cached_totals(db_file, cache_file, "foo", 8) == [(("foo",), 28800)]
+
+        # A new database at the same location, with the same data version.
+        os.rename(db_file, db_file + ".old")
+        assert _cached_totals(db_file, cache_file, "bar", 1) == [(("bar",), 3600)]
+
+        # The original database restored from a backup.
+        os.replace(db_file + ".old", db_file)
+        assert _cached_totals(db_file, cache_file, None, 0) == [(("foo",), 28800)]
+    finally:
+        tt.sql.connect(db_url="sqlite:///")
+
+
+def test_pivot(reporting_service):
+    reporting_service.timer_service.aggregate.return_value = [
+        ((9, "foo"), Measures(600, 1, 600, 600)),
+        ((8, "bar"), Measures(300, 2, 100, 200)),
+    ]
+
+    table = reporting_service.pivot(
+        None, None, ["hour"], ["task"], measure="min", task_ids=[1, 2]
+    )
+
+    assert table.labels == [8, 9, "TOTAL"]
+    assert table.table[-1] == {
+        "foo": timedelta(seconds=600),
+        "bar": timedelta(seconds=100),
+    }
+    assert table.summaries[-1] == timedelta(seconds=100)
+    reporting_service.timer_service.aggregate.assert_called_once_with(
+        ("hour", "task"),
+        start=None,
+        end=None,
+        task_ids=[1, 2],
+        rollup=None,
+        tags=None,
+    )
+
+
+def test_summary_by_task_rollup(reporting_service):
+    reporting_service.timer_service.aggregate.return_value = []
+
+    reporting_service.summary_by_task(None, None, rollup=2)
+    reporting_service.pivot(None, None, ["task"], rollup=2)
+
+    for c in reporting_service.timer_service.aggregate.call_args_list:
+        assert c[1]["rollup"] == 2
+
+
+def test_pivot_plain(reporting_service):
+    reporting_service.timer_service.aggregate.return_value = [
+        (("foo", 9), Measures(600, 1, 600, 600))
+    ]
+
+    table = reporting_service.pivot(None, None, ["task", "hour"], plain=True)
+
+    assert [dict(row) for row in table.rows()] == [
+        {"task/hour": "foo/9", "elapsed": 600}
+    ]
+
+
+@mock.patch("tt.reader.timeline")
+def test_check(timeline, timer_service):
+    t0 = datetime(2018, 2, 12, 9, 0, tzinfo=timezone.utc)
+    timeline.return_value = iter(
+        [
+            tt.reader.TimerRow(1, "foo", t0, t0 + timedelta(hours=2)),
+            tt.reader.TimerRow(2, "bar", t0 + timedelta(hours=1), t0),
+            tt.reader.TimerRow(3, "bar", t0 + timedelta(hours=1), None),
+        ]
+    )
+
+    with tt.datetime.frozen(t0 + timedelta(hours=3)):
+        problems = list(timer_service.check())
+
+    assert problems == [
+        {
+            "kind": "negative",
+            "timers": "2",
+            "start": local_time(t0 + timedelta(hours=1)),
+            "stop": local_time(t0),
+            "elapsed": timedelta(hours=1),
+        },
+        {
+            "kind": "overlap",
+            "timers": "1, 3",
+            "start": local_time(t0 + timedelta(hours=1)),
+            "stop": local_time(t0 + timedelta(hours=2)),
+            "elapsed": timedelta(hours=1),
+        },
+    ]
+
+
+@mock.patch("tt.reader.search")
+def test_search(search, timer_service):
+    t0 = datetime(2018, 2, 12, 9, 0, tzinfo=timezone.utc)
+    search.return_value = [
+        tt.reader.SearchRow(1, "foo", t0, t0 + timedelta(hours=1), "[Planning]")
+    ]
+
+    records = timer_service.search("planning", limit=5)
+
+    assert records == [
+        {
+            "id": 1,
+            "task": "foo",
+            "start": local_time(t0),
+            "stop": local_time(t0 + timedelta(hours=1)),
+            "elapsed": timedelta(hours=1),
+            "note": "[Planning]",
+        }
+    ]
+    text, start, end, limit = search.call_args[0]
+    assert (text, start, limit) == (
+        "planning",
+        datetime(1970, 1, 1, tzinfo=timezone.utc),
+        5,
+    )
+    assert end.tzinfo is not None
+    assert search.call_args[1] == {"task_ids": None, "tags": None}
+
+
+@mock.patch("tt.reader.search")
+def test_search_filters(search, timer_service):
+    search.return_value = []
+    tags = tt.reader.TagFilter([1], [])
+
+    timer_service.search("planning", task_ids=[1, 2], tags=tags)
+
+    assert search.call_args[1] == {"task_ids": [1, 2], "tags": tags}
+
+
+def test_matches(reporting_service):
+    records = [{"id": 1, "task": "foo", "note": "[Planning]"}]
+
+    table = reporting_service.matches(records)
+
+    assert table.headers == ["id", "task", "start", "elapsed", "note"]
+    assert table.table == records
+
+
+@mock.patch("tt.reader.timeline")
+def test_untracked(timeline, timer_service):
+    monday = datetime(2018, 2, 12, tzinfo=tz_local())
+    timeline.return_value = iter(
+        [
+            tt.reader.TimerRow(
+                1, "foo", monday + timedelta(hours=10), monday + timedelta(hours=16)
+            )
+        ]
+    )
+
+    with tt.datetime.frozen(monday + timedelta(days=7)):
+        gaps = list(
+            timer_service.untracked(
+                monday, monday + timedelta(days=1), (time(9), time(17))
+            )
+        )
+
+    assert gaps == [
+        {
+            "date": monday.date(),
+            "start": monday + timedelta(hours=9),
+            "stop": monday + timedelta(hours=10),
+            "elapsed": timedelta(hours=1),
+        },
+        {
+            "date": monday.date(),
+            "start": monday + timedelta(hours=16),
+            "stop": monday + timedelta(hours=17),
+            "elapsed": timedelta(hours=1),
+        },
+    ]
+    timeline.assert_called_once_with(start=monday, end=monday + timedelta(days=1))
+
+
+@pytest.mark.parametrize(
+    "day,hours",
+    [
+        (date(2018, 7, 3), (time(9), time(17))),
+        # The end of daylight saving time, at 02:00.
+        (date(2018, 11, 4), (time(0), time(4))),
+    ],
+)
+@mock.patch("tt.reader.timeline")
+def test_untracked_local_time(timeline, timer_service, new_york, day, hours):
+    start = datetime.combine(day, time(), tzinfo=tz_local())
+    timeline.return_value = iter([])
+
+    with tt.datetime.frozen(start + timedelta(days=7)):
+        (gap,) = timer_service.untracked(start, start + timedelta(days=1), hours)
+
+    assert gap["date"] == day
+    assert (gap["start"].hour, gap["stop"].hour) == (hours[0].hour, hours[1].hour)
+    assert gap["start"].utcoffset() == timedelta(hours=-4)
+    assert gap["stop"] > gap["start"]
+
+
+def test_untracked_table(reporting_service):
+    gaps = [{"date": date(2018, 2, 12), "elapsed": timedelta(hours=1)}]
+
+    table = reporting_service.untracked(gaps)
+
+    assert table.headers == ["date", "start", "stop", "elapsed"]
+    assert table.table == gaps
+
+
+def test_problems(reporting_service):
+    problems = [{"kind": "gap", "timers": "1, 2", "elapsed": timedelta(hours=1)}]
+
+    table = reporting_service.problems(problems)
+
+    assert table.headers == ["kind", "timers", "start", "stop", "elapsed"]
+    assert table.table == problems
+
+
+@mock.patch("tt.timer.create")
+def test_start_default_timestamp(create, timer_service):
+    instant = datetime(2018, 2, 14, 9, 0, tzinfo=tz_local())
+    with tt.datetime.frozen(instant) as now:
+        timer_service.start("foo")
+
+    create.assert_called_once_with(task="foo", start=now, tags=None, note=None)
+
+
+@mock.patch("tt.reader.active")
+@mock.patch("tt.timer.update")
+def test_stop_default_timestamp(update, active, mocker, timer_service):
+    active.return_value = tt.reader.TimerRow(1, "foo", mocker.MagicMock(), None)
+
+    instant = datetime(2018, 2, 14, 9, 0, tzinfo=tz_local())
+    with tt.datetime.frozen(instant) as now:
+        timer_service.stop()
+
+    update.assert_called_once_with(1, stop=now)
+
+
+def _report_statements(session, count_statements, names):
+    end = datetime(2018, 3, 5, tzinfo=tz_local())
+    start = end - timedelta(days=14)
+    for i, name in enumerate(names):
+        timer_start = start + timedelta(hours=6 * i, minutes=5 * len(names))
+        session.add(
+            Timer(
+                task=Task(name=name),
+                start=timer_start,
+                stop=timer_start + timedelta(minutes=5),
+            )
+        )
+    session.commit()
+    session.close()
+
+    reporting_service = ReportingService(TimerService())
+    with count_statements() as counter:
+        for table in reporting_service.timers_by_day(start, end):
+            str(table)
+        str(reporting_service.summary_by_task(start, end))
+        for table in reporting_service.summary_by_day_and_task(start, end):
+            str(table)
+    return counter.count
+
+
+@pytest.mark.parametrize("count", [10, 50])
+def test_report_statement_count_is_constant(session, count_statements, count):
+    few = _report_statements(session, count_statements, ["one"])
+    many = _report_statements(
+        session, count_statements, ["task%d" % i for i in range(count)]
+    )
+    assert few == many
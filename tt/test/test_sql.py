@@ -1,7 +1,359 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved
 
+from datetime import datetime, timedelta, timezone
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import tt.sql
+from tt.sql import (
+    EpochDateTime,
+    Statistics,
+    connect,
+    disable_statistics,
+    enable_statistics,
+    read_transaction,
+    transaction,
+)
+
 
 def test_can_access_db(session):
     result = session.execute("select 1")
     assert result.scalar() == 1
+
+
+@pytest.mark.parametrize(
+    "statement,shape",
+    [
+        ("select 1", "select 1"),
+        ("SELECT  *\n  FROM timer", "SELECT * FROM timer"),
+        (
+            "SELECT * FROM task WHERE id IN (?, ?, ?)",
+            "SELECT * FROM task WHERE id IN (?, ...)",
+        ),
+        ("SELECT * FROM task WHERE id = ?", "SELECT * FROM task WHERE id = ?"),
+    ],
+)
+def test_statement_shape(statement, shape):
+    assert Statistics.shape(statement) == shape
+
+
+def test_statistics():
+    statistics = Statistics()
+    statistics.executed("b", 1.0)
+    statistics.executed("a", 2.0)
+    statistics.executed("b", 2.0)
+    statistics.fetched("b", 10)
+
+    assert statistics.as_list() == [
+        {"statement": "b", "count": 2, "rows": 10, "seconds": 3.0},
+        {"statement": "a", "count": 1, "rows": 0, "seconds": 2.0},
+    ]
+    assert statistics.totals() == {"count": 3, "rows": 10, "seconds": 5.0}
+
+
+def test_statistics_count_rows():
+    statistics = enable_statistics()
+    try:
+        connect(db_url="sqlite:///")
+        with transaction() as session:
+            session.execute("create table t (x integer)")
+            session.execute("insert into t values (1), (2), (3)")
+            assert len(session.execute("select x from t").fetchall()) == 3
+            assert session.execute("select x from t where x > 1").fetchone()
+            assert len(session.execute("select x from t").fetchmany(2)) == 2
+    finally:
+        disable_statistics()
+
+    statements = {s["statement"]: s for s in statistics.as_list()}
+    assert statements["insert into t values (1), (2), (3)"]["rows"] == 3
+    assert statements["select x from t"]["count"] == 2
+    assert statements["select x from t"]["rows"] == 5
+    assert statements["select x from t where x > 1"]["rows"] == 1
+
+
+def test_statistics_disabled(session):
+    assert tt.sql.statistics is None
+    assert session.execute("select 1").fetchall() == [(1,)]
+
+
+def test_epoch_datetime_bind():
+    epoch = EpochDateTime()
+    tz = timezone(timedelta(hours=-5))
+
+    assert epoch.process_bind_param(None, None) is None
+    assert epoch.process_bind_param(datetime(1970, 1, 1, tzinfo=tz), None) == 18000
+    assert (
+        epoch.process_bind_param(
+            datetime(2018, 2, 14, 9, 0, 0, 999, timezone.utc), None
+        )
+        == 1518598800
+    )
+
+
+def test_epoch_datetime_bind_invalid():
+    epoch = EpochDateTime()
+    with pytest.raises(ValueError):
+        epoch.process_bind_param(datetime(2018, 2, 14), None)
+    with pytest.raises(TypeError):
+        epoch.process_bind_param("2018-02-14", None)
+
+
+def test_epoch_datetime_result():
+    epoch = EpochDateTime()
+    assert epoch.process_result_value(None, None) is None
+    assert epoch.process_result_value(1518598800, None) == datetime(
+        2018, 2, 14, 9, 0, tzinfo=timezone.utc
+    )
+
+
+def test_connect_sets_schema_version(session):
+    assert session.execute("PRAGMA user_version").scalar() == tt.sql.SCHEMA_VERSION
+
+
+def _indexes(session):
+    return {
+        row.name
+        for row in session.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    }
+
+
+def test_connect_creates_indexes(session):
+    assert {
+        "ix_timer_start_id",
+        "ix_timer_task_id_start",
+        "ix_timer_stop",
+        "ix_task_tree_ancestor_id_depth",
+        "ix_timer_tag_timer_id",
+    } <= _indexes(session)
+
+
+def _database_id(session):
+    return session.execute(
+        "SELECT value FROM meta WHERE key = :key", {"key": tt.sql.DATABASE_ID}
+    ).scalar()
+
+
+def test_connect_assigns_database_id(session):
+    database_id = _database_id(session)
+    assert database_id is not None
+
+    tt.sql.Session.remove()
+    connect(db_url="sqlite:///")
+    with transaction() as other:
+        assert _database_id(other) not in (None, database_id)
+
+
+def _notes(session, query):
+    return [
+        row.rowid
+        for row in session.execute(
+            "SELECT rowid FROM timer_note WHERE timer_note MATCH :query",
+            {"query": query},
+        )
+    ]
+
+
+def test_note_index(session):
+    session.execute("INSERT INTO task (id, name) VALUES (1, 'foo')")
+    session.execute(
+        "INSERT INTO timer (id, start, task_id, note) VALUES "
+        "(1, 0, 1, 'Sprint planning'), (2, 60, 1, NULL)"
+    )
+    assert _notes(session, "planning") == [1]
+
+    session.execute("UPDATE timer SET note = 'Code review' WHERE id = 1")
+    session.execute("UPDATE timer SET note = 'Design review' WHERE id = 2")
+    assert _notes(session, "planning") == []
+    assert _notes(session, "review") == [1, 2]
+
+    session.execute("UPDATE timer SET stop = 30 WHERE id = 1")
+    session.execute("DELETE FROM timer WHERE id = 2")
+    assert _notes(session, "review") == [1]
+
+
+def test_migrate_text_timestamps(tmpdir):
+    db_file = str(tmpdir.join("legacy.db"))
+    with sqlite3.connect(db_file) as legacy:
+        legacy.executescript("""
+            CREATE TABLE task (
+                id INTEGER NOT NULL,
+                name VARCHAR(24) NOT NULL,
+                description VARCHAR(255),
+                PRIMARY KEY (id),
+                UNIQUE (name)
+            );
+            CREATE TABLE timer (
+                id INTEGER NOT NULL,
+                start DATETIME NOT NULL,
+                stop DATETIME,
+                task_id INTEGER NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY(task_id) REFERENCES task (id)
+            );
+            INSERT INTO task VALUES (1, 'foo', NULL);
+            INSERT INTO timer VALUES
+                (1, '2018-02-14 09:00:00.000000', '2018-02-14 10:30:00.250000', 1),
+                (2, '2018-02-14 11:00:00.000000', NULL, 1);
+            """)
+    legacy.close()
+
+    connect(db_url="sqlite:///%s" % db_file)
+
+    with transaction() as session:
+        assert session.execute("PRAGMA user_version").scalar() == 8
+        assert {
+            "ix_timer_start_id",
+            "ix_timer_task_id_start",
+            "ix_timer_stop",
+            "ix_task_tree_ancestor_id_depth",
+            "ix_timer_tag_timer_id",
+        } <= _indexes(session)
+        rows = session.execute("SELECT id, start, stop, task_id FROM timer").fetchall()
+        tree = session.execute("SELECT * FROM task_tree").fetchall()
+    assert [tuple(row) for row in tree] == [(1, 1, 0, 1)]
+
+    with transaction() as session:
+        session.execute("UPDATE timer SET note = 'Sprint planning' WHERE id = 2")
+        matches = session.execute(
+            "SELECT rowid FROM timer_note WHERE timer_note MATCH 'planning'"
+        ).fetchall()
+    assert [tuple(row) for row in matches] == [(2,)]
+    assert [tuple(row) for row in rows] == [
+        (1, 1518598800, 1518604200, 1),
+        (2, 1518606000, None, 1),
+    ]
+
+    with transaction() as session:
+        database_id = _database_id(session)
+    assert database_id is not None
+
+    # Connecting again does not migrate twice.
+    connect(db_url="sqlite:///%s" % db_file)
+    with transaction() as session:
+        assert session.execute("SELECT start FROM timer WHERE id = 1").scalar() == (
+            1518598800
+        )
+        assert _database_id(session) == database_id
+
+
+@pytest.fixture
+def db_file(tmpdir):
+    db_file = str(tmpdir.join("timetrack.db"))
+    connect(db_url="sqlite:///%s" % db_file)
+    with transaction() as session:
+        session.execute("INSERT INTO task (name) VALUES ('foo')")
+    yield db_file
+    connect(db_url="sqlite:///")
+
+
+def test_connect_enables_wal(db_file):
+    with transaction() as session:
+        assert session.execute("PRAGMA journal_mode").scalar() == "wal"
+
+
+def test_read_transaction(db_file):
+    with read_transaction() as session:
+        assert session.execute("SELECT name FROM task").scalar() == "foo"
+
+
+def test_read_transaction_is_read_only(db_file):
+    with pytest.raises(OperationalError):
+        with read_transaction() as session:
+            session.execute("INSERT INTO task (name) VALUES ('bar')")
+
+
+def test_read_transaction_does_not_block_writes(db_file):
+    with read_transaction() as reader:
+        assert reader.execute("SELECT COUNT(*) FROM task").scalar() == 1
+
+        with transaction() as writer:
+            writer.execute("INSERT INTO task (name) VALUES ('bar')")
+
+        # The reader keeps reading from its snapshot.
+        assert reader.execute("SELECT COUNT(*) FROM task").scalar() == 1
+
+    with read_transaction() as reader:
+        assert reader.execute("SELECT COUNT(*) FROM task").scalar() == 2
+
+
+def test_read_transaction_in_memory(session):
+    assert tt.sql._read_only is False
+    with read_transaction() as reader:
+        assert reader.execute("select 1").scalar() == 1
+
+
+def test_read_transaction_statistics(db_file):
+    statistics = enable_statistics()
+    try:
+        connect(db_url="sqlite:///%s" % db_file)
+        with read_transaction() as reader:
+            assert reader.execute("SELECT name FROM task").fetchall() == [("foo",)]
+    finally:
+        disable_statistics()
+
+    assert statistics.statements["SELECT name FROM task"]["rows"] == 1
+
+
+def _names(session):
+    return [name for name, in session.execute("SELECT name FROM task ORDER BY id")]
+
+
+def test_nested_transaction_commits_once(db_file):
+    with transaction() as outer:
+        with transaction() as inner:
+            assert inner is outer
+            inner.execute("INSERT INTO task (name) VALUES ('bar')")
+
+        # Not yet committed.
+        with read_transaction() as session:
+            assert _names(session) == ["foo", "bar"]
+        connection = sqlite3.connect(db_file)
+        assert connection.execute("SELECT COUNT(*) FROM task").fetchone() == (1,)
+        connection.close()
+
+    with read_transaction() as session:
+        assert _names(session) == ["foo", "bar"]
+
+
+def test_nested_transaction_rollback(db_file):
+    with pytest.raises(RuntimeError):
+        with transaction():
+            with transaction() as inner:
+                inner.execute("INSERT INTO task (name) VALUES ('bar')")
+            raise RuntimeError
+
+    with read_transaction() as session:
+        assert _names(session) == ["foo"]
+
+
+def test_after_commit(session):
+    calls = []
+
+    tt.sql.after_commit(lambda: calls.append("now"))
+    assert calls == ["now"]
+
+    def callback():
+        calls.append("later")
+
+    with transaction():
+        with transaction():
+            tt.sql.after_commit(callback)
+        tt.sql.after_commit(callback)
+        assert calls == ["now"]
+    assert calls == ["now", "later"]
+
+
+def test_after_commit_rollback(session):
+    calls = []
+
+    with pytest.raises(RuntimeError):
+        with transaction():
+            tt.sql.after_commit(lambda: calls.append("never"))
+            raise RuntimeError
+
+    with transaction():
+        pass
+    assert calls == []
@@ -0,0 +1,97 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+from datetime import datetime, timezone
+import json
+import os
+from unittest import mock
+
+import pytest
+
+import tt.reader
+import tt.state
+
+
+@pytest.fixture
+def paths(tmpdir):
+    state_file = str(tmpdir.join(tt.state.STATE_FILE))
+    db_file = str(tmpdir.join("timetrack2.db"))
+    with open(db_file, "w"):
+        pass
+    os.utime(db_file, (0, 0))
+    tt.state.configure(state_file)
+    return state_file, db_file
+
+
+def test_save_and_load(paths):
+    state_file, db_file = paths
+    start = datetime(2018, 2, 14, 9, 0, tzinfo=timezone.utc)
+
+    tt.state.save(tt.reader.TimerRow(1, "foo", start, None))
+
+    assert tt.state.load(state_file, db_file) == {
+        "id": 1,
+        "task": "foo",
+        "start": 1518598800,
+    }
+
+
+def test_save_no_active_timer(paths):
+    state_file, db_file = paths
+    tt.state.save(None)
+    assert tt.state.load(state_file, db_file) == {}
+
+
+def test_save_not_configured(tmpdir):
+    tt.state.configure(None)
+    tt.state.save(None)
+    assert not tmpdir.listdir()
+
+
+def test_save_error_removes_temporary_file(paths, tmpdir):
+    with mock.patch("json.dump", side_effect=ValueError):
+        with pytest.raises(ValueError):
+            tt.state.save(None)
+    assert [p.basename for p in tmpdir.listdir()] == ["timetrack2.db"]
+
+
+def test_load_missing(paths):
+    state_file, db_file = paths
+    assert tt.state.load(state_file, db_file) is None
+
+
+def test_load_stale(paths):
+    state_file, db_file = paths
+    tt.state.save(None)
+    os.utime(state_file, (0, 0))
+    os.utime(db_file, (1, 1))
+    assert tt.state.load(state_file, db_file) is None
+
+
+@pytest.mark.parametrize("content", ["{", "[]"])
+def test_load_invalid(paths, content):
+    state_file, db_file = paths
+    with open(state_file, "w") as out:
+        out.write(content)
+    assert tt.state.load(state_file, db_file) is None
+
+
+@pytest.mark.parametrize(
+    "state,expected",
+    [
+        ({}, ""),
+        ({"id": 1, "task": "foo", "start": 1000}, "foo 00:00"),
+        ({"id": 1, "task": "foo", "start": 1000 - 3600 - 61}, "foo 01:01"),
+        ({"id": 1, "task": "foo", "start": 1000 - 25 * 3600}, "foo 25:00"),
+        ({"id": 1, "task": "foo", "start": 2000}, "foo 00:00"),
+    ],
+)
+def test_format_prompt(state, expected):
+    assert tt.state.format_prompt(state, now=1000) == expected
+
+
+def test_state_file_is_json(paths):
+    state_file, _ = paths
+    tt.state.save(None)
+    with open(state_file) as in_:
+        assert json.load(in_) == {}
@@ -0,0 +1,83 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved
+
+import io
+import json
+
+import pytest
+
+import tt.profile
+import tt.sql
+import tt.stats
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    yield
+    tt.sql.disable_statistics()
+    tt.profile.disable()
+    tt.profile.reset()
+
+
+def test_collected_disabled():
+    out = io.StringIO()
+    with tt.stats.collected(False, stream=out):
+        assert tt.sql.statistics is None
+
+    assert out.getvalue() == ""
+
+
+def test_collected_table():
+    out = io.StringIO()
+    with tt.stats.collected(stream=out):
+        tt.sql.connect(db_url="sqlite:///")
+        with tt.sql.transaction() as session:
+            session.execute("select 1").fetchall()
+        with tt.profile.phase("dateparser"):
+            pass
+
+    assert tt.sql.statistics is None
+    text = out.getvalue()
+    assert "select 1" in text
+    assert "Date parsing" in text
+    assert "SQL execution" in text
+
+
+def test_collected_json(tmpdir):
+    output = str(tmpdir.join("stats.json"))
+    with tt.stats.collected(fmt="json", output=output):
+        tt.sql.connect(db_url="sqlite:///")
+        with tt.sql.transaction() as session:
+            session.execute("select 1 union select 2").fetchall()
+
+    with open(output) as in_:
+        data = json.load(in_)
+
+    statement = [s for s in data["statements"] if s["statement"].startswith("select")]
+    assert statement == [
+        {
+            "statement": "select 1 union select 2",
+            "count": 1,
+            "rows": 2,
+            "seconds": statement[0]["seconds"],
+        }
+    ]
+    assert data["sql"]["count"] >= 1
+    assert data["total"] > 0
+    assert "sql" in data["phases"]
+
+
+def test_write_table_truncates_statements():
+    data = {
+        "total": 1.0,
+        "phases": {"custom": 0.5, "render": 0.25},
+        "sql": {"count": 1, "rows": 0, "seconds": 0.1},
+        "statements": [{"statement": "x" * 100, "count": 1, "rows": 0, "seconds": 0.1}],
+    }
+    out = io.StringIO()
+    tt.stats.write_table(data, out)
+
+    text = out.getvalue()
+    assert "x" * 57 + "..." in text
+    assert "x" * 58 not in text
+    assert text.index("Table rendering") < text.index("custom")
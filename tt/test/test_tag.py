@@ -0,0 +1,74 @@
+# Copyright (C) 2018, Anthony Oteri
+# All rights reserved.
+
+from datetime import datetime, timezone
+
+import pytest
+
+from tt.exc import ValidationError
+import tt.meta
+import tt.tag
+from tt.orm import Tag, Task, Timer, TimerTag
+
+
+@pytest.fixture
+def timer(session):
+    session.add(Timer(id=1, task=Task(name="foo"), start=datetime.now(timezone.utc)))
+    session.commit()
+    return 1
+
+
+def _tags(session, timer_id):
+    return sorted(
+        name
+        for name, in session.query(Tag.name)
+        .join(TimerTag, TimerTag.tag_id == Tag.id)
+        .filter(TimerTag.timer_id == timer_id)
+    )
+
+
+def test_attach(session, timer):
+    version = tt.meta.get()
+
+    tt.tag.attach(timer, ["billable", "meeting"])
+
+    assert _tags(session, timer) == ["billable", "meeting"]
+    assert tt.meta.get() > version
+
+
+def test_attach_existing(session, timer):
+    tt.tag.attach(timer, ["billable"])
+    tt.tag.attach(timer, ["billable", "meeting", "meeting"])
+
+    assert session.query(Tag).count() == 2
+    assert _tags(session, timer) == ["billable", "meeting"]
+
+
+@pytest.mark.parametrize("timer_id,names", [(1, [""]), (2, ["billable"])])
+def test_attach_invalid(session, timer, timer_id, names):
+    with pytest.raises(ValidationError):
+        tt.tag.attach(timer_id, names)
+    assert session.query(Tag).count() == 0
+
+
+def test_detach(session, timer):
+    tt.tag.attach(timer, ["billable", "meeting"])
+
+    tt.tag.detach(timer, ["meeting"])
+
+    assert _tags(session, timer) == ["billable"]
+    assert session.query(Tag).count() == 2
+
+
+def test_detach_missing(session, timer):
+    with pytest.raises(ValidationError, match="No such tag meeting"):
+        tt.tag.detach(timer, ["meeting"])
+
+
+def test_lookup(session, timer):
+    tt.tag.attach(timer, ["meeting", "billable"])
+
+    assert tt.tag.lookup(["meeting", "billable"]) == [1, 2]
+    assert tt.tag.lookup([]) == []
+    with pytest.raises(ValidationError, match="No such tag other"):
+        tt.tag.lookup(["billable", "other"])
@@ -1,13 +1,19 @@
 # Copyright (C) 2018, Anthony Oteri.
 # All rights reserved
 
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import json
 
 import pytest
 
 from tt.exc import ValidationError
-from tt.task import create, get, update, remove, tasks
-from tt.orm import Task, Timer
+import tt.meta
+import tt.reader
+import tt.state
+import tt.sql
+import tt.task
+from tt.task import create, lookup, merge, move, update, remove
+from tt.orm import Task, TaskTree, Timer
 
 
 def test_create(session):
@@ -19,6 +25,121 @@ def test_create(session):
     assert results[0].description is None
 
 
+def _tree(session):
+    return [
+        (row.ancestor_id, row.descendant_id, row.depth, row.level)
+        for row in session.query(TaskTree).order_by(
+            TaskTree.descendant_id, TaskTree.depth
+        )
+    ]
+
+
+def test_create_with_parent(session):
+    create(name="acme")
+    create(name="web", parent="acme")
+    create(name="api", parent="web")
+
+    assert _tree(session) == [
+        (1, 1, 0, 1),
+        (2, 2, 0, 2),
+        (1, 2, 1, 1),
+        (3, 3, 0, 3),
+        (2, 3, 1, 2),
+        (1, 3, 2, 1),
+    ]
+
+
+def test_create_with_invalid_parent_raises(session):
+    with pytest.raises(ValidationError):
+        create(name="web", parent="acme")
+
+    assert session.query(Task).count() == 0
+
+
+def test_move(session):
+    for name in ("acme", "web", "api", "other"):
+        create(name=name)
+
+    move("web", parent="acme")
+    move("api", parent="web")
+    assert _tree(session) == [
+        (1, 1, 0, 1),
+        (2, 2, 0, 2),
+        (1, 2, 1, 1),
+        (3, 3, 0, 3),
+        (2, 3, 1, 2),
+        (1, 3, 2, 1),
+        (4, 4, 0, 1),
+    ]
+
+    # The subtasks move along, and keep their place under the task.
+    move("web", parent="other")
+    assert _tree(session) == [
+        (1, 1, 0, 1),
+        (2, 2, 0, 2),
+        (4, 2, 1, 1),
+        (3, 3, 0, 3),
+        (2, 3, 1, 2),
+        (4, 3, 2, 1),
+        (4, 4, 0, 1),
+    ]
+
+    move("web")
+    assert _tree(session) == [
+        (1, 1, 0, 1),
+        (2, 2, 0, 1),
+        (3, 3, 0, 2),
+        (2, 3, 1, 1),
+        (4, 4, 0, 1),
+    ]
+    assert tt.meta.get() == 8
+
+
+@pytest.mark.parametrize(
+    "name,parent",
+    [("acme", "web"), ("acme", "acme"), ("nosuch", None), ("acme", "nosuch")],
+)
+def test_move_invalid_raises(session, name, parent):
+    create(name="acme")
+    create(name="web", parent="acme")
+
+    with pytest.raises(ValidationError):
+        move(name, parent=parent)
+
+    assert _tree(session) == [(1, 1, 0, 1), (2, 2, 0, 2), (1, 2, 1, 1)]
+
+
+def test_move_rolls_up_existing_timers(session):
+    start = datetime(2018, 2, 14, 9, tzinfo=timezone.utc)
+    create(name="acme")
+    create(name="acme-web")
+    session.add(Timer(task_id=2, start=start, stop=start + timedelta(hours=1)))
+    session.commit()
+
+    move("acme-web", parent="acme")
+
+    groups = tt.reader.aggregate(
+        ("task",), start, start + timedelta(days=1), start, rollup=1
+    )
+    assert [(key, measures.elapsed) for key, measures in groups] == [(("acme",), 3600)]
+
+
+def test_move_statement_count_is_constant(session, count_statements):
+    create(name="root")
+    create(name="other")
+    parent = "root"
+    for depth in range(10):
+        create(name="sub%d" % depth, parent=parent)
+        parent = "sub%d" % depth
+
+    counts = []
+    for name in ("sub9", "root"):
+        with count_statements() as counter:
+            move(name, parent="other")
+        counts.append(counter.count)
+    assert counts[0] == counts[1]
+
+
 def test_create_with_description(session):
     create(name="foo", description="Foobar")
 
@@ -45,11 +166,14 @@ def test_create_invalid_name_raises(session, name):
         create(name=name)
 
 
-def test_get_task(session):
+def test_create_task(session):
     create(name="foo")
-    task = get(name="foo")
-    assert task.id == 1
-    assert task.name == "foo"
+    assert [(task.id, task.name) for task in tt.reader.tasks()] == [(1, "foo")]
+
+
+def test_update_missing_task_raises(session):
+    with pytest.raises(ValidationError, match="No such task 1"):
+        update(1, description="Foo")
 
 
 def test_rename_task(session):
@@ -102,6 +226,17 @@ def test_remove(session):
         assert session.query(Task).filter(Task.name == name).count() == 1
 
 
+def test_remove_subtask(session):
+    create(name="acme")
+    create(name="web", parent="acme")
+
+    with pytest.raises(ValidationError):
+        remove("acme")
+
+    remove("web")
+    assert _tree(session) == [(1, 1, 0, 1)]
+
+
 @pytest.mark.parametrize("name", ["buzz", None, ""])
 def test_remove_invalid_task_raises(session, name):
 
@@ -134,10 +269,213 @@ def test_remove_task_with_timers_raises(session):
         remove("foo")
 
 
+@pytest.fixture
+def duplicates(session):
+    """Three timers of duplicate tasks, the last running."""
+    start = datetime(2018, 2, 14, 9, tzinfo=timezone.utc)
+    tasks = {name: Task(name=name) for name in ["meeting", "meetings", "mtg"]}
+    session.add_all(
+        [
+            Timer(task=tasks["meetings"], start=start, stop=start.replace(hour=10)),
+            Timer(task=tasks["meeting"], start=start.replace(hour=11)),
+            Timer(
+                task=tasks["mtg"],
+                start=start.replace(hour=10),
+                stop=start.replace(hour=11),
+            ),
+        ]
+    )
+    session.commit()
+
+
+def test_merge(session, duplicates):
+    version = tt.meta.get()
+    lookup("mtg")
+
+    assert merge(["meetings", "mtg", "meetings"], "meeting") == 2
+
+    session.expire_all()
+    (task,) = session.query(Task).all()
+    assert task.name == "meeting"
+    assert len(task.timers) == 3
+    assert tt.meta.get() == version + 1
+    assert lookup("mtg") is None
+
+
+@pytest.mark.parametrize(
+    "names,into", [(["meeting"], "meeting"), (["nope"], "meeting"), (["mtg"], "nope")]
+)
+def test_merge_invalid_raises(names, into, session, duplicates):
+    with pytest.raises(ValidationError):
+        merge(names, into)
+
+    assert session.query(Task).count() == 3
+
+
+def test_merge_subtasks(session, duplicates):
+    create(name="client")
+    create(name="web", parent="client")
+
+    with pytest.raises(ValidationError):
+        merge(["meetings", "client"], "meeting")
+
+    merge(["web"], "meeting")
+    assert _tree(session) == [(4, 4, 0, 1)]
+
+
+def test_merge_updates_state_file(session, duplicates, tmpdir):
+    state_file = tmpdir.join("state.json")
+    tt.state.configure(str(state_file))
+
+    merge(["meeting"], "mtg")
+
+    assert json.loads(state_file.read())["task"] == "mtg"
+
+
+def test_merge_statement_count_is_constant(session, duplicates, count_statements):
+    session.add_all(
+        Timer(task_id=2, start=datetime(2018, 1, day, tzinfo=timezone.utc))
+        for day in range(1, 29)
+    )
+    session.commit()
+
+    with count_statements() as counter:
+        merge(["meetings", "mtg"], "meeting")
+    assert counter.count <= 10
+
+
 def test_all(session):
 
     names = ["foo", "bar", "baz", "boom"]
     session.add_all([Task(name=n) for n in names])
+    session.commit()
+
+    assert [task.name for task in tt.reader.tasks()] == names
+
+
+def test_writes_bump_data_version(session):
+    create(name="foo")
+    assert tt.meta.get() == 1
+
+    update(1, description="bar")
+    assert tt.meta.get() == 2
+
+    remove(name="foo")
+    assert tt.meta.get() == 3
+
+
+def test_rename_updates_state_file(session, tmpdir):
+    state_file = tmpdir.join("state.json")
+    tt.state.configure(str(state_file))
+    task = Task(name="foo")
+    session.add(Timer(task=task, start=datetime(2018, 2, 14, tzinfo=timezone.utc)))
+    session.commit()
+
+    update(task.id, name="bar")
+
+    assert json.loads(state_file.read())["task"] == "bar"
+
+
+def test_lookup(session):
+    create(name="foo")
+    create(name="bar")
+
+    assert lookup("foo") == 1
+    assert lookup("bar") == 2
+    assert lookup("baz") is None
+
+
+def test_lookup_loads_tasks_once(session, count_statements):
+    create(name="foo")
+    create(name="bar")
+    lookup("foo")
+
+    with count_statements() as counter:
+        assert lookup("foo") == 1
+        assert lookup("bar") == 2
+    assert counter.count == 0
+
+
+def test_lookup_follows_changes(session, count_statements):
+    create(name="foo")
+    create(name="bar")
+    lookup("foo")
+
+    create(name="baz")
+    update(1, name="fizz")
+    remove(name="bar")
+
+    with count_statements() as counter:
+        assert lookup("baz") == 3
+        assert lookup("fizz") == 1
+    assert counter.count == 0
+    assert lookup("foo") is None
+    assert lookup("bar") is None
+
+
+def test_lookup_finds_tasks_created_elsewhere(session):
+    create(name="foo")
+    lookup("foo")
+
+    session.add(Task(name="bar"))
+    session.commit()
+
+    assert lookup("bar") == 2
+
+
+def test_lookup_within_transaction(session):
+    create(name="foo")
+    lookup("foo")
+
+    with pytest.raises(RuntimeError):
+        with tt.sql.transaction():
+            update(1, name="bar")
+            create(name="foo")
+            assert lookup("foo") == 2
+            assert lookup("bar") == 1
+            raise RuntimeError()
+
+    assert lookup("foo") == 1
+    assert lookup("bar") is None
+
+
+def test_lookup_reloads_after_connect(session):
+    create(name="foo")
+    lookup("foo")
+
+    tt.sql.connect(db_url="sqlite:///")
+
+    assert lookup("foo") is None
+
+
+def test_matching(session):
+    for name in ("client-a", "client-b", "internal", "Client-c"):
+        create(name=name)
+
+    assert tt.task.matching("client-*") == [1, 2]
+    assert tt.task.matching("*a*") == [1, 3]
+    assert tt.task.matching("nope*") == []
+
+
+def test_matching_refreshes_lookup(session, count_statements):
+    create(name="foo")
+    lookup("foo")
+    session.add(Task(name="bar"))
+    session.commit()
+
+    assert tt.task.matching("b*") == [2]
+    with count_statements() as counter:
+        assert lookup("bar") == 2
+    assert counter.count == 0
+
+
+def test_matching_within_transaction(session):
+    create(name="foo")
+
+    with pytest.raises(RuntimeError):
+        with tt.sql.transaction():
+            create(name="fizz")
+            assert tt.task.matching("f*") == [1, 2]
+            raise RuntimeError()
 
-    for expected_name, task in zip(names, tasks()):
-        assert task.name == expected_name
+    assert lookup("fizz") is None
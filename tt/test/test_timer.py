@@ -2,12 +2,21 @@
 # All rights reserved.
 
 from datetime import datetime, timedelta, timezone
+import json
+import sqlite3
 
 import pytest
+from sqlalchemy import event
 
+import tt.datetime
 from tt.exc import ValidationError
+import tt.meta
+import tt.sql
+import tt.state
+import tt.tag
+import tt.task
 import tt.timer
-from tt.orm import Task, Timer
+from tt.orm import Tag, Task, Timer, TimerTag
 
 
 @pytest.fixture
@@ -31,6 +40,35 @@ def test_create(session, task):
     assert timer.running
 
 
+def test_create_tags(session, task):
+    session.add(task)
+    session.commit()
+
+    tt.timer.create(task=task.name, start=datetime.now(timezone.utc), tags=["a", "b"])
+
+    assert sorted(tag.name for tag in session.query(Tag)) == ["a", "b"]
+    assert session.query(TimerTag).filter(TimerTag.timer_id == 1).count() == 2
+
+
+@pytest.mark.parametrize("note,expected", [("Planning", "Planning"), ("", None)])
+def test_create_note(note, expected, session, task):
+    session.add(task)
+    session.commit()
+
+    tt.timer.create(task=task.name, start=datetime.now(timezone.utc), note=note)
+
+    assert session.query(Timer).get(1).note == expected
+
+
+def test_create_empty_tag_raises(session, task):
+    session.add(task)
+    session.commit()
+
+    with pytest.raises(ValidationError):
+        tt.timer.create(task=task.name, start=datetime.now(timezone.utc), tags=[""])
+    assert session.query(Timer).count() == 0
+
+
 def test_create_start_in_the_future_raises(session, task):
     session.add(task)
 
@@ -49,7 +87,7 @@ def test_create_invalid_task_raises(session):
 def test_create_second_timer_stops_first(session, task):
     session.add(task)
 
-    now = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
 
     one_hour_ago = now - timedelta(hours=1)
     two_hours_ago = now - timedelta(hours=2)
@@ -73,6 +111,71 @@ def test_create_second_timer_stops_first(session, task):
     assert timer_one.stop == timer_two.start
 
 
+@pytest.fixture
+def day(session, task):
+    """Two stopped timers, from 9:00 to 10:00 and 11:00 to 12:00 yesterday."""
+    session.add(task)
+    morning = datetime.now(timezone.utc).replace(
+        hour=9, minute=0, second=0, microsecond=0
+    ) - timedelta(days=1)
+    session.add_all(
+        [
+            Timer(task=task, start=morning, stop=morning + timedelta(hours=1)),
+            Timer(
+                task=task,
+                start=morning + timedelta(hours=2),
+                stop=morning + timedelta(hours=3),
+            ),
+        ]
+    )
+    session.commit()
+    return morning
+
+
+def test_create_overlapping_raises(session, task, day):
+    with pytest.raises(ValidationError, match="Overlaps timer 2"):
+        tt.timer.create(task=task.name, start=day + timedelta(hours=1, minutes=30))
+    assert session.query(Timer).count() == 2
+
+
+def test_create_after_last(session, task, day):
+    tt.timer.create(task=task.name, start=day + timedelta(hours=3))
+    assert session.query(Timer).count() == 3
+
+
+@pytest.mark.parametrize(
+    "start,stop,message",
+    [
+        (timedelta(minutes=30), None, "Overlaps timer 1"),
+        (timedelta(hours=1, minutes=30), timedelta(hours=2, minutes=1), "timer 2"),
+        (timedelta(hours=1, minutes=30), timedelta(hours=4), "timer 2"),
+    ],
+)
+def test_update_overlapping_raises(session, day, start, stop, message):
+    timer = Timer(
+        task_id=1,
+        start=day + timedelta(hours=1, minutes=10),
+        stop=day + timedelta(hours=1, minutes=20),
+    )
+    session.add(timer)
+    session.commit()
+
+    with pytest.raises(ValidationError, match=message):
+        tt.timer.update(timer.id, start=day + start, stop=day + stop if stop else None)
+
+
+def test_update_adjacent(session, day):
+    tt.timer.update(1, stop=day + timedelta(hours=2))
+    tt.timer.update(2, start=day + timedelta(hours=2))
+
+    assert session.query(Timer).get(1).stop == session.query(Timer).get(2).start
+
+
+def test_update_make_active_overlapping_raises(session, day):
+    with pytest.raises(ValidationError, match="Overlaps timer 2"):
+        tt.timer.update(1, stop="")
+
+
 def test_update_timer_task(session):
 
     old_task = Task(name="old")
@@ -97,11 +200,16 @@ def test_update_timer_invalid_task_raises(session, task):
         tt.timer.update(1, task="invalid_task_name")
 
 
+def test_update_missing_timer_raises(session):
+    with pytest.raises(ValidationError, match="No such timer 1"):
+        tt.timer.update(1, stop=datetime.now(timezone.utc))
+
+
 def test_update_time_start(session, task):
 
     session.add(task)
 
-    now = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
     one_hour_ago = now - timedelta(hours=1)
     two_hours_ago = now - timedelta(hours=2)
 
@@ -139,7 +247,7 @@ def test_update_time_stop(session, task):
 
     session.add(task)
 
-    now = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
     one_hour_ago = now - timedelta(hours=1)
     two_hours_ago = now - timedelta(hours=2)
 
@@ -199,65 +307,98 @@ def test_remove(session, task):
     assert session.query(Timer).count() == 0
 
 
-def test_active_running(session, task):
+def test_remove_untags(session, task):
     session.add(task)
+    session.commit()
+    tt.timer.create(task=task.name, start=datetime.now(timezone.utc), tags=["a"])
 
-    session.add(Timer(task=task, start=datetime.now(timezone.utc)))
-
-    cur = tt.timer.active()
+    tt.timer.remove(1)
 
-    assert cur is not None
-    assert cur.id == 1
+    assert session.query(TimerTag).count() == 0
+    assert session.query(Tag).count() == 1
 
 
-def test_active_stopped(session, task):
-    session.add(task)
+@pytest.mark.parametrize("dry_run,expected", [(False, "bar"), (True, "foo")])
+def test_retag(dry_run, expected, session, day):
+    session.add(Task(name="bar"))
+    session.commit()
+    version = tt.meta.get()
 
-    session.add(
-        Timer(
-            task=task, start=datetime.now(timezone.utc), stop=datetime.now(timezone.utc)
-        )
+    count = tt.timer.retag(
+        "foo", "bar", day + timedelta(hours=2), day + timedelta(days=1), dry_run
     )
 
-    assert tt.timer.active() is None
+    assert count == 1
+    session.expire_all()
+    assert [timer.task.name for timer in session.query(Timer).order_by(Timer.id)] == [
+        "foo",
+        expected,
+    ]
+    assert (tt.meta.get() > version) != dry_run
 
 
-def test_last(session, task):
-    session.add(task)
-    timers = [
-        Timer(task=task, start=datetime.now(timezone.utc) + timedelta(hours=i))
-        for i in range(-5, 0)
-    ]
-    session.add_all(timers)
+@pytest.mark.parametrize(
+    "old_name,new_name", [("foo", "foo"), ("foo", "baz"), ("baz", "foo")]
+)
+def test_retag_invalid(old_name, new_name, session, day):
+    with pytest.raises(ValidationError):
+        tt.timer.retag(old_name, new_name, day, day + timedelta(days=1))
 
-    last = tt.timer.last()
-    assert last is not None
-    assert last["id"] == 5
-    assert last["task"] == task.name
 
+def test_retag_none(session, day):
+    session.add(Task(name="bar"))
+    session.commit()
+    version = tt.meta.get()
 
-def test_last_empty_db(session, task):
-    session.add(task)
-    last = tt.timer.last()
-    assert last is None
+    assert tt.timer.retag("foo", "bar", day - timedelta(days=1), day) == 0
+    assert tt.meta.get() == version
 
 
-def test_timers(session, task):
-    session.add(task)
+@pytest.mark.parametrize("dry_run,expected", [(False, 0), (True, 2)])
+def test_remove_range(dry_run, expected, session, day):
+    count = tt.timer.remove_range("foo", day, day + timedelta(days=1), dry_run)
+
+    assert count == 2
+    assert session.query(Timer).count() == expected
 
-    now = datetime.now(timezone.utc)
-    duration = timedelta(hours=1)
 
-    for hours in range(100, 0, -1):
-        offset = timedelta(hours=hours)
-        start = now - offset - duration
-        stop = start + duration
-        session.add(Timer(task=task, start=start, stop=stop))
+def test_remove_range_untags(session, day):
+    tt.tag.attach(1, ["a"])
+    tt.tag.attach(2, ["a"])
 
-    assert session.query(Timer).count() == 100
+    tt.timer.remove_range("foo", day, day + timedelta(hours=1))
 
-    timers_ = tt.timer.timers()
-    assert len(list(timers_)) == 100
+    assert [row.timer_id for row in session.query(TimerTag)] == [2]
+
+
+def test_remove_range_running(session, day, task):
+    session.add(Timer(task=task, start=day + timedelta(hours=4)))
+    session.commit()
+
+    with pytest.raises(ValidationError):
+        tt.timer.remove_range("foo", day, day + timedelta(days=1))
+
+    assert session.query(Timer).count() == 3
+    assert tt.timer.remove_range("foo", day, day + timedelta(hours=4)) == 2
+
+
+def test_remove_range_uses_index(session, day):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, many):
+        statements.append((statement, parameters))
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        tt.timer.remove_range("foo", day, day + timedelta(days=1))
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    for statement, parameters in statements:
+        if "timer" in statement and "meta" not in statement:
+            plan = engine.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            assert "ix_timer_task_id_start" in " ".join(row[-1] for row in plan)
 
 
 @pytest.mark.parametrize("running", [False, True])
@@ -293,24 +434,139 @@ def test_validate_stop_in_future():
         tt.timer._validate(Timer(start=start, stop=stop))
 
 
-def test_slice(session, task):
+def test_validate_frozen_clock():
+    instant = datetime(2018, 2, 14, 9, tzinfo=timezone.utc)
+
+    with tt.datetime.frozen(instant):
+        tt.timer._validate(Timer(start=instant))
+        with pytest.raises(AssertionError):
+            tt.timer._validate(Timer(start=instant + timedelta(seconds=1)))
+
 
+def test_writes_bump_data_version(session, task):
     session.add(task)
 
     now = datetime.now(timezone.utc)
-    duration = timedelta(hours=1)
 
-    for hours in range(100, 0, -1):
-        offset = timedelta(hours=hours)
-        start = now - offset - duration
-        stop = start + duration
-        session.add(Timer(task=task, start=start, stop=stop))
+    tt.timer.create(task=task.name, start=now - timedelta(hours=1))
+    assert tt.meta.get() == 1
+
+    tt.timer.update(1, stop=now)
+    assert tt.meta.get() == 2
+
+    tt.timer.remove(1)
+    assert tt.meta.get() == 3
+
+
+def test_writes_save_state(session, task, tmpdir):
+    state_file = tmpdir.join("state.json")
+    tt.state.configure(str(state_file))
+    session.add(task)
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start = now - timedelta(hours=1)
+
+    tt.timer.create(task=task.name, start=start)
+    assert json.loads(state_file.read()) == {
+        "id": 1,
+        "task": "foo",
+        "start": start.timestamp(),
+    }
+
+    tt.timer.update(1, stop=now)
+    assert json.loads(state_file.read()) == {}
+
+    tt.timer.update(1, stop="")
+    assert json.loads(state_file.read())["id"] == 1
+
+    tt.timer.remove(1)
+    assert json.loads(state_file.read()) == {}
+
+
+def test_writes_without_state_file(session, task, tmpdir):
+    session.add(task)
+    tt.timer.create(task=task.name, start=datetime.now(timezone.utc))
+    assert tt.state.filename is None
+
+
+def test_create_looks_up_task_once(session, count_statements):
+    tt.task.create("foo")
+    start = datetime.now(timezone.utc).replace(microsecond=0)
+    tt.timer.create(task="foo", start=start - timedelta(hours=2))
+
+    with count_statements() as counter:
+        tt.timer.create(task="foo", start=start - timedelta(hours=1))
+
+    # The registered id is only confirmed, by primary key.
+    assert counter.selects("task") == 1
+    assert any(
+        "WHERE task.id = ? AND task.name = ?" in shape
+        for shape in counter.statistics.statements
+    )
+
+
+@pytest.fixture
+def other_process(tmpdir):
+    """Connect to a database file, returning a function which runs SQL on a
+    separate connection, as another process would."""
+    db_file = str(tmpdir.join("timetrack.db"))
+    tt.sql.connect(db_url="sqlite:///%s" % db_file)
+
+    def execute(*statements):
+        with sqlite3.connect(db_file) as other:
+            for statement in statements:
+                other.execute(statement)
+        other.close()
+
+    yield execute
+    tt.sql.connect(db_url="sqlite:///")
+
+
+def _timers():
+    with tt.sql.transaction() as session:
+        return [tuple(row) for row in session.execute("SELECT id, task_id FROM timer")]
+
+
+def test_create_task_merged_by_other_process(other_process):
+    tt.task.create("foo")
+    tt.task.create("bar")
+    assert tt.task.lookup("foo") == 1
+
+    other_process(
+        "DELETE FROM task_tree WHERE descendant_id = 1", "DELETE FROM task WHERE id = 1"
+    )
+
+    start = datetime.now(timezone.utc) - timedelta(hours=1)
+    with pytest.raises(ValidationError):
+        tt.timer.create(task="foo", start=start)
+    assert _timers() == []
+    assert tt.task.lookup("foo") is None
+
+
+def test_create_task_replaced_by_other_process(other_process):
+    tt.task.create("foo")
+    assert tt.task.lookup("foo") == 1
+
+    other_process(
+        "UPDATE task SET name = 'old' WHERE id = 1",
+        "INSERT INTO task (id, name) VALUES (2, 'foo')",
+    )
+
+    start = datetime.now(timezone.utc) - timedelta(hours=1)
+    tt.timer.create(task="foo", start=start)
+    assert _timers() == [(1, 2)]
+
 
-    start = now - timedelta(hours=24)
+def test_retag_task_removed_by_other_process(other_process):
+    tt.task.create("foo")
+    tt.task.create("bar")
+    start = datetime.now(timezone.utc) - timedelta(hours=2)
+    tt.timer.create(task="foo", start=start)
+    tt.timer.update(1, stop=start + timedelta(hours=1))
+    assert tt.task.lookup("bar") == 2
 
-    slice_ = list(tt.timer.slice(start=start, end=now))
-    assert len(slice_) == 23
+    other_process("DELETE FROM task WHERE id = 2")
 
-    for s in slice_:
-        assert s["start"] >= start
-        assert s["start"] < now
+    with pytest.raises(ValidationError, match="No such task bar"):
+        tt.timer.retag("foo", "bar", start, start + timedelta(days=1))
+    assert _timers() == [(1, 1)]
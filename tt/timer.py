@@ -1,42 +1,78 @@
 # Copyright (C) 2018, Anthony Oteri
 # All rights reserved.
 
-from datetime import datetime, timezone
+from datetime import timedelta
 import logging
 
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy import and_, bindparam, func, select
 
+import tt.datetime
 from tt.exc import ValidationError
-from tt.orm import Task, Timer
+import tt.meta
+from tt.orm import Timer, TimerTag
+import tt.reader
+import tt.sql
 from tt.sql import transaction
+import tt.state
+import tt.tag
+import tt.task
 
 log = logging.getLogger(__name__)
 
+_timer = Timer.__table__
 
-def create(task, start):
+# The timers of a task started within a time range, for the bulk changes.
+# The selection is a single range of the ix_timer_task_id_start index.
+_selected = and_(
+    _timer.c.task_id == bindparam("from_id"),
+    _timer.c.start >= bindparam("begin"),
+    _timer.c.start < bindparam("end"),
+)
+_COUNT = select([func.count(), func.count(_timer.c.stop)]).where(_selected)
+_RETAG = _timer.update().where(_selected).values(task_id=bindparam("to_id"))
+_DELETE = _timer.delete().where(_selected)
+
+_timer_tag = TimerTag.__table__
+_UNTAG = _timer_tag.delete().where(
+    _timer_tag.c.timer_id.in_(select([_timer.c.id]).where(_selected))
+)
+
+
+def create(task, start, tags=None, note=None):
     """Create a new timer for the given task.
 
     :param str: task: The name of an existing task.
     :param datetime.datetime start: The UTC starting time.
+    :param tags: The names of the tags of the timer, see tt.tag.attach().
+                 (Default value = None)
+    :param note: A free-text note, indexed for tt.reader.search().
+                 (Default value = None)
     :raises: ValidationError If the timer fails to validate.
     """
 
     with transaction() as session:
-        try:
-            task = session.query(Task).filter(Task.name == task).one()
-        except NoResultFound:
+        task_id = tt.task.resolve(session, task)
+        if task_id is None:
             raise ValidationError("Invalid task %s" % task)
 
         for active in session.query(Timer).filter(Timer.stop.is_(None)).all():
             active.stop = start
 
         try:
-            timer = Timer(task=task, start=start)
+            timer = Timer(task_id=task_id, start=start, note=note or None)
             _validate(timer)
+            _check_overlap(session, timer)
             session.add(timer)
+            tt.meta.bump(session)
         except AssertionError as err:
             raise ValidationError(err)
 
+        if tags:
+            session.flush()
+            tt.tag.attach(timer.id, tags)
+
+    tt.sql.after_commit(save_state)
+
 
 def update(id, task=None, start=None, stop=None):
     """
@@ -46,18 +82,17 @@ def update(id, task=None, start=None, stop=None):
     :param task:  The new task name. (Default value = None)
     :param start:  The new start time. (Default value = None)
     :param stop:  The new stop time. (Default value = None)
-    :raises: ValidationError if the timer fails validation checks.
+    :raises: ValidationError if there is no such timer, or the timer fails
+             validation checks.
     """
     with transaction() as session:
         try:
             timer = session.query(Timer).get(id)
+            if timer is None:
+                raise ValidationError("No such timer %s" % id)
 
             if task is not None:
-                try:
-                    task = session.query(Task).filter(Task.name == task).one()
-                except NoResultFound:
-                    raise ValidationError("No such task %s" % task)
-                timer.task = task
+                timer.task_id = _lookup(session, task)
 
             if start is not None:
                 timer.start = start
@@ -69,30 +104,76 @@ def update(id, task=None, start=None, stop=None):
                     timer.stop = stop
 
             _validate(timer)
+            _check_overlap(session, timer)
+            tt.meta.bump(session)
 
         except AssertionError as err:
             raise ValidationError("Invalid timer %s: %s" % (timer, err))
 
+    tt.sql.after_commit(save_state)
+
 
 def _validate(timer):
     """Validate time constraints on a timer.
 
+    Overlaps with other timers are checked by _check_overlap().
+
     The following conditions must hold true:
 
         * The start time must be in the past
         * If there is a stop time, it must be in the past
         * If there is a stop time, the start time must come first
 
+    The present is the second of tt.datetime.utc_now(), which is truncated
+    to the second and may be frozen.
+
     :param timer:  The timer to validate.
     :raises: AssertionError if the validation conditions are not met.
     """
 
-    now = datetime.now(timezone.utc)
+    future = tt.datetime.utc_now() + timedelta(seconds=1)
     if timer.running:
-        assert timer.start < now, "Start time in the future"
+        assert timer.start < future, "Start time in the future"
     else:
         assert timer.start < timer.stop, "Start time after stop time"
-        assert timer.stop <= now, "Stop time in the future"
+        assert timer.stop < future, "Stop time in the future"
+
+
+def _check_overlap(session, timer):
+    """Check that a timer does not overlap any other timer.
+
+    As long as the other timers do not overlap each other, only the two
+    neighbors of the timer by start time need to be checked: the timer
+    started last at or before it, and the timer started first at or after
+    it.  Each is found with a single seek of the ix_timer_start_id index.
+
+    :param session: The session of the current transaction.
+    :param timer: The new or changed timer.
+    :raises: AssertionError if the timer overlaps another timer.
+    """
+    others = session.query(Timer.id, Timer.start, Timer.stop)
+    if timer.id is not None:
+        others = others.filter(Timer.id != timer.id)
+
+    before = (
+        others.filter(Timer.start <= timer.start)
+        .order_by(Timer.start.desc(), Timer.id.desc())
+        .first()
+    )
+    if before is not None:
+        assert before.stop is not None and before.stop <= timer.start, (
+            "Overlaps timer %d" % before.id
+        )
+
+    after = (
+        others.filter(Timer.start >= timer.start)
+        .order_by(Timer.start, Timer.id)
+        .first()
+    )
+    if after is not None:
+        assert timer.stop is not None and timer.stop <= after.start, (
+            "Overlaps timer %d" % after.id
+        )
 
 
 def remove(id):
@@ -102,36 +183,87 @@ def remove(id):
     :param id: The id of the timer to delete.
     """
     with transaction() as session:
+        session.query(TimerTag).filter(TimerTag.timer_id == id).delete()
         session.query(Timer).filter(Timer.id == id).delete()
+        tt.meta.bump(session)
+
+    tt.sql.after_commit(save_state)
 
 
-def active():
-    """Fetch the active timer if there is one, or None if not."""
+def retag(task, new_task, start, end, dry_run=False):
+    """
+    Move the timers of a task started within a time range to another task.
+
+    The timers are counted and changed by one statement each, however many
+    there are.  Their times are unchanged, so they need no validation.
+
+    :param task: The name of the task of the timers.
+    :param new_task: The name of the task to move them to.
+    :param start: The UTC starting time (inclusive).
+    :param end: The UTC ending time (exclusive).
+    :param dry_run: If True, only count the timers. (Default value = False)
+    :returns: The number of timers moved, or which would be moved.
+    :raises: ValidationError if either task does not exist, or they are the
+             same task.
+    """
     with transaction() as session:
-        return session.query(Timer).filter(Timer.stop.is_(None)).one_or_none()
+        from_id = _lookup(session, task)
+        to_id = _lookup(session, new_task)
+        if from_id == to_id:
+            raise ValidationError("Cannot move timers to the same task %s" % task)
+
+        params = {"from_id": from_id, "begin": start, "end": end}
+        count, _ = session.execute(_COUNT, params).first()
+        if dry_run or not count:
+            return count
 
+        session.execute(_RETAG, dict(params, to_id=to_id))
+        tt.meta.bump(session)
 
-def last():
-    """Fetch the last timer, active or not.
+    tt.sql.after_commit(save_state)
+    return count
 
-    :return dict: The dictionary represenation of the timer or None
+
+def remove_range(task, start, end, dry_run=False):
+    """
+    Remove the timers of a task started within a time range.
+
+    The timers are counted and removed by one statement each, however many
+    there are.
+
+    :param task: The name of the task of the timers.
+    :param start: The UTC starting time (inclusive).
+    :param end: The UTC ending time (exclusive).
+    :param dry_run: If True, only count the timers. (Default value = False)
+    :returns: The number of timers removed, or which would be removed.
+    :raises: ValidationError if the task does not exist, or the running
+             timer is among the timers.
     """
     with transaction() as session:
-        result = session.query(Timer).order_by(Timer.start.desc()).first()
+        params = {"from_id": _lookup(session, task), "begin": start, "end": end}
+        count, stopped = session.execute(_COUNT, params).first()
+        if count != stopped:
+            raise ValidationError("Cannot remove the running timer")
+        if dry_run or not count:
+            return count
 
-        return result.as_dict() if result else None
+        session.execute(_UNTAG, params)
+        session.execute(_DELETE, params)
+        tt.meta.bump(session)
 
+    return count
 
-def timers():
-    """Generator for iterating over all timers."""
-    with transaction() as session:
-        for timer in session.query(Timer).all():
-            yield timer
 
+def _lookup(session, task):
+    """Look up the id of a task by name within a write transaction, which
+    must exist."""
+    task_id = tt.task.resolve(session, task)
+    if task_id is None:
+        raise ValidationError("No such task %s" % task)
+    return task_id
 
-def slice(start, end):
-    with transaction() as session:
-        for timer in (
-            session.query(Timer).filter(start <= Timer.start, Timer.start < end).all()
-        ):
-            yield timer.as_dict()
+
+def save_state():
+    """Record the active timer in the state file, if one is configured."""
+    if tt.state.filename is not None:
+        tt.state.save(tt.reader.active())